@@ -0,0 +1,2 @@
+"""Benchmarks for the transcription service, run from the repository root with
+`python -m benchmarks.<name>`"""
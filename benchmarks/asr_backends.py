@@ -0,0 +1,136 @@
+"""
+Real-time factor of each ASR backend on the same audio.
+
+Every backend registered in ASR_BACKENDS is loaded in turn and runs on the same
+waveform twice: whole, through infer, and cut into diarizer-like segments,
+through infer_batch. The real-time factor is processing time over audio
+duration, lower is better. Each backend needs a model in its own format:
+
+    python -m benchmarks.asr_backends \
+        --model-dir hf=pretrained_models/whisper-small \
+        --model-dir ctranslate2=pretrained_models/faster-whisper-small \
+        --audio sample.wav --device cpu
+"""
+
+import argparse
+import json
+import logging
+from time import perf_counter
+
+import numpy as np
+
+from codes.asr_inference_service.asr_model import ASR_BACKENDS, build_asr_model
+from codes.asr_inference_service.audio_ingest import load_audio
+
+logging.basicConfig(
+    format="%(levelname)s | %(asctime)s | %(message)s", level=logging.INFO
+)
+
+
+def make_audio(seconds: float, sample_rate: int, seed: int = 0) -> np.ndarray:
+    """
+    Generate tone bursts separated by short pauses, when no --audio is given
+    """
+    rng = np.random.default_rng(seed)
+    parts = []
+    total = 0
+    while total < seconds * sample_rate:
+        length = int(rng.uniform(1.0, 12.0) * sample_rate)
+        t = np.arange(length, dtype=np.float32) / sample_rate
+        parts.append(0.1 * np.sin(2 * np.pi * rng.uniform(120, 300) * t))
+        parts.append(np.zeros(int(0.3 * sample_rate), dtype=np.float32))
+        total += length + int(0.3 * sample_rate)
+    noise = 0.01 * rng.standard_normal(total)
+    return (np.concatenate(parts) + noise).astype(np.float32)
+
+
+def run_backend(backend: str, model_dir: str, waveform: np.ndarray, args) -> dict:
+    """Load one backend and time it on the whole waveform and on its segments"""
+    load_start = perf_counter()
+    asr = build_asr_model(
+        backend, model_dir, args.sample_rate, args.device, args.compute_type
+    )
+    load_seconds = perf_counter() - load_start
+
+    duration = len(waveform) / args.sample_rate
+    segment_samples = int(args.segment_seconds * args.sample_rate)
+    segments = [
+        waveform[start : start + segment_samples]
+        for start in range(0, len(waveform), segment_samples)
+    ]
+
+    # Warm up so the first timed call does not pay for lazy initialisation
+    asr.infer(segments[0], args.sample_rate)
+
+    infer_start = perf_counter()
+    asr.infer(waveform, args.sample_rate)
+    infer_seconds = perf_counter() - infer_start
+
+    batch_start = perf_counter()
+    asr.infer_batch(segments, args.sample_rate, batch_size=args.batch_size)
+    batch_seconds = perf_counter() - batch_start
+
+    return {
+        "backend": backend,
+        "compute_type": getattr(asr, "compute_type", None)
+        or str(getattr(asr, "torch_dtype", "")),
+        "load_seconds": round(load_seconds, 3),
+        "infer_seconds": round(infer_seconds, 3),
+        "infer_rtf": round(infer_seconds / duration, 4),
+        "infer_batch_seconds": round(batch_seconds, 3),
+        "infer_batch_rtf": round(batch_seconds / duration, 4),
+    }
+
+
+def main():
+    """Run every backend given a model directory and print the results as JSON"""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--model-dir",
+        action="append",
+        required=True,
+        metavar="BACKEND=PATH",
+        help=f"model directory of a backend, one of {list(ASR_BACKENDS)}",
+    )
+    parser.add_argument(
+        "--audio", help="audio file to transcribe, synthetic audio if unset"
+    )
+    parser.add_argument(
+        "--seconds", type=float, default=120, help="length of the synthetic audio"
+    )
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--compute-type", default=None)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--segment-seconds", type=float, default=10)
+    parser.add_argument("--sample-rate", type=int, default=16000)
+    args = parser.parse_args()
+
+    model_dirs = dict(item.split("=", 1) for item in args.model_dir)
+    if args.audio:
+        waveform = load_audio(args.audio, args.sample_rate)
+    else:
+        waveform = make_audio(args.seconds, args.sample_rate)
+
+    results = [
+        run_backend(backend, model_dir, waveform, args)
+        for backend, model_dir in model_dirs.items()
+    ]
+
+    print(
+        json.dumps(
+            {
+                "audio_seconds": round(len(waveform) / args.sample_rate, 2),
+                "device": args.device,
+                "batch_size": args.batch_size,
+                "segment_seconds": args.segment_seconds,
+                "results": results,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
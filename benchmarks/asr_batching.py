@@ -0,0 +1,103 @@
+"""
+Benchmark of per-segment ASR against batched ASR on a stand-in Whisper model.
+
+The legacy path builds a new transformers pipeline for every diarized segment
+and runs it at batch size 1, which is what diar_inference used to do. The batched
+path reuses the pipeline built by WhisperASR and sends the segments through
+infer_batch. A small checkpoint such as whisper-tiny is enough to show the gap:
+
+    python -m benchmarks.asr_batching --model-dir pretrained_models/whisper-tiny
+"""
+
+import argparse
+import json
+import logging
+from time import perf_counter
+
+import numpy as np
+from transformers import pipeline
+
+from codes.asr_inference_service.asr_model import WhisperASR
+
+logging.basicConfig(
+    format="%(levelname)s | %(asctime)s | %(message)s", level=logging.INFO
+)
+
+
+def make_segments(num_segments: int, sample_rate: int, seed: int = 0) -> list:
+    """
+    Generate tone bursts with diarizer-like lengths (1 to 12 seconds)
+    """
+    rng = np.random.default_rng(seed)
+    segments = []
+    for _ in range(num_segments):
+        length = int(rng.uniform(1.0, 12.0) * sample_rate)
+        t = np.arange(length, dtype=np.float32) / sample_rate
+        tone = 0.1 * np.sin(2 * np.pi * rng.uniform(120, 300) * t)
+        noise = 0.01 * rng.standard_normal(length)
+        segments.append((tone + noise).astype(np.float32))
+    return segments
+
+
+def legacy_infer(asr: WhisperASR, segments: list) -> list:
+    """
+    One pipeline per segment at batch size 1, as diar_inference used to run
+    """
+    transcriptions = []
+    for segment in segments:
+        pipe = pipeline(
+            "automatic-speech-recognition",
+            model=asr.model,
+            tokenizer=asr.processor.tokenizer,
+            feature_extractor=asr.processor.feature_extractor,
+            torch_dtype=asr.torch_dtype,
+            device=asr.device,
+        )
+        transcriptions.append(pipe(segment)["text"])
+    return transcriptions
+
+
+def main():
+    """Run both paths on the same segments and print the timings as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model-dir", required=True)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--num-segments", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--sample-rate", type=int, default=16000)
+    args = parser.parse_args()
+
+    asr = WhisperASR(args.model_dir, args.sample_rate, args.device)
+    segments = make_segments(args.num_segments, args.sample_rate)
+
+    # Warm up so the first timed call does not pay for lazy initialisation
+    asr.infer(segments[0], args.sample_rate)
+
+    legacy_start = perf_counter()
+    legacy_texts = legacy_infer(asr, segments)
+    legacy_time = perf_counter() - legacy_start
+
+    batched_start = perf_counter()
+    batched_texts = asr.infer_batch(
+        segments, args.sample_rate, batch_size=args.batch_size
+    )
+    batched_time = perf_counter() - batched_start
+
+    matching = sum(a.strip() == b.strip() for a, b in zip(legacy_texts, batched_texts))
+    print(
+        json.dumps(
+            {
+                "num_segments": args.num_segments,
+                "batch_size": args.batch_size,
+                "legacy_seconds": round(legacy_time, 3),
+                "batched_seconds": round(batched_time, 3),
+                "speedup": round(legacy_time / batched_time, 2),
+                "matching_transcriptions": matching,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
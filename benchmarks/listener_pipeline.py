@@ -0,0 +1,119 @@
+"""
+Synthetic benchmark of the listener's staged job pipeline.
+
+Each stage sleeps for a configurable time per file, standing in for the Drive
+download, the decode/resample, the GPU inference and the upload. The same backlog
+is run serially, as the old audio_loop did, and through JobPipeline. The number to
+watch is the utilisation of the inference stage, which should sit near 100% once
+the other stages are kept off its critical path:
+
+    python -m benchmarks.listener_pipeline --num-files 20
+"""
+
+import argparse
+import json
+import time
+from time import perf_counter
+
+from codes.google_doc_utils.job_pipeline import JobPipeline
+
+
+def sleeping_stage(seconds: float):
+    """Stage function that holds its worker for a fixed time"""
+
+    def run(job):
+        time.sleep(seconds)
+        return job
+
+    return run
+
+
+def run_serial(num_files: int, timings: dict) -> float:
+    """Every stage of a file runs before the next file starts"""
+
+    start = perf_counter()
+    for index in range(num_files):
+        job = {"id": index}
+        for stage in ("download", "decode", "inference", "upload"):
+            sleeping_stage(timings[stage])(job)
+    return perf_counter() - start
+
+
+def run_pipelined(num_files: int, timings: dict, args) -> tuple:
+    """The same backlog through JobPipeline with the listener's stage layout"""
+
+    pipeline = JobPipeline(prefetch_depth=args.prefetch_depth)
+    pipeline.add_stage(
+        "download", sleeping_stage(timings["download"]), args.download_workers
+    )
+    pipeline.add_stage("decode", sleeping_stage(timings["decode"]), args.decode_workers)
+    pipeline.add_stage("inference", sleeping_stage(timings["inference"]), 1)
+    pipeline.add_stage("upload", sleeping_stage(timings["upload"]), args.upload_workers)
+    pipeline.start()
+
+    start = perf_counter()
+    submitted = 0
+    while submitted < num_files:
+        # The listener resubmits on its next poll when the first queue is full
+        if pipeline.submit({"id": submitted}, key=submitted):
+            submitted += 1
+        else:
+            time.sleep(0.001)
+    pipeline.wait_until_idle()
+    elapsed = perf_counter() - start
+    stats = pipeline.stats()
+    pipeline.stop()
+
+    # Utilisation over the span in which inference could have been running, i.e.
+    # after the first file reached it
+    first_file_latency = timings["download"] + timings["decode"]
+    inference = stats["inference"]
+    inference["steady_state_utilisation"] = round(
+        inference["busy_seconds"] / (elapsed - first_file_latency), 3
+    )
+    return elapsed, stats
+
+
+def main():
+    """Run the serial and pipelined backlogs and print the comparison as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--num-files", type=int, default=20)
+    parser.add_argument("--download", type=float, default=0.3)
+    parser.add_argument("--decode", type=float, default=0.15)
+    parser.add_argument("--inference", type=float, default=0.5)
+    parser.add_argument("--upload", type=float, default=0.2)
+    parser.add_argument("--prefetch-depth", type=int, default=2)
+    parser.add_argument("--download-workers", type=int, default=2)
+    parser.add_argument("--decode-workers", type=int, default=2)
+    parser.add_argument("--upload-workers", type=int, default=1)
+    args = parser.parse_args()
+
+    timings = {
+        "download": args.download,
+        "decode": args.decode,
+        "inference": args.inference,
+        "upload": args.upload,
+    }
+    serial_seconds = run_serial(args.num_files, timings)
+    pipelined_seconds, stats = run_pipelined(args.num_files, timings, args)
+
+    print(
+        json.dumps(
+            {
+                "num_files": args.num_files,
+                "stage_seconds": timings,
+                "serial_seconds": round(serial_seconds, 3),
+                "serial_inference_utilisation": round(
+                    args.num_files * args.inference / serial_seconds, 3
+                ),
+                "pipelined_seconds": round(pipelined_seconds, 3),
+                "speedup": round(serial_seconds / pipelined_seconds, 2),
+                "stages": stats,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
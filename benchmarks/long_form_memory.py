@@ -0,0 +1,174 @@
+"""
+Peak memory of long-form processing against recording length.
+
+Synthetic recordings of each --hours length are written to disk block by block,
+then every (length, mode) pair runs in a fresh interpreter so its peak RSS is
+measured on its own:
+
+    whole     decodes the whole recording with load_audio, as the listener does
+              without DIAR_WINDOW_SECONDS
+    windowed  streams it through iter_audio_chunks and iter_windows, the input
+              side of windowed diar_inference, touching every window
+
+With --model-dir the windowed mode runs the real ASRModelForInference in windowed
+mode instead, diarizing and transcribing every window. Peak RSS of the windowed
+mode should stay flat as the recordings get longer:
+
+    python -m benchmarks.long_form_memory --hours 0.5 1 2 4
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+import numpy as np
+import soundfile as sf
+
+from codes.asr_inference_service.audio_ingest import (
+    iter_audio_chunks,
+    iter_windows,
+    load_audio,
+)
+
+MODES = ("whole", "windowed")
+
+
+def write_recording(path: str, hours: float, sample_rate: int, seed: int = 0):
+    """
+    Write a mono recording of a tone changing every minute over noise, one minute at a
+    time so the writer itself stays small
+    """
+    rng = np.random.default_rng(seed)
+    block = sample_rate * 60
+    with sf.SoundFile(
+        path, "w", samplerate=sample_rate, channels=1, subtype="PCM_16"
+    ) as f:
+        for minute in range(int(hours * 60)):
+            t = np.arange(block) / sample_rate
+            tone = 0.2 * np.sin(2 * np.pi * (150 + 50 * (minute % 3)) * t)
+            f.write((tone + 0.02 * rng.standard_normal(block)).astype(np.float32))
+
+
+def run_mode(mode: str, path: str, args) -> dict:
+    """Process one recording in one mode, in this process"""
+    start = perf_counter()
+    windows = 0
+
+    if mode == "whole":
+        waveform = load_audio(path, args.sample_rate)
+        checksum = float(waveform.sum(dtype=np.float64))
+    elif args.model_dir:
+        from codes.asr_inference_service.model import ASRModelForInference
+
+        model = ASRModelForInference(
+            model_dir=args.model_dir,
+            sample_rate=args.sample_rate,
+            device=args.device,
+            diar_window_seconds=args.window_seconds,
+            diar_window_overlap_seconds=args.overlap_seconds,
+        )
+        checksum = 0.0
+        for segment_string in model.iter_diar_inference(path):
+            checksum += len(segment_string)
+    else:
+        window_samples = int(args.window_seconds * args.sample_rate)
+        hop_samples = window_samples - int(args.overlap_seconds * args.sample_rate)
+        chunks = iter_audio_chunks(path, args.sample_rate)
+        checksum = 0.0
+        for _, window, _ in iter_windows(chunks, window_samples, hop_samples):
+            checksum += float(window.sum(dtype=np.float64))
+            windows += 1
+
+    return {
+        "mode": mode,
+        "seconds": round(perf_counter() - start, 3),
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        ),
+        "windows": windows,
+        "checksum": round(checksum, 1),
+    }
+
+
+def main():
+    """Run every (length, mode) pair in its own interpreter and print the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--hours", type=float, nargs="+", default=[0.5, 1, 2, 4])
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    parser.add_argument("--sample-rate", type=int, default=16000)
+    parser.add_argument("--window-seconds", type=float, default=600)
+    parser.add_argument("--overlap-seconds", type=float, default=30)
+    parser.add_argument("--model-dir")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--run-mode", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--input", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_mode:
+        print(json.dumps(run_mode(args.run_mode, args.input, args)))
+        return
+
+    passthrough = [
+        "--sample-rate",
+        str(args.sample_rate),
+        "--window-seconds",
+        str(args.window_seconds),
+        "--overlap-seconds",
+        str(args.overlap_seconds),
+        "--device",
+        args.device,
+    ] + (["--model-dir", args.model_dir] if args.model_dir else [])
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for hours in args.hours:
+            path = os.path.join(tmp_dir, f"recording_{hours}h.wav")
+            write_recording(path, hours, args.sample_rate)
+
+            for mode in args.modes:
+                process = subprocess.run(
+                    [
+                        sys.executable,
+                        "-m",
+                        "benchmarks.long_form_memory",
+                        "--run-mode",
+                        mode,
+                        "--input",
+                        path,
+                    ]
+                    + passthrough,
+                    capture_output=True,
+                    text=True,
+                    check=False,
+                )
+                if process.returncode != 0:
+                    result = {
+                        "mode": mode,
+                        "error": process.stderr.strip().splitlines()[-1],
+                    }
+                else:
+                    result = json.loads(process.stdout.strip().splitlines()[-1])
+                results.append({"hours": hours, **result})
+
+            os.remove(path)
+
+    print(
+        json.dumps(
+            {
+                "window_seconds": args.window_seconds,
+                "overlap_seconds": args.overlap_seconds,
+                "model": args.model_dir or "none, input side only",
+                "results": results,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
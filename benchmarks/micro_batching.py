@@ -0,0 +1,153 @@
+"""
+Load test of /v1/transcribe_filepath style requests, with and without micro-batching.
+
+--clients concurrent clients each send short clips back to back for --requests
+requests, through the InferenceExecutor the API runs the model on:
+
+    off       every clip is its own forward pass, model.infer at batch size 1
+    batched   clips go through MicroBatcher and model.infer_batch, up to
+              --max-batch-size clips waiting at most --max-wait-ms for each other
+
+The stand-in model costs a fixed --overhead-ms per forward pass plus --item-ms
+per clip, and sleeps so the GIL is free, as a GPU leaves it. Pass --model-dir to
+load a real Whisper checkpoint instead, e.g. whisper-tiny. Throughput and
+p50/p99 latency are printed as JSON per client count:
+
+    python -m benchmarks.micro_batching --clients 1 4 16 32
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from time import perf_counter
+
+import numpy as np
+
+from codes.asr_inference_service.inference_executor import InferenceExecutor
+from codes.asr_inference_service.micro_batcher import MicroBatcher
+
+
+class FixedCostASR:
+    """Model whose forward pass costs an overhead plus a time per clip"""
+
+    def __init__(self, overhead: float, per_item: float):
+        self.overhead = overhead
+        self.per_item = per_item
+
+    def infer(self, waveform: np.ndarray, sample_rate: int = None) -> str:
+        return self.infer_batch([waveform])[0]
+
+    def infer_batch(self, waveforms: list) -> list:
+        time.sleep(self.overhead + self.per_item * len(waveforms))
+        return [f" {len(waveform)} samples" for waveform in waveforms]
+
+
+class WhisperModel:
+    """The infer / infer_batch interface of ASRModelForInference on a WhisperASR"""
+
+    def __init__(self, model_dir: str, sample_rate: int):
+        from codes.asr_inference_service.asr_model import WhisperASR
+
+        self.sample_rate = sample_rate
+        self.asr = WhisperASR(model_dir, sample_rate)
+
+    def infer(self, waveform: np.ndarray, sample_rate: int = None) -> str:
+        return self.asr.infer(waveform, self.sample_rate)
+
+    def infer_batch(self, waveforms: list) -> list:
+        return self.asr.infer_batch(
+            waveforms, self.sample_rate, batch_size=len(waveforms)
+        )
+
+
+def percentile(latencies: list, q: float) -> float:
+    return round(float(np.percentile(latencies, q)) * 1000, 2)
+
+
+async def load_test(model, clip: np.ndarray, clients: int, args, batched: bool) -> dict:
+    """Run the clients against the executor and report throughput and latency"""
+    # Room for every client, the test measures latency rather than rejections
+    inference = InferenceExecutor(max_workers=1, max_queue=clients)
+    batcher = MicroBatcher(
+        lambda clips: inference.call(model.infer_batch, clips),
+        max_batch_size=args.max_batch_size,
+        max_wait=args.max_wait_ms / 1000,
+    )
+
+    async def request():
+        if not batched:
+            return await inference.run(model.infer, clip, args.sample_rate)
+        inference.admit()
+        try:
+            return await batcher.submit(clip)
+        finally:
+            inference.release()
+
+    latencies = []
+
+    async def client():
+        for _ in range(args.requests):
+            start = perf_counter()
+            await request()
+            latencies.append(perf_counter() - start)
+
+    start = perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    elapsed = perf_counter() - start
+    inference.pool.shutdown()
+
+    return {
+        "requests_per_second": round(len(latencies) / elapsed, 2),
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+    }
+
+
+def main():
+    """Load test both modes at each client count and print the results as JSON"""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 4, 16, 32])
+    parser.add_argument("--requests", type=int, default=20, help="requests per client")
+    parser.add_argument("--clip-seconds", type=float, default=3.0)
+    parser.add_argument("--sample-rate", type=int, default=16000)
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--overhead-ms", type=float, default=40.0)
+    parser.add_argument("--item-ms", type=float, default=5.0)
+    parser.add_argument("--model-dir", default=None)
+    args = parser.parse_args()
+
+    if args.model_dir:
+        model = WhisperModel(args.model_dir, args.sample_rate)
+    else:
+        model = FixedCostASR(args.overhead_ms / 1000, args.item_ms / 1000)
+
+    t = np.arange(int(args.clip_seconds * args.sample_rate)) / args.sample_rate
+    clip = (0.1 * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+
+    results = {}
+    for clients in args.clients:
+        results[clients] = {
+            mode: asyncio.run(
+                load_test(model, clip, clients, args, batched=mode == "batched")
+            )
+            for mode in ("off", "batched")
+        }
+
+    print(
+        json.dumps(
+            {
+                "max_batch_size": args.max_batch_size,
+                "max_wait_ms": args.max_wait_ms,
+                "clients": results,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
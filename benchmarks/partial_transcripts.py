@@ -0,0 +1,174 @@
+"""
+Time to first text of a long listener job, with and without partial transcripts.
+
+A job of --segments segments is transcribed at --segment-seconds per segment (a
+sleep standing in for the models), written with TranscriptWriter and uploaded to
+the in-memory Drive stand-in the way inference_stage and upload_stage do it:
+
+    final     the transcript is uploaded once, after the last segment
+    partial   PartialTranscript publishes it while it is written, through a
+              StatusWriter, and the final upload replaces it in place
+
+A watcher thread polls the outputs folder for the first transcribed text. The
+Drive requests of each run are counted, partial publishing should add a number
+bounded by the job length over the publishing cadence, not by its segments:
+
+    python -m benchmarks.partial_transcripts --segments 500 --every-seconds 1
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from time import perf_counter
+
+from codes.asr_inference_service.transcript import (
+    OUTPUT_EXTENSIONS,
+    OUTPUT_FORMATS,
+    OUTPUT_MEDIA_TYPES,
+    TranscriptSegment,
+    TranscriptWriter,
+    transcript_footer,
+    transcript_header,
+)
+from codes.google_doc_utils.partial_upload import PartialTranscript
+from codes.google_doc_utils.status_writer import StatusWriter
+from codes.google_doc_utils.utils import update_txt_file, upload_txt_file
+from tests.fake_drive import FakeDriveService
+
+FOLDER_ID = "outputs-folder"
+
+
+def iter_segments(count: int, segment_seconds: float):
+    """Segments produced at the pace of a model taking segment_seconds for each"""
+    for index in range(count):
+        time.sleep(segment_seconds)
+        yield TranscriptSegment(
+            index * 5.0,
+            index * 5.0 + 4.5,
+            f"SPEAKER_{index % 2:02d}",
+            f" segment {index}",
+        )
+
+
+def watch_first_text(
+    drive: FakeDriveService,
+    empty_size: int,
+    start: float,
+    stop: threading.Event,
+    found: dict,
+):
+    """Record when a file of the outputs folder first holds more than an empty transcript"""
+    while not stop.is_set():
+        for file in list(drive.files_by_id.values()):
+            if FOLDER_ID in file["parents"] and len(file["content"]) > empty_size:
+                found["seconds"] = perf_counter() - start
+                return
+        time.sleep(0.001)
+
+
+def run_job(args, partial: bool) -> dict:
+    """One job from the first segment to the final upload, as the listener runs it"""
+    drive = FakeDriveService()
+    status_writer = StatusWriter(
+        drive, debounce=args.debounce, interval=args.interval
+    ).start()
+    empty_size = len(
+        (
+            transcript_header(args.output_format)
+            + transcript_footer(args.output_format, 1)
+        ).encode()
+    )
+    mimetype = OUTPUT_MEDIA_TYPES[args.output_format]
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "recording" + OUTPUT_EXTENSIONS[args.output_format])
+        publisher = PartialTranscript(
+            path,
+            FOLDER_ID,
+            status_writer,
+            every_segments=args.every_segments if partial else 0,
+            every_seconds=args.every_seconds if partial else 0,
+            mimetype=mimetype,
+            suffix=transcript_footer(args.output_format, 1),
+        )
+
+        stop = threading.Event()
+        first_text = {}
+        start = perf_counter()
+        watcher = threading.Thread(
+            target=watch_first_text, args=(drive, empty_size, start, stop, first_text)
+        )
+        watcher.start()
+
+        # upload_txt_file prints its progress, keep stdout for the JSON
+        with contextlib.redirect_stdout(sys.stderr):
+            with (
+                open(path, "w") as f,
+                TranscriptWriter(f, args.output_format, flush=True) as writer,
+            ):
+                for segment in iter_segments(args.segments, args.segment_seconds):
+                    writer.write(segment)
+                    publisher.segment_written()
+            drive_id = publisher.finish()
+            if drive_id:
+                update_txt_file(path, drive_id, drive, mimetype=mimetype)
+            else:
+                upload_txt_file(path, FOLDER_ID, drive, mimetype=mimetype)
+        elapsed = perf_counter() - start
+
+        watcher.join(timeout=1)
+        stop.set()
+        status_writer.close()
+
+        with open(path, "rb") as f:
+            transcript = f.read()
+        outputs = [
+            file for file in drive.files_by_id.values() if FOLDER_ID in file["parents"]
+        ]
+        if len(outputs) != 1 or outputs[0]["content"] != transcript:
+            raise SystemExit(
+                "The outputs folder does not hold exactly the final transcript"
+            )
+
+    return {
+        "job_seconds": round(elapsed, 3),
+        "time_to_first_text": round(first_text.get("seconds", elapsed), 3),
+        "drive_requests": dict(sorted(drive.call_counts.items())),
+    }
+
+
+def main():
+    """Run the job without and with partial transcripts and print both as JSON"""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--segments", type=int, default=500)
+    parser.add_argument("--segment-seconds", type=float, default=0.01)
+    parser.add_argument("--every-segments", type=int, default=0)
+    parser.add_argument("--every-seconds", type=float, default=1.0)
+    parser.add_argument("--debounce", type=float, default=0.2)
+    parser.add_argument("--interval", type=float, default=1.0)
+    parser.add_argument("--output-format", choices=OUTPUT_FORMATS, default="text")
+    args = parser.parse_args()
+
+    print(
+        json.dumps(
+            {
+                "segments": args.segments,
+                "segment_seconds": args.segment_seconds,
+                "output_format": args.output_format,
+                "final": run_job(args, partial=False),
+                "partial": run_job(args, partial=True),
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Micro-benchmark of audio ingest: wall time and peak memory of decoding a long
+file to 16 kHz mono with each resampler of audio_ingest.load_audio, against the
+old two-pass path (librosa.load at its default 22050 Hz, then a librosa resample
+to 16 kHz) when librosa is installed.
+
+A synthetic stereo 44.1 kHz wav of --minutes length is written once, then every
+case runs in a fresh interpreter so its peak RSS is measured on its own:
+
+    python -m benchmarks.resample --minutes 60
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+import numpy as np
+import soundfile as sf
+
+from codes.asr_inference_service.audio_ingest import RESAMPLERS, load_audio
+
+CASES = ("librosa_two_pass",) + RESAMPLERS
+
+
+def write_input(path: str, minutes: float, sample_rate: int, seed: int = 0):
+    """
+    Write a stereo tone-plus-noise wav block by block, so the input itself
+    never has to fit in memory
+    """
+    rng = np.random.default_rng(seed)
+    block = sample_rate * 60
+    with sf.SoundFile(
+        path, "w", samplerate=sample_rate, channels=2, subtype="PCM_16"
+    ) as f:
+        for start in range(0, int(minutes * block), block):
+            t = (start + np.arange(block)) / sample_rate
+            tone = 0.2 * np.sin(2 * np.pi * 220 * t)
+            noise = 0.02 * rng.standard_normal((block, 2))
+            f.write((tone[:, None] + noise).astype(np.float32))
+
+
+def run_case(case: str, path: str, target_sr: int) -> dict:
+    """Decode the input with one case, in this process"""
+    start = perf_counter()
+    if case == "librosa_two_pass":
+        import librosa
+
+        y, sr = librosa.load(path)
+        waveform = librosa.resample(librosa.to_mono(y), orig_sr=sr, target_sr=target_sr)
+    else:
+        waveform = load_audio(path, target_sr, case)
+    seconds = perf_counter() - start
+
+    return {
+        "case": case,
+        "seconds": round(seconds, 3),
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        ),
+        "output_mb": round(waveform.nbytes / 1e6, 1),
+        "output_samples": len(waveform),
+    }
+
+
+def main():
+    """Run every case in its own interpreter and print the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--minutes", type=float, default=60)
+    parser.add_argument("--input-sr", type=int, default=44100)
+    parser.add_argument("--target-sr", type=int, default=16000)
+    parser.add_argument("--cases", nargs="+", default=list(CASES), choices=CASES)
+    parser.add_argument("--run-case", choices=CASES, help=argparse.SUPPRESS)
+    parser.add_argument("--input", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case(args.run_case, args.input, args.target_sr)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "input.wav")
+        write_input(path, args.minutes, args.input_sr)
+
+        results = []
+        for case in args.cases:
+            process = subprocess.run(
+                [
+                    sys.executable,
+                    "-m",
+                    "benchmarks.resample",
+                    "--run-case",
+                    case,
+                    "--input",
+                    path,
+                    "--target-sr",
+                    str(args.target_sr),
+                ],
+                capture_output=True,
+                text=True,
+                check=False,
+            )
+            if process.returncode != 0:
+                results.append(
+                    {"case": case, "error": process.stderr.strip().splitlines()[-1]}
+                )
+            else:
+                results.append(json.loads(process.stdout.strip().splitlines()[-1]))
+
+    print(
+        json.dumps(
+            {
+                "minutes": args.minutes,
+                "input_sr": args.input_sr,
+                "target_sr": args.target_sr,
+                "results": results,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Segment building and indexing, DataFrame rows against Segments arrays.
+
+A synthetic diarization of --turns speaker turns goes through both paths:
+
+    dataframe  the former PyannoteDiarizer.to_dataframe, a DataFrame grown with one
+               .loc append per kept turn, then read back row by row with
+               segments["start_time"][x] as transcribe_segments did
+    segments   Segments.from_annotation, filter_min_length and merge_same_speaker
+               as PyannoteDiarizer.to_segments does, then sample_bounds
+
+Both must produce the same turns, the timings are printed as JSON:
+
+    python -m benchmarks.segments --turns 10000
+"""
+
+import argparse
+import json
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from codes.asr_inference_service.segments import Segments
+
+
+class _Turn:
+    __slots__ = ("start", "end")
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+
+
+class FakeAnnotation:
+    """Stand-in for a pyannote Annotation, with its itertracks"""
+
+    def __init__(self, tracks):
+        self.tracks = tracks
+
+    def itertracks(self, yield_label=False):
+        for index, (start, end, speaker) in enumerate(self.tracks):
+            yield _Turn(start, end), index, speaker
+
+
+def make_diarization(
+    turns: int, num_speakers: int = 4, seed: int = 0
+) -> FakeAnnotation:
+    """Turns of 0.1 to 6 s, with short gaps and runs of the same speaker"""
+    rng = np.random.default_rng(seed)
+    lengths = rng.uniform(0.1, 6.0, turns)
+    gaps = rng.uniform(0.0, 1.5, turns)
+    starts = np.cumsum(gaps + np.concatenate(([0.0], lengths[:-1])))
+    speakers = rng.integers(0, num_speakers, turns)
+    return FakeAnnotation(
+        [
+            (start, start + length, f"SPEAKER_{speaker:02d}")
+            for start, length, speaker in zip(
+                starts.tolist(), lengths.tolist(), speakers.tolist()
+            )
+        ]
+    )
+
+
+def dataframe_path(diarization, min_segment_length, min_silence_length, sample_rate):
+    """The row-by-row DataFrame code this benchmark measures Segments against"""
+    df_diarized = pd.DataFrame(columns=["start_time", "end_time", "speaker", "text"])
+    prev_speaker = "None"
+    prev_stoptime = 0.0
+
+    for turn, _, speaker in diarization.itertracks(yield_label=True):
+        start_time, stop_time, cur_speaker = (
+            round(turn.start, 3),
+            round(turn.end, 3),
+            speaker,
+        )
+        if stop_time - start_time < min_segment_length:
+            continue
+
+        if cur_speaker == prev_speaker:
+            if start_time - prev_stoptime > min_silence_length:
+                df_diarized.loc[len(df_diarized)] = (
+                    start_time,
+                    stop_time,
+                    cur_speaker,
+                    "",
+                )
+            df_diarized.loc[df_diarized.index[-1], "end_time"] = stop_time
+        else:
+            df_diarized.loc[len(df_diarized)] = start_time, stop_time, cur_speaker, ""
+
+        prev_speaker = cur_speaker
+        prev_stoptime = stop_time
+
+    bounds = [
+        (
+            int(df_diarized["start_time"][x] * sample_rate),
+            int(df_diarized["end_time"][x] * sample_rate),
+        )
+        for x in range(len(df_diarized))
+    ]
+    return list(
+        zip(df_diarized["start_time"], df_diarized["end_time"], df_diarized["speaker"])
+    ), bounds
+
+
+def segments_path(diarization, min_segment_length, min_silence_length, sample_rate):
+    """Segments, as PyannoteDiarizer.to_segments and transcribe_segments use them"""
+    segments = (
+        Segments.from_annotation(diarization, decimals=3)
+        .filter_min_length(min_segment_length)
+        .merge_same_speaker(min_silence_length)
+    )
+    start_frames, end_frames = segments.sample_bounds(sample_rate)
+    return list(segments), list(zip(start_frames.tolist(), end_frames.tolist()))
+
+
+def main():
+    """Time both paths on the same diarization and print the results as JSON"""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--turns", type=int, default=10000)
+    parser.add_argument("--min-segment-length", type=float, default=0.5)
+    parser.add_argument("--min-silence-length", type=float, default=1.0)
+    parser.add_argument("--sample-rate", type=int, default=16000)
+    args = parser.parse_args()
+
+    diarization = make_diarization(args.turns)
+    params = (args.min_segment_length, args.min_silence_length, args.sample_rate)
+
+    results = {}
+    outputs = {}
+    for name, path in (("dataframe", dataframe_path), ("segments", segments_path)):
+        start = perf_counter()
+        outputs[name] = path(diarization, *params)
+        results[name] = round(perf_counter() - start, 4)
+
+    if outputs["dataframe"] != outputs["segments"]:
+        raise SystemExit("The two paths produced different segments")
+
+    print(
+        json.dumps(
+            {
+                "turns": args.turns,
+                "segments": len(outputs["segments"][0]),
+                "seconds": results,
+                "speedup": round(results["dataframe"] / results["segments"], 1),
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""
+Per-stage benchmark of the transcription pipeline.
+
+Synthetic multi-speaker audio of --seconds length is written to a wav file, then
+each stage is timed on its own, fed by the output of the stage before it:
+
+    decode     soundfile read of the wav, at its own rate and channels
+    resample   downmix and resample of the decoded audio to 16 kHz
+    ingest     decode and resample in the single pass load_audio does
+    denoise    denoiser on the 16 kHz waveform
+    diarize    diarizer on the 16 kHz waveform
+    asr        batched ASR of the diarized segments
+    format     transcript formatting of the transcribed segments, in --output-format
+    upload     upload of the transcript to the in-memory Drive stand-in
+
+By default every model is a stub from benchmarks.stubs, so the suite runs on a
+CPU-only machine; real or tiny models can be swapped in per stage. The results
+are JSON with sorted keys, meant to be saved and diffed between commits, and
+--compare flags the stages that got slower than a saved baseline:
+
+    python -m benchmarks.stages --seconds 600 --output baseline.json
+    python -m benchmarks.stages --seconds 600 --compare baseline.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+from time import perf_counter
+
+import numpy as np
+import soundfile as sf
+
+from benchmarks.stubs import StubASR, StubDenoiser, StubDiarizer
+from benchmarks.synthetic import make_conversation
+from codes.asr_inference_service.audio_ingest import RESAMPLERS, load_audio, resample
+from codes.asr_inference_service.transcript import (
+    OUTPUT_FORMATS,
+    TIMESTAMP_FORMATS,
+    TranscriptSegment,
+    iter_transcript,
+)
+from codes.google_doc_utils.utils import upload_txt_file
+from tests.fake_drive import FakeDriveService
+
+STAGES = (
+    "decode",
+    "resample",
+    "ingest",
+    "denoise",
+    "diarize",
+    "asr",
+    "format",
+    "upload",
+)
+
+# A stage is only flagged as a regression when it is also slower by this many seconds
+MIN_REGRESSION_SECONDS = 0.005
+
+
+def timed(fn, repeats: int):
+    """Run fn repeats times, return its last result and the timings"""
+    timings = []
+    for _ in range(repeats):
+        start = perf_counter()
+        result = fn()
+        timings.append(perf_counter() - start)
+    return result, timings
+
+
+def build_models(args, turns: list):
+    """Stub models unless a real model is asked for, real ones are imported lazily"""
+    if args.denoiser == "real":
+        from codes.asr_inference_service.denoise import DENOISER
+
+        denoiser = DENOISER(device=args.device, dry=args.dry)
+    elif args.denoiser == "stub":
+        denoiser = StubDenoiser(args.sample_rate)
+    else:
+        denoiser = None
+
+    if args.diarizer == "real":
+        from codes.asr_inference_service.diarizer import PyannoteDiarizer
+
+        diarizer = PyannoteDiarizer(
+            args.device, min_segment_length=0.5, min_silence_length=0
+        )
+    else:
+        diarizer = StubDiarizer(turns)
+
+    if args.asr == "stub":
+        asr = StubASR(args.sample_rate)
+    else:
+        from codes.asr_inference_service.asr_model import build_asr_model
+
+        asr = build_asr_model(
+            args.asr, args.model_dir, args.sample_rate, args.device, args.compute_type
+        )
+
+    return denoiser, diarizer, asr
+
+
+def run_stages(args) -> dict:
+    """Time every stage, returning {stage: timings} and counts describing the run"""
+    waveform, turns = make_conversation(
+        args.seconds, args.input_sr, args.num_speakers, args.channels, args.seed
+    )
+    denoiser, diarizer, asr = build_models(args, turns)
+    timings = {}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        wav_path = os.path.join(tmp_dir, "conversation.wav")
+        sf.write(wav_path, waveform, args.input_sr, subtype="PCM_16")
+        del waveform
+
+        decoded, timings["decode"] = timed(
+            lambda: sf.read(wav_path, dtype="float32", always_2d=True)[0], args.repeats
+        )
+        resampled, timings["resample"] = timed(
+            lambda: resample(
+                decoded, args.input_sr, args.sample_rate, args.resampler, channel_axis=1
+            ),
+            args.repeats,
+        )
+        _, timings["ingest"] = timed(
+            lambda: load_audio(wav_path, args.sample_rate, args.resampler), args.repeats
+        )
+        decoded = None
+
+        if denoiser is not None:
+            denoised, timings["denoise"] = timed(
+                lambda: denoiser.denoise(resampled, args.sample_rate), args.repeats
+            )
+            audio = np.asarray(denoised, dtype=np.float32)
+        else:
+            audio = resampled
+
+        segments, timings["diarize"] = timed(
+            lambda: diarizer.diarize(audio, args.sample_rate), args.repeats
+        )
+        starts, ends, speakers = (
+            segments.start.tolist(),
+            segments.end.tolist(),
+            segments.speaker.tolist(),
+        )
+        start_frames, end_frames = segments.sample_bounds(args.sample_rate)
+        segment_audios = [
+            audio[start_frame:end_frame]
+            for start_frame, end_frame in zip(
+                start_frames.tolist(), end_frames.tolist()
+            )
+        ]
+
+        transcriptions, timings["asr"] = timed(
+            lambda: asr.infer_batch(
+                segment_audios, args.sample_rate, batch_size=args.batch_size
+            ),
+            args.repeats,
+        )
+        transcript, timings["format"] = timed(
+            lambda: "".join(
+                iter_transcript(
+                    (
+                        TranscriptSegment(start, end, speaker, text)
+                        for start, end, speaker, text in zip(
+                            starts, ends, speakers, transcriptions
+                        )
+                    ),
+                    args.output_format,
+                    args.timestamp_format,
+                )
+            ),
+            args.repeats,
+        )
+
+        transcript_path = os.path.join(tmp_dir, "conversation.txt")
+        with open(transcript_path, "w") as f:
+            f.write(transcript)
+        drive = FakeDriveService()
+        # upload_txt_file prints its progress, keep stdout for the JSON
+        with contextlib.redirect_stdout(sys.stderr):
+            _, timings["upload"] = timed(
+                lambda: upload_txt_file(transcript_path, "benchmark-folder", drive),
+                args.repeats,
+            )
+
+    counts = {
+        "turns": len(turns),
+        "segments": len(segment_audios),
+        "transcript_bytes": len(transcript.encode()),
+        "drive_calls": drive.total_calls(),
+    }
+    return timings, counts
+
+
+def summarise(timings: dict, audio_seconds: float) -> dict:
+    """Min and median per stage, and the real-time factor of the best run"""
+    return {
+        stage: {
+            "min_seconds": round(min(values), 5),
+            "median_seconds": round(statistics.median(values), 5),
+            "rtf": round(min(values) / audio_seconds, 6),
+        }
+        for stage, values in timings.items()
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Stages slower than the baseline by more than the tolerance"""
+    regressions = []
+    for stage in STAGES:
+        current = results["stages"].get(stage)
+        previous = baseline.get("stages", {}).get(stage)
+        if current is None or previous is None:
+            continue
+        ratio = current["min_seconds"] / max(previous["min_seconds"], 1e-9)
+        slower_by = current["min_seconds"] - previous["min_seconds"]
+        print(
+            f"{stage:>10}  {previous['min_seconds']:>10.4f}s -> {current['min_seconds']:>10.4f}s  x{ratio:.2f}",
+            file=sys.stderr,
+        )
+        if ratio > 1 + tolerance and slower_by > MIN_REGRESSION_SECONDS:
+            regressions.append(stage)
+    return regressions
+
+
+def main():
+    """Run the suite, print the results as JSON and optionally compare them to a baseline"""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--seconds", type=float, default=300)
+    parser.add_argument("--num-speakers", type=int, default=3)
+    parser.add_argument("--input-sr", type=int, default=44100)
+    parser.add_argument("--channels", type=int, default=2)
+    parser.add_argument("--sample-rate", type=int, default=16000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--resampler", default="soxr_hq", choices=RESAMPLERS)
+    parser.add_argument("--denoiser", default="stub", choices=("stub", "real", "none"))
+    parser.add_argument("--dry", type=float, default=0.25)
+    parser.add_argument("--diarizer", default="stub", choices=("stub", "real"))
+    parser.add_argument("--asr", default="stub", choices=("stub", "hf", "ctranslate2"))
+    parser.add_argument(
+        "--model-dir", help="ASR model directory, for the hf and ctranslate2 backends"
+    )
+    parser.add_argument("--compute-type")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument(
+        "--timestamp-format", default="hour-minute-second", choices=TIMESTAMP_FORMATS
+    )
+    parser.add_argument("--output-format", default="text", choices=OUTPUT_FORMATS)
+    parser.add_argument("--output", help="also write the results to this file")
+    parser.add_argument(
+        "--compare", help="results file of a previous run to compare against"
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="allowed slowdown, 0.2 is 20%%"
+    )
+    args = parser.parse_args()
+
+    if args.asr != "stub" and not args.model_dir:
+        parser.error("--model-dir is required for a real ASR backend")
+
+    timings, counts = run_stages(args)
+    results = {
+        "config": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("output", "compare", "tolerance")
+        },
+        "counts": counts,
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+        },
+        "stages": summarise(timings, args.seconds),
+    }
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
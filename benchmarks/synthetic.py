@@ -0,0 +1,86 @@
+"""
+Synthetic multi-speaker audio for the benchmarks.
+
+Each speaker is a harmonic voice with its own pitch and timbre, amplitude
+modulated at a syllable-like rate. Speakers take turns of random length separated
+by short pauses, over a low noise floor. The turns are returned with the audio,
+so stub diarizers can hand back a known ground truth.
+"""
+
+import numpy as np
+
+
+def make_conversation(
+    seconds: float,
+    sample_rate: int = 16000,
+    num_speakers: int = 3,
+    channels: int = 1,
+    seed: int = 0,
+):
+    """
+    Generate a conversation of the given length
+
+    Inputs:
+        seconds (float): length of the audio
+        sample_rate (int): sample rate of the audio
+        num_speakers (int): number of distinct voices
+        channels (int): 1 for (T,) audio, more for (T, C) audio with the voice
+        panned slightly differently on each channel
+        seed (int): seed of the random generator, the same seed gives the same audio
+
+    Returns:
+        waveform (np.ndarray): float32 audio of shape (T,) or (T, C)
+        turns (list): (start_seconds, end_seconds, speaker) of every turn
+    """
+    rng = np.random.default_rng(seed)
+    total = int(seconds * sample_rate)
+    waveform = (0.005 * rng.standard_normal(total)).astype(np.float32)
+
+    voices = [
+        {
+            "f0": 100 + 160 * index / max(num_speakers - 1, 1),
+            "harmonics": rng.uniform(0.2, 1.0, size=6) / np.arange(1, 7),
+            "syllable_rate": rng.uniform(3.5, 5.5),
+        }
+        for index in range(num_speakers)
+    ]
+
+    turns = []
+    position = 0.0
+    speaker = 0
+    while position < seconds:
+        length = min(rng.uniform(1.0, 8.0), seconds - position)
+        start, end = int(position * sample_rate), int((position + length) * sample_rate)
+        waveform[start:end] += voice(voices[speaker], end - start, sample_rate, rng)
+        turns.append(
+            (round(position, 3), round(position + length, 3), f"SPEAKER_{speaker:02d}")
+        )
+
+        position += length + rng.uniform(0.2, 1.0)
+        speaker = (
+            (speaker + int(rng.integers(1, num_speakers))) % num_speakers
+            if num_speakers > 1
+            else 0
+        )
+
+    if channels > 1:
+        gains = np.linspace(0.8, 1.0, channels, dtype=np.float32)
+        waveform = waveform[:, None] * gains[None, :]
+
+    return waveform, turns
+
+
+def voice(params: dict, length: int, sample_rate: int, rng) -> np.ndarray:
+    """One turn of a harmonic voice with pitch drift and syllable modulation"""
+    t = np.arange(length, dtype=np.float32) / sample_rate
+    pitch = params["f0"] * (
+        1 + 0.05 * np.sin(2 * np.pi * 0.3 * t + rng.uniform(0, np.pi))
+    )
+    phase = 2 * np.pi * np.cumsum(pitch) / sample_rate
+
+    signal = np.zeros(length, dtype=np.float32)
+    for harmonic, amplitude in enumerate(params["harmonics"], start=1):
+        signal += amplitude * np.sin(harmonic * phase)
+
+    envelope = 0.5 * (1 + np.sin(2 * np.pi * params["syllable_rate"] * t))
+    return (0.1 * signal * envelope).astype(np.float32)
@@ -1,12 +1,28 @@
 import logging
 from time import perf_counter
 
-import librosa
 import numpy as np
 import torch
 from faster_whisper import WhisperModel
+from faster_whisper.audio import pad_or_trim
+from faster_whisper.tokenizer import Tokenizer
 from transformers import AutoModelForSpeechSeq2Seq, AutoProcessor, pipeline
 
+from codes.asr_inference_service.audio_ingest import resample
+from codes.asr_inference_service.metrics import observe_model_load, observe_stage
+
+HF_COMPUTE_TYPES = ("float16", "bfloat16", "float32")
+
+# Whisper decodes at most 30 s of audio per pass, longer segments go through
+# the model's long-form transcription instead of a batch
+WHISPER_WINDOW_SECONDS = 30
+
+
+def default_compute_type(device: str) -> str:
+    """CTranslate2 compute type for a device: float16 on GPU, int8 (int8 weights,
+    float32 compute) on CPU, where float16 is not supported"""
+    return "float16" if device == "cuda" else "int8"
+
 
 class WhisperASR:
     """Base class for ASR model for inference"""
@@ -16,36 +32,50 @@ class WhisperASR:
         model_dir: str,
         sample_rate: int = 16000,
         device: str = "cpu",
+        compute_type: str = None,
     ):
         """
         Inputs:
             model_dir (str): path to model directory
             sample_rate (int): the target sample rate in which the model accepts
+            compute_type (str): precision of the model, chosen per device if None
         """
         device = (
             device
             if device in ["cuda", "cpu"]
-            else "cuda" if torch.cuda.is_available() else "cpu"
+            else "cuda"
+            if torch.cuda.is_available()
+            else "cpu"
         )
 
-        self.init_model(model_dir, device)
         self.target_sr = sample_rate
+        self.init_model(model_dir, device, compute_type)
 
-    def init_model(self, model_dir: str, device: str):
+    def init_model(self, model_dir: str, device: str, compute_type: str = None):
         """Method to initialise Whisper model on class initialisation
 
         Inputs:
             model_dir (str): path to model directory
+            compute_type (str): one of HF_COMPUTE_TYPES, chosen per device if None
         """
         logging.info("Loading Whisper ASR model...")
         model_load_start = perf_counter()
 
         self.device = device
-        self.torch_dtype = torch.float16 if self.device == "cuda" else torch.float32
+        compute_type = compute_type or (
+            "float16" if self.device == "cuda" else "float32"
+        )
+        if compute_type not in HF_COMPUTE_TYPES:
+            raise ValueError(
+                f"Compute type {compute_type} is not supported by the hf backend, choose one of {HF_COMPUTE_TYPES}"
+            )
+        self.torch_dtype = getattr(torch, compute_type)
         logging.info("Torch dtype: %s", self.torch_dtype)
 
         self.processor = AutoProcessor.from_pretrained(model_dir)
-        self.model = AutoModelForSpeechSeq2Seq.from_pretrained(model_dir)
+        self.model = AutoModelForSpeechSeq2Seq.from_pretrained(
+            model_dir, torch_dtype=self.torch_dtype
+        )
         self.model.to(device)
         self.model.config.forced_decoder_ids = None
         self.model.eval()
@@ -67,10 +97,21 @@ class WhisperASR:
         self.model.generation_config.suppress_tokens = []
         ##########################################################################
 
+        # Built once and reused by every infer call, creating a pipeline is not free
+        self.pipe = pipeline(
+            "automatic-speech-recognition",
+            model=self.model,
+            tokenizer=self.processor.tokenizer,
+            feature_extractor=self.processor.feature_extractor,
+            torch_dtype=self.torch_dtype,
+            device=self.device,
+        )
+
         model_load_end = perf_counter()
         logging.info(
             "Models loaded. Elapsed time: %s", model_load_end - model_load_start
         )
+        observe_model_load("asr", model_load_end - model_load_start)
 
     def infer(self, waveform: np.ndarray, input_sr: int) -> str:
         """Method to run inference on a waveform to generate a transcription
@@ -85,77 +126,158 @@ class WhisperASR:
         inference_start = perf_counter()
 
         if input_sr != self.target_sr:
-            waveform = librosa.resample(
-                waveform, orig_sr=input_sr, target_sr=self.target_sr
-            )
+            waveform = resample(waveform, input_sr, self.target_sr)
 
         if len(waveform.shape) == 2:
             logging.info("Converting Steoreo Waveform to Mono Waveform")
             waveform = waveform.mean(axis=1)
 
-        pipe = pipeline(
-            "automatic-speech-recognition",
-            model=self.model,
-            tokenizer=self.processor.tokenizer,
-            feature_extractor=self.processor.feature_extractor,
-            torch_dtype=self.torch_dtype,
-            device=self.device,
+        if len(waveform) > WHISPER_WINDOW_SECONDS * self.target_sr:
+            transcription = self.transcribe_long(waveform)
+        else:
+            transcription = self.pipe(np.array(waveform))["text"]
+        inference_end = perf_counter()
+        logging.info(
+            "Inference Model triggered. Elapsed time: %s",
+            inference_end - inference_start,
+        )
+        observe_stage(
+            "asr", inference_end - inference_start, len(waveform) / self.target_sr
         )
 
-        transcription = pipe(np.array(waveform))
+        return transcription
+
+    def transcribe_long(self, waveform: np.ndarray, batch_size: int = 1) -> str:
+        """Transcribe a mono waveform at the target sample rate longer than one 30 s
+        window, in chunks of 30 s that the pipeline stitches back together"""
+        output = self.pipe(
+            np.asarray(waveform, dtype=np.float32),
+            chunk_length_s=WHISPER_WINDOW_SECONDS,
+            batch_size=batch_size,
+        )
+        return output["text"]
+
+    def infer_batch(self, waveforms: list, input_sr: int, batch_size: int = 8) -> list:
+        """Method to run inference on a list of waveforms in batches. Segments of up
+        to 30 s are batched together, longer ones are transcribed on their own in
+        30 s chunks, which Whisper would otherwise cut at 30 s
+
+        Inputs:
+            waveforms (list): List of mono waveforms, each of shape (T,)
+            input_sr (int): Sample rate of the input waveforms
+            batch_size (int): Number of waveforms passed through the model at once
+
+        Returns:
+            transcriptions (list): Output texts, in the same order as waveforms
+        """
+        if not waveforms:
+            return []
+
+        inference_start = perf_counter()
+
+        if input_sr != self.target_sr:
+            waveforms = [
+                resample(waveform, input_sr, self.target_sr) for waveform in waveforms
+            ]
+
+        transcriptions = [""] * len(waveforms)
+        max_samples = WHISPER_WINDOW_SECONDS * self.target_sr
+        batched = [
+            index
+            for index, waveform in enumerate(waveforms)
+            if len(waveform) <= max_samples
+        ]
+
+        if batched:
+            outputs = self.pipe(
+                [np.asarray(waveforms[index], dtype=np.float32) for index in batched],
+                batch_size=batch_size,
+            )
+            for index, output in zip(batched, outputs):
+                transcriptions[index] = output["text"]
+
+        for index, waveform in enumerate(waveforms):
+            if len(waveform) > max_samples:
+                transcriptions[index] = self.transcribe_long(waveform, batch_size)
+
         inference_end = perf_counter()
         logging.info(
-            "Inference Model triggered. Elapsed time: %s",
+            "Batched inference on %s segments (batch size %s). Elapsed time: %s",
+            len(waveforms),
+            batch_size,
+            inference_end - inference_start,
+        )
+        observe_stage(
+            "asr",
             inference_end - inference_start,
+            sum(len(waveform) for waveform in waveforms) / self.target_sr,
         )
 
-        return transcription["text"]
+        return transcriptions
 
 
 class FasterWhisperASR:
-    '''
+    """
     Class for FasterWhisper implementation
-    '''
+    """
+
     def __init__(
         self,
         model_dir: str,
         sample_rate: int = 16000,
         device: str = "cpu",
+        compute_type: str = None,
     ):
         """
         Inputs:
             model_dir (str): path to model directory
             sample_rate (int): the target sample rate in which the model accepts
+            compute_type (str): precision of the model, chosen per device if None
         """
         device = (
             device
             if device in ["cuda", "cpu"]
-            else "cuda" if torch.cuda.is_available() else "cpu"
+            else "cuda"
+            if torch.cuda.is_available()
+            else "cpu"
         )
 
-        self.init_model(model_dir, device)
         self.target_sr = sample_rate
+        self.init_model(model_dir, device, compute_type)
 
-    def init_model(self, model_dir: str, device: str):
+    def init_model(self, model_dir: str, device: str, compute_type: str = None):
         """Method to initialise Whisper model on class initialisation
 
         Inputs:
-            model_dir (str): path to model directory
+            model_dir (str): path to a CTranslate2 Whisper model directory
+            compute_type (str): CTranslate2 compute type, chosen per device if None
         """
         logging.info("Loading Whisper ASR model...")
         model_load_start = perf_counter()
 
         self.device = device
-        self.torch_dtype = torch.float16 if self.device == "cuda" else torch.float32
-        logging.info("Torch dtype: %s", self.torch_dtype)
+        self.compute_type = compute_type or default_compute_type(self.device)
+        logging.info("CTranslate2 compute type: %s", self.compute_type)
 
-        # self.processor = AutoProcessor.from_pretrained(model_dir)
-        self.model = WhisperModel(model_dir, device=self.device, compute_type="float16")
+        self.model = WhisperModel(
+            model_dir, device=self.device, compute_type=self.compute_type
+        )
+        self.beam_size = 5
+
+        # English transcription without timestamps, the same prompt for every batch
+        self.tokenizer = Tokenizer(
+            self.model.hf_tokenizer,
+            self.model.model.is_multilingual,
+            task="transcribe",
+            language="en",
+        )
+        self.prompt = self.model.get_prompt(self.tokenizer, [], without_timestamps=True)
 
         model_load_end = perf_counter()
         logging.info(
             "Models loaded. Elapsed time: %s", model_load_end - model_load_start
         )
+        observe_model_load("asr", model_load_end - model_load_start)
 
     def infer(self, waveform: np.ndarray, input_sr: int) -> str:
         """Method to run inference on a waveform to generate a transcription
@@ -170,26 +292,135 @@ class FasterWhisperASR:
         inference_start = perf_counter()
 
         if input_sr != self.target_sr:
-            waveform = librosa.resample(
-                waveform, orig_sr=input_sr, target_sr=self.target_sr
-            )
+            waveform = resample(waveform, input_sr, self.target_sr)
 
         if len(waveform.shape) == 2:
             logging.info("Converting Steoreo Waveform to Mono Waveform")
             waveform = waveform.mean(axis=1)
 
-        segments, _ = self.model.transcribe(waveform, language="en", vad_filter=False)
-        transcription = ""
-
-        for segment in segments:
-            transcription += segment.text
-
-        # transcription = list(segments['text'])
+        transcription = self.transcribe_long(waveform)
 
         inference_end = perf_counter()
         logging.info(
             "Inference Model triggered. Elapsed time: %s",
             inference_end - inference_start,
         )
+        observe_stage(
+            "asr", inference_end - inference_start, len(waveform) / self.target_sr
+        )
 
         return transcription
+
+    def transcribe_long(self, waveform: np.ndarray) -> str:
+        """Transcribe a mono waveform at the target sample rate with the long-form
+        transcription of faster-whisper, for audio longer than one 30 s window"""
+        segments, _ = self.model.transcribe(
+            waveform, language="en", vad_filter=False, beam_size=self.beam_size
+        )
+        return "".join(segment.text for segment in segments)
+
+    def infer_batch(self, waveforms: list, input_sr: int, batch_size: int = 8) -> list:
+        """Method to run inference on a list of waveforms in batches. Segments of up
+        to 30 s are encoded and decoded together by CTranslate2, longer ones are
+        transcribed on their own
+
+        Inputs:
+            waveforms (list): List of mono waveforms, each of shape (T,)
+            input_sr (int): Sample rate of the input waveforms
+            batch_size (int): Number of waveforms passed through the model at once
+
+        Returns:
+            transcriptions (list): Output texts, in the same order as waveforms
+        """
+        if not waveforms:
+            return []
+
+        inference_start = perf_counter()
+
+        if input_sr != self.target_sr:
+            waveforms = [
+                resample(waveform, input_sr, self.target_sr) for waveform in waveforms
+            ]
+
+        transcriptions = [""] * len(waveforms)
+        max_samples = WHISPER_WINDOW_SECONDS * self.target_sr
+        batched = [
+            index
+            for index, waveform in enumerate(waveforms)
+            if 0 < len(waveform) <= max_samples
+        ]
+
+        for start in range(0, len(batched), batch_size):
+            indices = batched[start : start + batch_size]
+            features = np.stack(
+                [
+                    pad_or_trim(
+                        self.model.feature_extractor(
+                            np.asarray(waveforms[index], dtype=np.float32)
+                        )
+                    )
+                    for index in indices
+                ]
+            )
+            results = self.model.model.generate(
+                self.model.encode(features),
+                [list(self.prompt) for _ in indices],
+                beam_size=self.beam_size,
+                max_length=self.model.max_length,
+                suppress_blank=True,
+                suppress_tokens=[-1],
+            )
+            for index, result in zip(indices, results):
+                transcriptions[index] = self.tokenizer.decode(result.sequences_ids[0])
+
+        for index, waveform in enumerate(waveforms):
+            if len(waveform) > max_samples:
+                transcriptions[index] = self.transcribe_long(waveform)
+
+        inference_end = perf_counter()
+        logging.info(
+            "Batched inference on %s segments (batch size %s). Elapsed time: %s",
+            len(waveforms),
+            batch_size,
+            inference_end - inference_start,
+        )
+        observe_stage(
+            "asr",
+            inference_end - inference_start,
+            sum(len(waveform) for waveform in waveforms) / self.target_sr,
+        )
+
+        return transcriptions
+
+
+# Backends selectable with ASR_BACKEND
+ASR_BACKENDS = {
+    "hf": WhisperASR,
+    "ctranslate2": FasterWhisperASR,
+}
+
+
+def build_asr_model(
+    backend: str,
+    model_dir: str,
+    sample_rate: int = 16000,
+    device: str = "cpu",
+    compute_type: str = None,
+):
+    """Build the ASR model of a backend registered in ASR_BACKENDS
+
+    Inputs:
+        backend (str): name of the backend, hf or ctranslate2
+        model_dir (str): path to a model directory in the backend's format
+        compute_type (str): precision of the model, chosen per device if None
+
+    Returns:
+        ASR model with infer and infer_batch methods
+    """
+    if backend not in ASR_BACKENDS:
+        raise ValueError(
+            f"Unknown ASR backend {backend}, choose one of {list(ASR_BACKENDS)}"
+        )
+
+    logging.info("ASR backend: %s", backend)
+    return ASR_BACKENDS[backend](model_dir, sample_rate, device, compute_type)
@@ -0,0 +1,514 @@
+"""
+Audio ingest module, decodes audio into the float32 mono waveform at the target
+sample rate that the models expect, in a single pass.
+
+Files libsndfile can read (wav, flac, ogg, mp3) are decoded block by block, each
+block is downmixed and fed to a streaming resampler, and the output lands in a
+buffer preallocated from the frame count, so peak memory stays close to the size
+of the output waveform. Anything else (mp4 and other containers) goes through
+ffmpeg, which decodes, downmixes and resamples in one pass as well.
+"""
+
+import contextlib
+import io
+import itertools
+import logging
+import os
+import shutil
+import subprocess
+import threading
+from math import gcd
+from time import perf_counter
+
+import numpy as np
+import soundfile as sf
+import soxr
+from scipy.signal import resample_poly
+
+from codes.asr_inference_service.metrics import observe_stage
+
+logging.basicConfig(
+    format="%(levelname)s | %(asctime)s | %(message)s", level=logging.INFO
+)
+
+# soxr_hq: soxr high quality, the default
+# soxr_qq: soxr quick, cheaper and good enough for speech at 16 kHz
+# polyphase: scipy polyphase filter, exact for integer ratios such as 48 kHz to 16 kHz
+RESAMPLERS = ("soxr_hq", "soxr_qq", "polyphase")
+DEFAULT_RESAMPLER = "soxr_hq"
+
+SOXR_QUALITIES = {"soxr_hq": "HQ", "soxr_qq": "QQ"}
+
+# Frames decoded per block when streaming a file through the resampler
+BLOCK_FRAMES = 1 << 18
+
+# Extra capacity, in seconds, preallocated on top of the probed duration
+FFMPEG_SLACK_SECONDS = 1
+
+
+def load_audio(
+    source, target_sr: int, resampler: str = DEFAULT_RESAMPLER
+) -> np.ndarray:
+    """
+    Decode a file into a float32 mono waveform at the target sample rate
+
+    Inputs:
+        source (str/bytes/file object): path of the file, its bytes or a binary file object
+        target_sr (int): sample rate of the returned waveform
+        resampler (str): one of RESAMPLERS
+
+    Returns:
+        waveform (np.ndarray) of shape (T,)
+    """
+    decode_start = perf_counter()
+    waveform = _load_audio(source, target_sr, resampler)
+    observe_stage("decode", perf_counter() - decode_start, len(waveform) / target_sr)
+    return waveform
+
+
+def _load_audio(source, target_sr: int, resampler: str) -> np.ndarray:
+    check_resampler(resampler)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+
+    try:
+        sound_file = sf.SoundFile(source)
+    except RuntimeError:
+        # Not a format libsndfile can read, let ffmpeg decode it
+        if hasattr(source, "seek"):
+            source.seek(0)
+        return extract_audio_ffmpeg(source, target_sr)
+
+    with sound_file:
+        logging.info(
+            "Audio ingest : %s SR x %s channels to %s SR (%s)",
+            sound_file.samplerate,
+            sound_file.channels,
+            target_sr,
+            resampler,
+        )
+        if sound_file.samplerate == target_sr or resampler == "polyphase":
+            waveform = _read_mono(sound_file)
+            return resample(waveform, sound_file.samplerate, target_sr, resampler)
+
+        return _read_mono_resampled(sound_file, target_sr, SOXR_QUALITIES[resampler])
+
+
+def iter_audio_chunks(source, target_sr: int, resampler: str = DEFAULT_RESAMPLER):
+    """
+    Decode a file progressively, yielding its float32 mono waveform at the target
+    sample rate as consecutive chunks, so a file of any length can be processed
+    in bounded memory. The polyphase resampler needs the whole signal, streams
+    use soxr high quality instead.
+
+    Inputs:
+        source (str/bytes/file object): path of the file, its bytes or a binary file object
+        target_sr (int): sample rate of the yielded chunks
+        resampler (str): one of RESAMPLERS
+
+    Returns:
+        generator of np.ndarray chunks of shape (T,)
+    """
+    check_resampler(resampler)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+
+    try:
+        sound_file = sf.SoundFile(source)
+    except RuntimeError:
+        if hasattr(source, "seek"):
+            source.seek(0)
+        yield from stream_audio_ffmpeg(source, target_sr)
+        return
+
+    with sound_file:
+        yield from _sound_file_chunks(
+            sound_file, target_sr, SOXR_QUALITIES.get(resampler, "HQ")
+        )
+
+
+def prefetch_audio_chunks(chunks, samples: int):
+    """
+    Decode the first samples of a chunk stream ahead of time, e.g. on another
+    thread than the one that goes through the rest of it
+
+    Inputs:
+        chunks (iterable): consecutive np.ndarray chunks of shape (T,), e.g. from
+        iter_audio_chunks
+        samples (int): samples to decode now
+
+    Returns:
+        iterator of every chunk, the prefetched ones first
+    """
+    chunks = iter(chunks)
+    prefetched = []
+    decoded = 0
+    for chunk in chunks:
+        prefetched.append(chunk)
+        decoded += len(chunk)
+        if decoded >= samples:
+            break
+    return itertools.chain(prefetched, chunks)
+
+
+def iter_windows(chunks, window_samples: int, hop_samples: int):
+    """
+    Assemble consecutive waveform chunks into fixed-length overlapping windows.
+    Only one window is held at a time, whatever the length of the input.
+
+    Inputs:
+        chunks (iterable): consecutive np.ndarray chunks of shape (T,)
+        window_samples (int): length of a window
+        hop_samples (int): distance between the starts of two windows
+
+    Returns:
+        generator of (start_sample, window, is_last), the last window can be shorter
+    """
+    keep = window_samples - hop_samples
+    buffer = np.empty(window_samples, dtype=np.float32)
+    filled = 0
+    start = 0
+    pending = None
+
+    for chunk in chunks:
+        offset = 0
+        while offset < len(chunk):
+            take = min(window_samples - filled, len(chunk) - offset)
+            buffer[filled : filled + take] = chunk[offset : offset + take]
+            filled += take
+            offset += take
+
+            if filled == window_samples:
+                # Held back one window, to know which one is the last
+                if pending is not None:
+                    yield pending + (False,)
+                pending = (start, buffer.copy())
+                buffer[:keep] = buffer[hop_samples:]
+                filled = keep
+                start += hop_samples
+
+    # The tail after the last full window, unless that window already covers it
+    if filled > keep or (pending is None and filled):
+        if pending is not None:
+            yield pending + (False,)
+        pending = (start, buffer[:filled].copy())
+
+    if pending is not None:
+        yield pending + (True,)
+
+
+def to_mono(waveform: np.ndarray, channel_axis: int) -> np.ndarray:
+    """
+    Average the channels of a waveform along channel_axis into a float32 (T,)
+    waveform, a (T,) waveform is returned as it is
+    """
+    waveform = np.asarray(waveform, dtype=np.float32)
+    if waveform.ndim > 1:
+        waveform = waveform.mean(axis=channel_axis, dtype=np.float32)
+
+    return waveform
+
+
+def resample(
+    waveform: np.ndarray,
+    orig_sr: int,
+    target_sr: int,
+    resampler: str = DEFAULT_RESAMPLER,
+    channel_axis: int = 0,
+) -> np.ndarray:
+    """
+    Resample a waveform already in memory, it is downmixed to mono first
+
+    Inputs:
+        waveform (np.ndarray): waveform of shape (T,), or (C, T) / (T, C) with
+        channel_axis 0 / 1
+        orig_sr (int): sample rate of the waveform
+        target_sr (int): sample rate of the returned waveform
+        resampler (str): one of RESAMPLERS
+        channel_axis (int): axis of the channels of a multichannel waveform
+
+    Returns:
+        waveform (np.ndarray) of shape (T,)
+    """
+    check_resampler(resampler)
+    waveform = to_mono(waveform, channel_axis)
+    if orig_sr == target_sr:
+        return waveform
+
+    if resampler == "polyphase":
+        divisor = gcd(int(orig_sr), int(target_sr))
+        resampled = resample_poly(waveform, target_sr // divisor, orig_sr // divisor)
+        return resampled.astype(np.float32, copy=False)
+
+    return soxr.resample(
+        waveform, orig_sr, target_sr, quality=SOXR_QUALITIES[resampler]
+    )
+
+
+def check_resampler(resampler: str):
+    """Raise a ValueError for an unknown resampler name"""
+    if resampler not in RESAMPLERS:
+        raise ValueError(f"Unknown resampler {resampler}, choose one of {RESAMPLERS}")
+
+
+def _read_mono(sound_file) -> np.ndarray:
+    """Read a whole file block by block into a preallocated mono buffer"""
+    waveform = _Buffer(sound_file.frames)
+    for block in sound_file.blocks(BLOCK_FRAMES, dtype="float32", always_2d=True):
+        waveform.append(to_mono(block, channel_axis=1))
+
+    return waveform.finish()
+
+
+def _read_mono_resampled(sound_file, target_sr: int, quality: str) -> np.ndarray:
+    """Read a file block by block through a streaming soxr resampler"""
+    expected = int(np.ceil(sound_file.frames * target_sr / sound_file.samplerate))
+    waveform = _Buffer(expected)
+    for chunk in _sound_file_chunks(sound_file, target_sr, quality):
+        waveform.append(chunk)
+
+    return waveform.finish()
+
+
+def _sound_file_chunks(sound_file, target_sr: int, quality: str):
+    """Yield a file's blocks downmixed, and resampled by a streaming soxr resampler"""
+    stream = None
+    if sound_file.samplerate != target_sr:
+        stream = soxr.ResampleStream(
+            sound_file.samplerate, target_sr, 1, dtype="float32", quality=quality
+        )
+
+    for block in sound_file.blocks(BLOCK_FRAMES, dtype="float32", always_2d=True):
+        chunk = to_mono(block, channel_axis=1)
+        yield chunk if stream is None else stream.resample_chunk(chunk)
+    if stream is not None:
+        yield stream.resample_chunk(np.empty(0, dtype=np.float32), last=True)
+
+
+class _Buffer:
+    """Growable float32 buffer, preallocated to the expected length"""
+
+    def __init__(self, expected: int):
+        self.data = np.empty(max(int(expected), 1), dtype=np.float32)
+        self.size = 0
+
+    def append(self, chunk: np.ndarray):
+        end = self.size + len(chunk)
+        if end > len(self.data):
+            # The frame count was short (or unknown), grow in place when possible
+            self.data.resize(max(end, int(len(self.data) * 1.25)), refcheck=False)
+        self.data[self.size : end] = chunk
+        self.size = end
+
+    def finish(self) -> np.ndarray:
+        self.data.resize(self.size, refcheck=False)
+        return self.data
+
+
+def extract_audio_ffmpeg(source, desired_sr):
+    """
+    Decodes the audio track of any file ffmpeg can read (mp4, mp3, wav, ...)
+    into a float32 mono waveform at the desired samplerate.
+
+    ffmpeg does the downmix and the resampling and streams raw float32 PCM through
+    a pipe straight into a buffer preallocated from the probed duration, so peak
+    memory stays close to the size of the final array.
+
+    Inputs:
+        source: path of the file, its bytes, or a binary file object
+        desired_sr: samplerate of the returned waveform
+
+    Returns:
+        1-D float32 numpy array
+    """
+
+    with _run_ffmpeg(source, desired_sr) as (process, duration):
+        capacity = int(((duration or 60) + FFMPEG_SLACK_SECONDS) * desired_sr)
+        buffer = np.empty(capacity, dtype=np.float32)
+        filled_bytes = 0
+        while True:
+            if filled_bytes == buffer.nbytes:
+                # The probe was short (or missing), grow the buffer in place when possible
+                buffer.resize(int(buffer.size * 1.25) + desired_sr, refcheck=False)
+            view = memoryview(buffer).cast("B")[filled_bytes:]
+            read = process.stdout.readinto(view)
+            view.release()
+            if not read:
+                break
+            filled_bytes += read
+
+    if filled_bytes == 0:
+        raise ValueError("No audio could be extracted: no audio stream found")
+
+    buffer.resize(filled_bytes // buffer.itemsize, refcheck=False)
+    logging.info("Audio extracted, Shape : %s", buffer.shape)
+
+    return buffer
+
+
+def stream_audio_ffmpeg(source, desired_sr, chunk_samples=BLOCK_FRAMES):
+    """
+    Same decode as extract_audio_ffmpeg, but yields the waveform as consecutive
+    float32 chunks of chunk_samples samples instead of building the whole array
+    """
+
+    with _run_ffmpeg(source, desired_sr) as (process, _):
+        while True:
+            data = process.stdout.read(chunk_samples * 4)
+            if not data:
+                break
+            yield np.frombuffer(data, dtype=np.float32)
+
+
+@contextlib.contextmanager
+def _run_ffmpeg(source, desired_sr):
+    """
+    Starts ffmpeg decoding source into float32 mono PCM at desired_sr on its
+    stdout, yields (process, probed duration or None). Raises a ValueError with
+    ffmpeg's error if it failed, once the caller has read its output.
+    """
+
+    with _ffmpeg_input(source) as (input_path, pass_fds, stdin_source):
+        duration = (
+            probe_duration(input_path, pass_fds) if stdin_source is None else None
+        )
+        logging.info(
+            "Extracting audio with ffmpeg : %s SR, %s s probed", desired_sr, duration
+        )
+
+        # -nostdin keeps ffmpeg off stdin unless the input itself is piped there
+        command = (
+            ["ffmpeg", "-v", "error"]
+            if stdin_source is not None
+            else ["ffmpeg", "-nostdin", "-v", "error"]
+        )
+        command += [
+            "-i",
+            input_path,
+            "-vn",
+            "-ac",
+            "1",
+            "-ar",
+            str(desired_sr),
+            "-f",
+            "f32le",
+            "pipe:1",
+        ]
+        process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE if stdin_source is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            pass_fds=pass_fds,
+        )
+        writer = None
+        if stdin_source is not None:
+            writer = threading.Thread(
+                target=_write_stdin, args=(process.stdin, stdin_source), daemon=True
+            )
+            writer.start()
+
+        # ffmpeg errors go to stderr, drained in the background so it can never block
+        stderr_chunks = []
+        stderr_reader = threading.Thread(
+            target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True
+        )
+        stderr_reader.start()
+
+        try:
+            yield process, duration
+        finally:
+            # Closing stdout first also stops ffmpeg when the caller gave up early
+            process.stdout.close()
+            returncode = process.wait()
+            stderr_reader.join()
+            if writer is not None:
+                writer.join()
+
+    # Only reached when the caller read the output without raising
+    if returncode != 0:
+        error = b"".join(stderr_chunks).decode(errors="replace").strip()
+        raise ValueError(
+            f"No audio could be extracted: {error or 'no audio stream found'}"
+        )
+
+
+def audio_duration(path: str):
+    """Duration in seconds of an audio or video file, from its header, None if it is unknown"""
+    try:
+        return sf.info(path).duration
+    except RuntimeError:
+        return probe_duration(path)
+
+
+def probe_duration(input_path, pass_fds=()):
+    """
+    Reads the duration in seconds of a media file from its container header
+    with ffprobe, None if it is unknown
+    """
+
+    try:
+        result = subprocess.run(
+            [
+                "ffprobe",
+                "-v",
+                "error",
+                "-show_entries",
+                "format=duration",
+                "-of",
+                "default=noprint_wrappers=1:nokey=1",
+                input_path,
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+            pass_fds=pass_fds,
+        )
+        return float(result.stdout.strip())
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
+
+
+@contextlib.contextmanager
+def _ffmpeg_input(source):
+    """
+    Yields (input path, fds to pass to ffmpeg, data to write to its stdin) for a
+    path, bytes or binary file object.
+
+    In-memory sources are copied into an anonymous memory file where the platform
+    has one, which, unlike a pipe, is seekable: mp4 files keep their index at the
+    end of the file and ffmpeg can only read those from a seekable input.
+    Elsewhere they are streamed to ffmpeg's stdin.
+    """
+
+    if isinstance(source, (str, os.PathLike)):
+        yield os.fspath(source), (), None
+        return
+
+    if not hasattr(os, "memfd_create"):
+        yield "pipe:0", (), source
+        return
+
+    fd = os.memfd_create("ffmpeg-input")
+    try:
+        with open(fd, "wb", closefd=False) as memory_file:
+            if isinstance(source, (bytes, bytearray, memoryview)):
+                memory_file.write(source)
+            else:
+                shutil.copyfileobj(source, memory_file)
+        yield f"/dev/fd/{fd}", (fd,), None
+    finally:
+        os.close(fd)
+
+
+def _write_stdin(stdin, source):
+    try:
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            stdin.write(source)
+        else:
+            shutil.copyfileobj(source, stdin)
+    except BrokenPipeError:
+        # ffmpeg exited early, its error is reported from its exit code
+        pass
+    finally:
+        stdin.close()
@@ -0,0 +1,181 @@
+"""
+Binary encodings of audio returned by the API.
+
+A waveform is sent back as a byte stream instead of a JSON list of floats, which
+for minutes of audio means tens of megabytes of text and seconds of parsing:
+
+    wav    32-bit float WAV, the header then the samples in chunks
+    flac   FLAC at 24-bit precision, clipped to [-1, 1] and compressed
+    raw    bare little-endian float32 samples, rate and channels in the headers
+    json   the legacy DenoiseResponse list of floats, only when asked for
+"""
+
+import io
+import struct
+
+import numpy as np
+import soundfile as sf
+
+AUDIO_FORMATS = ("wav", "flac", "raw", "json")
+AUDIO_MEDIA_TYPES = {
+    "wav": "audio/wav",
+    "flac": "audio/flac",
+    "raw": "application/octet-stream",
+    "json": "application/json",
+}
+# Accept header media types of each format, besides the ones above
+_ACCEPT_ALIASES = {
+    "audio/wave": "wav",
+    "audio/x-wav": "wav",
+    "audio/vnd.wave": "wav",
+    "audio/x-flac": "flac",
+}
+DEFAULT_AUDIO_FORMAT = "wav"
+
+# Frames per chunk of a streamed response
+CHUNK_FRAMES = 1 << 16
+
+WAVE_FORMAT_IEEE_FLOAT = 3
+
+
+def parse_accept(accept: str) -> list:
+    """
+    Media types of an Accept header, most preferred first
+
+    Inputs:
+        accept (str): Accept header of a request, e.g. "audio/flac, */*;q=0.1"
+
+    Returns:
+        media_types (list): lower-cased media types with a quality above 0, by
+        decreasing quality then in the order given
+    """
+    ranges = []
+    for position, part in enumerate(accept.split(",")):
+        media_type, *params = [item.strip() for item in part.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            ranges.append((-quality, position, media_type.lower()))
+
+    return [media_type for _, _, media_type in sorted(ranges)]
+
+
+def negotiate_audio_format(accept: str = None, requested: str = None) -> str:
+    """
+    Pick the format of an audio response
+
+    Inputs:
+        accept (str): Accept header of the request, e.g. "audio/flac, */*;q=0.1"
+        requested (str): format asked for by name, wins over the Accept header
+
+    Returns:
+        format (str): one of AUDIO_FORMATS, DEFAULT_AUDIO_FORMAT when anything goes
+
+    Raises:
+        ValueError: when none of the formats asked for is supported
+    """
+    if requested:
+        if requested not in AUDIO_FORMATS:
+            raise ValueError(
+                f"Unknown audio format {requested!r}, expected one of {AUDIO_FORMATS}"
+            )
+        return requested
+
+    if not accept:
+        return DEFAULT_AUDIO_FORMAT
+
+    media_types = {media_type: fmt for fmt, media_type in AUDIO_MEDIA_TYPES.items()}
+    media_types.update(_ACCEPT_ALIASES)
+
+    for media_type in parse_accept(accept):
+        if media_type in media_types:
+            return media_types[media_type]
+        if media_type in ("*/*", "audio/*"):
+            return DEFAULT_AUDIO_FORMAT
+
+    raise ValueError(
+        f"None of {accept!r} is supported, expected one of {list(AUDIO_MEDIA_TYPES.values())}"
+    )
+
+
+def wav_header(frames: int, sample_rate: int, channels: int = 1) -> bytes:
+    """Header of a 32-bit float WAV file of frames frames"""
+    block_align = 4 * channels
+    data_size = frames * block_align
+    return (
+        struct.pack("<4sI4s", b"RIFF", 36 + data_size, b"WAVE")
+        + struct.pack(
+            "<4sIHHIIHH",
+            b"fmt ",
+            16,
+            WAVE_FORMAT_IEEE_FLOAT,
+            channels,
+            sample_rate,
+            sample_rate * block_align,
+            block_align,
+            32,
+        )
+        + struct.pack("<4sI", b"data", data_size)
+    )
+
+
+def encoded_size(waveform: np.ndarray, output_format: str):
+    """Size in bytes of the encoded audio, None when only known once encoded"""
+    if output_format == "raw":
+        return waveform.size * 4
+    if output_format == "wav":
+        return 44 + waveform.size * 4
+    return None
+
+
+def iter_encoded_audio(
+    waveform: np.ndarray,
+    sample_rate: int,
+    output_format: str,
+    chunk_frames: int = CHUNK_FRAMES,
+):
+    """
+    Yield a waveform encoded in a binary format, chunk by chunk
+
+    Inputs:
+        waveform (np.ndarray): mono waveform of shape (T,)
+        sample_rate (int): sample rate of the waveform
+        output_format (str): wav, flac or raw
+        chunk_frames (int): frames per chunk
+
+    Returns:
+        generator of bytes
+    """
+    samples = np.ascontiguousarray(waveform, dtype="<f4")
+
+    if output_format == "flac":
+        # The FLAC header holds the sample count, so it is encoded whole
+        buffer = io.BytesIO()
+        sf.write(
+            buffer,
+            np.clip(samples, -1.0, 1.0),
+            sample_rate,
+            format="FLAC",
+            subtype="PCM_24",
+        )
+        data = buffer.getbuffer()
+        chunk_bytes = chunk_frames * 3
+        for start in range(0, len(data), chunk_bytes):
+            yield bytes(data[start : start + chunk_bytes])
+        return
+
+    if output_format == "wav":
+        yield wav_header(len(samples), sample_rate)
+    elif output_format != "raw":
+        raise ValueError(f"Cannot stream audio as {output_format!r}")
+
+    data = memoryview(samples).cast("B")
+    chunk_bytes = chunk_frames * 4
+    for start in range(0, len(data), chunk_bytes):
+        yield bytes(data[start : start + chunk_bytes])
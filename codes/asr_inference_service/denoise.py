@@ -1,11 +1,14 @@
 import logging
 from time import perf_counter
 
+import numpy as np
 import torch
 import torchaudio
 from denoiser import pretrained
 from denoiser.dsp import convert_audio
 
+from codes.asr_inference_service.metrics import observe_model_load, observe_stage
+
 logging.basicConfig(
     format="%(levelname)s | %(asctime)s | %(message)s", level=logging.INFO
 )
@@ -22,7 +25,7 @@ class DENOISER:
         Inputs:
             device (str): path to model directory
             dry (float): value from 1 to 0, with 0 being the strongest denoiser
-            amplification_factor (float): 
+            amplification_factor (float):
             used for amplifying the audio clip (choose 1 to let waveform be unchanged)
         """
         logging.info("Denoiser loading... ")
@@ -31,7 +34,9 @@ class DENOISER:
         self.device = (
             device
             if device in ["cuda", "cpu"]
-            else "cuda" if torch.cuda.is_available() else "cpu"
+            else "cuda"
+            if torch.cuda.is_available()
+            else "cpu"
         )
 
         if self.device == "cuda":
@@ -41,6 +46,7 @@ class DENOISER:
 
         self.dry = dry
         self.amplification_factor = amplification_factor
+        self.sample_rate = self.model.sample_rate
 
         logging.info(
             "Denoiser Dry: %s",
@@ -51,20 +57,25 @@ class DENOISER:
         logging.info(
             "Denoiser loaded. Elapsed time: %s", denoiser_load_end - denoiser_load_start
         )
+        observe_model_load("denoiser", denoiser_load_end - denoiser_load_start)
 
-    def denoise(self, input_audio_filepath: str):
+    def denoise(self, audio, sample_rate: int = None):
         """
-        Method to run denoising on an audiofile to generate a numpy array of denoised audio
+        Method to run denoising on audio to generate a numpy array of denoised audio,
+        the output is at self.sample_rate
 
         Inputs:
-            input_audio_filepath (string): Takes in filepath of the input audio
+            audio (str/numpy.ndarray/torch.Tensor): filepath of the input audio, or a
+            waveform of shape (T,) or (C, T) already in memory
+            sample_rate (int): sample rate of the waveform, required for arrays
 
         Returns:
             denosied (numpy.ndarray): Output numpy array with denoised audio
         """
 
         logging.info("Denoiser triggered.")
-        wav, sr = torchaudio.load(input_audio_filepath)
+        denoise_start = perf_counter()
+        wav, sr = self.load_waveform(audio, sample_rate)
 
         wav = self.amplify_audio(
             wav=wav, amplification_factor=self.amplification_factor
@@ -82,6 +93,9 @@ class DENOISER:
         denoised = denoised[0]
         denoised = denoised.data.cpu().numpy()[0]
         logging.info("Denoiser Complete.")
+        observe_stage(
+            "denoise", perf_counter() - denoise_start, len(denoised) / self.sample_rate
+        )
 
         return denoised
 
@@ -103,3 +117,32 @@ class DENOISER:
         logging.info("Amplification Complete")
 
         return amplified_wav
+
+    @staticmethod
+    def load_waveform(audio, sample_rate: int = None):
+        """
+        Method to turn a filepath, numpy array or tensor into a (C, T) float tensor
+
+        Inputs:
+            audio (str/numpy.ndarray/torch.Tensor): filepath or waveform
+            sample_rate (int): sample rate of the waveform, required for arrays
+
+        Returns:
+            wav (torch.tensor): waveform of shape (C, T)
+            sr (int): sample rate of the waveform
+        """
+        if isinstance(audio, str):
+            return torchaudio.load(audio)
+
+        if sample_rate is None:
+            raise ValueError("sample_rate is required when denoising a waveform")
+
+        if isinstance(audio, torch.Tensor):
+            wav = audio.float()
+        else:
+            wav = torch.from_numpy(np.asarray(audio, dtype=np.float32))
+
+        if wav.dim() == 1:
+            wav = wav.unsqueeze(0)
+
+        return wav, sample_rate
@@ -1,10 +1,15 @@
 # from nemo.collections.asr.models.msdd_models import NeuralDiarizer
 # from nemo.utils import nemo_logging
 import logging
+from time import perf_counter
 
-import pandas as pd
+import numpy as np
 import torch
 from pyannote.audio import Pipeline
+from scipy.optimize import linear_sum_assignment
+
+from codes.asr_inference_service.metrics import observe_model_load
+from codes.asr_inference_service.segments import Segments
 
 logger_nemo = logging.getLogger("nemo_logger")
 logger_nemo.disabled = True
@@ -52,18 +57,19 @@ logger_nemo.disabled = True
 
 
 class PyannoteDiarizer:
-    '''
+    """
     Pyannote diarizer implementation
-    '''
+    """
 
     def __init__(
         self, device: str, min_segment_length: float, min_silence_length: float
     ):
-
         device = (
             device
             if device in ["cuda", "cpu"]
-            else "cuda" if torch.cuda.is_available() else "cpu"
+            else "cuda"
+            if torch.cuda.is_available()
+            else "cpu"
         )
         self.device = torch.device(device)
         logging.info("Running on device: %s", device)
@@ -74,66 +80,167 @@ class PyannoteDiarizer:
         self.min_silence_length = min_silence_length
         logging.info("Minimum Silence Length: %s", self.min_silence_length)
 
+        diarizer_load_start = perf_counter()
         self.diarizer = Pipeline.from_pretrained("pyannote/speaker-diarization-3.1").to(
             self.device
         )
+        observe_model_load("diarizer", perf_counter() - diarizer_load_start)
 
         logging.info("Pyannote model loaded!")
 
-    def diarize_into_string(self, audio_filepath: str) -> str:
+    @staticmethod
+    def to_pyannote_input(audio, sample_rate: int = None):
+        """
+        Convert an audio filepath, numpy array or tensor into something the pyannote
+        pipeline accepts. Arrays are handed over in memory as a
+        {"waveform", "sample_rate"} dict so the audio is not decoded again.
+
+        Inputs:
+            audio (str/np.ndarray/torch.Tensor): filepath, or mono waveform of shape (T,)
+            sample_rate (int): sample rate of the waveform, required for arrays
         """
-        Diarize from audio_filepath to string with format:
+        if isinstance(audio, str):
+            return audio
+
+        if sample_rate is None:
+            raise ValueError("sample_rate is required when diarizing a waveform")
+
+        if isinstance(audio, torch.Tensor):
+            waveform = audio.detach().float().cpu()
+        else:
+            waveform = torch.from_numpy(np.asarray(audio, dtype=np.float32))
+
+        if waveform.dim() == 1:
+            waveform = waveform.unsqueeze(0)
+
+        return {"waveform": waveform, "sample_rate": sample_rate}
+
+    def diarize_into_string(self, audio, sample_rate: int = None) -> str:
+        """
+        Diarize from audio filepath or waveform to string with format:
 
         start={}s stop={}s speaker_{} \n
         """
 
         logging.info("Diarization started")
-        diarization = self.diarizer(audio_filepath)
-        simple_text = ""
+        diarization = self.diarizer(self.to_pyannote_input(audio, sample_rate))
 
-        for turn, _, cur_speaker in diarization.itertracks(yield_label=True):
-            simple_text += (
-                f"start={turn.start:.3f}s stop={turn.end:.3f}s speaker_{cur_speaker} \n"
-            )
+        return "".join(
+            f"start={start:.3f}s stop={end:.3f}s speaker_{speaker} \n"
+            for start, end, speaker in Segments.from_annotation(diarization)
+        )
 
-        return simple_text
+    def diarize(self, audio, sample_rate: int = None) -> Segments:
+        """
+        Diarize from audio filepath or waveform to Segments, filtered and merged
+        as in to_segments
+        """
+
+        logging.info("Diarization started")
+        diarization = self.diarizer(self.to_pyannote_input(audio, sample_rate))
 
-    def diarize(self, audio_filepath: str) -> pd.DataFrame:
+        return self.to_segments(diarization)
+
+    def diarize_with_embeddings(self, audio, sample_rate: int = None):
         """
-        Diarize from audio_filepath to pandas dataframe with format:
+        Diarize like diarize, also returning the pipeline's centroid embedding of
+        each speaker, used to link speakers across windows of a long recording
 
-        ['start_time', 'end_time', 'speaker', 'text']
+        Returns:
+            segments (Segments): speaker turns of the audio
+            embeddings (dict): speaker label to embedding (np.ndarray), the
+            embedding is NaN for a speaker with too little speech to embed
         """
 
         logging.info("Diarization started")
-        diarization = self.diarizer(audio_filepath)
-        df_diarized = pd.DataFrame(columns=["start_time", "end_time", "speaker", "text"])
-        prev_speaker = "None"
+        diarization, centroids = self.diarizer(
+            self.to_pyannote_input(audio, sample_rate), return_embeddings=True
+        )
+        # centroids[i] belongs to the i-th label, and is missing when nobody speaks
+        embeddings = {
+            label: centroids[index]
+            for index, label in enumerate(diarization.labels())
+            if centroids is not None and index < len(centroids)
+        }
 
-        for turn, _, speaker in diarization.itertracks(yield_label=True):
+        return self.to_segments(diarization), embeddings
 
-            start_time, stop_time, cur_speaker = (
-                round(turn.start, 3),
-                round(turn.end, 3),
-                speaker,
-            )
-            duration = stop_time - start_time
+    def to_segments(self, diarization) -> Segments:
+        """
+        Turn a pyannote annotation into Segments, with times rounded to the
+        millisecond, dropping turns shorter than min_segment_length and merging
+        consecutive turns of a speaker unless separated by more than
+        min_silence_length
+        """
 
-            if duration < self.min_segment_length:
-                continue
+        return (
+            Segments.from_annotation(diarization, decimals=3)
+            .filter_min_length(self.min_segment_length)
+            .merge_same_speaker(self.min_silence_length)
+        )
 
-            if cur_speaker == prev_speaker:
 
-                if start_time - prev_stoptime > self.min_silence_length:
+class SpeakerLinker:
+    """
+    Links the speaker labels pyannote assigns independently in each window of a
+    long recording to labels that hold across the whole recording.
 
-                    df_diarized.loc[len(df_diarized)] = start_time, stop_time, cur_speaker, ""
+    Every global speaker keeps the running mean of its unit-normalised embeddings.
+    The speakers of a new window are matched one-to-one to the global speakers by
+    cosine similarity (optimal assignment), a match below the threshold or a
+    speaker without an embedding starts a new global speaker.
+    """
 
-                df_diarized.loc[df_diarized.index[-1], "end_time"] = stop_time
+    def __init__(self, threshold: float = 0.3):
+        self.threshold = threshold
+        self.embedding_sums = []
 
-            else:
-                df_diarized.loc[len(df_diarized)] = start_time, stop_time, cur_speaker, ""
+    def link(self, embeddings: dict) -> dict:
+        """
+        Map the speaker labels of one window to global labels
 
-            prev_speaker = cur_speaker
-            prev_stoptime = stop_time
+        Inputs:
+            embeddings (dict): window speaker label to embedding (np.ndarray)
 
-        return df_diarized
\ No newline at end of file
+        Returns:
+            mapping (dict): window speaker label to global label, SPEAKER_{n:02d}
+        """
+        labels = [
+            label
+            for label, embedding in embeddings.items()
+            if np.all(np.isfinite(embedding))
+        ]
+        known = [
+            index
+            for index, total in enumerate(self.embedding_sums)
+            if total is not None
+        ]
+        mapping = {}
+
+        if labels and known:
+            window = self.normalise(np.stack([embeddings[label] for label in labels]))
+            centroids = self.normalise(
+                np.stack([self.embedding_sums[index] for index in known])
+            )
+            similarity = window @ centroids.T
+
+            for row, column in zip(*linear_sum_assignment(-similarity)):
+                if similarity[row, column] >= self.threshold:
+                    mapping[labels[row]] = known[column]
+
+        for label, embedding in embeddings.items():
+            if label not in mapping:
+                mapping[label] = len(self.embedding_sums)
+                self.embedding_sums.append(None)
+            if np.all(np.isfinite(embedding)):
+                index = mapping[label]
+                unit = self.normalise(embedding[None])[0]
+                total = self.embedding_sums[index]
+                self.embedding_sums[index] = unit if total is None else total + unit
+
+        return {label: f"SPEAKER_{index:02d}" for label, index in mapping.items()}
+
+    @staticmethod
+    def normalise(embeddings: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.maximum(norms, 1e-12)
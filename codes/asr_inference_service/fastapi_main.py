@@ -4,25 +4,59 @@ API module for ASR service.
 This module provides the FastAPI application for performing ASR.
 """
 
-import io
+import asyncio
+import contextlib
+import json
 import logging
 import os
 import shutil
-import tempfile
+import uuid
+from time import perf_counter, strftime
 
 import soundfile as sf
 import uvicorn
-from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi import FastAPI, File, HTTPException, Query, Request, Response, UploadFile
+from fastapi.responses import JSONResponse, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+from starlette.routing import Match
 from starlette.status import HTTP_200_OK
 
-from codes.asr_inference_service.audio_preprocessing import (
-    get_numpy_array_from_mp4,
-    resample_audio_array,
+from codes.asr_inference_service.audio_ingest import audio_duration, load_audio
+from codes.asr_inference_service.audio_output import (
+    AUDIO_MEDIA_TYPES,
+    encoded_size,
+    iter_encoded_audio,
+    negotiate_audio_format,
 )
 from codes.asr_inference_service.denoise import DENOISER
+from codes.asr_inference_service.inference_executor import InferenceExecutor, Overloaded
+from codes.asr_inference_service.job_queue import FINISHED_STATES, JobQueue, JobUpdates
+from codes.asr_inference_service.metrics import (
+    HTTP_REQUEST_SECONDS,
+    HTTP_REQUESTS,
+    HTTP_REQUESTS_IN_PROGRESS,
+)
+from codes.asr_inference_service.micro_batcher import MicroBatcher
 from codes.asr_inference_service.model import ASRModelForInference
-from codes.asr_inference_service.schemas import ASRResponse, DenoiseResponse, HealthResponse
+from codes.asr_inference_service.profiling import RequestProfile, parse_profilers
+from codes.asr_inference_service.result_cache import (
+    ResultCache,
+    fingerprint,
+    hash_audio,
+)
+from codes.asr_inference_service.schemas import (
+    ASRResponse,
+    DenoiseResponse,
+    HealthResponse,
+    JobResponse,
+)
+from codes.asr_inference_service.transcript import (
+    OUTPUT_MEDIA_TYPES,
+    check_output_format,
+    iter_transcript,
+)
 
 SERVICE_HOST = "0.0.0.0"
 SERVICE_PORT = 8080
@@ -33,7 +67,16 @@ logging.basicConfig(
 
 logging.getLogger("nemo_logger").setLevel(logging.ERROR)
 
-app = FastAPI()
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run the /v2/jobs worker for as long as the service is up"""
+    worker = asyncio.create_task(run_jobs())
+    yield
+    worker.cancel()
+
+
+app = FastAPI(lifespan=lifespan)
 model = ASRModelForInference(
     model_dir=os.environ["PRETRAINED_MODEL_DIR"],
     sample_rate=int(os.environ["SAMPLE_RATE"]),
@@ -41,6 +84,14 @@ model = ASRModelForInference(
     timestamp_format=os.environ["TIMESTAMPS_FORMAT"],
     min_segment_length=float(os.environ["MIN_SEGMENT_LENGTH"]),
     min_silence_length=float(os.environ["MIN_SILENCE_LENGTH"]),
+    asr_batch_size=int(os.environ.get("ASR_BATCH_SIZE", "8")),
+    resampler=os.environ.get("RESAMPLER", "soxr_hq"),
+    diar_window_seconds=float(os.environ.get("DIAR_WINDOW_SECONDS", "0")),
+    diar_window_overlap_seconds=float(
+        os.environ.get("DIAR_WINDOW_OVERLAP_SECONDS", "30")
+    ),
+    asr_backend=os.environ.get("ASR_BACKEND", "hf"),
+    asr_compute_type=os.environ.get("ASR_COMPUTE_TYPE", ""),
 )
 
 if int(os.environ["DENOISER"]):
@@ -52,14 +103,415 @@ if int(os.environ["DENOISER"]):
 
 SAMPLE_RATE = int(os.environ["SAMPLE_RATE"])
 
+# Requests may ask for profiling with an X-Profile header or a profile query
+# parameter, e.g. "cprofile,torch", only when ALLOW_PROFILING is set
+ALLOW_PROFILING = bool(int(os.environ.get("ALLOW_PROFILING", "0")))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+
+# Transcripts kept by decoded audio hash and model config, 0 turns the cache off
+RESULT_CACHE_MAX_BYTES = (
+    int(os.environ.get("RESULT_CACHE_MAX_MB", "1024")) * 1024 * 1024
+)
+result_cache = (
+    ResultCache(
+        os.environ.get("RESULT_CACHE_DIR", "result_cache"), RESULT_CACHE_MAX_BYTES
+    )
+    if RESULT_CACHE_MAX_BYTES
+    else None
+)
+MODEL_FINGERPRINT = model.config_fingerprint()
+
+# Model calls run off the event loop, INFERENCE_WORKERS at a time with up to
+# INFERENCE_QUEUE_SIZE more waiting. Requests past that get a 503 with Retry-After
+inference = InferenceExecutor(
+    max_workers=int(os.environ.get("INFERENCE_WORKERS", "1")),
+    max_queue=int(os.environ.get("INFERENCE_QUEUE_SIZE", "8")),
+    retry_after=int(os.environ.get("INFERENCE_RETRY_AFTER", "10")),
+)
+
+# Concurrent /v1/transcribe_filepath requests are transcribed together, up to
+# MICRO_BATCH_MAX_SIZE clips waiting at most MICRO_BATCH_MAX_WAIT_MS for each
+# other. A max size of 1 turns batching off
+MICRO_BATCH_MAX_SIZE = int(os.environ.get("MICRO_BATCH_MAX_SIZE", "8"))
+batcher = MicroBatcher(
+    lambda waveforms: inference.call(model.infer_batch, waveforms),
+    max_batch_size=MICRO_BATCH_MAX_SIZE,
+    max_wait=float(os.environ.get("MICRO_BATCH_MAX_WAIT_MS", "5")) / 1000,
+)
+
+
+# Asynchronous /v2/jobs, queued in SQLite under JOBS_DIR. At most JOBS_MAX_QUEUED
+# wait at once, results are kept JOB_RESULT_TTL_HOURS after their job finished
+job_queue = JobQueue(
+    os.environ.get("JOBS_DIR", "jobs"),
+    result_ttl=float(os.environ.get("JOB_RESULT_TTL_HOURS", "24")) * 3600,
+)
+JOBS_MAX_QUEUED = int(os.environ.get("JOBS_MAX_QUEUED", "100"))
+# Seconds between two keepalive comments of an idle event stream
+JOB_EVENTS_KEEPALIVE = 15
+# Seconds the jobs worker waits after an error of the queue
+JOBS_ERROR_BACKOFF = 1
+jobs_waiting = asyncio.Event()
+job_updates = JobUpdates()
+
+
+def cache_key(audio, kind: str) -> str:
+    """Result cache key of decoded audio, the same for any file format it came in"""
+    return result_cache.key(hash_audio(audio), kind, MODEL_FINGERPRINT)
+
+
+async def cached_transcription(audio, kind: str, transcribe) -> str:
+    """
+    Return the cached transcript of decoded audio, or run transcribe and cache its result
+
+    Inputs:
+        audio (np.ndarray): the decoded upload
+        kind (str): kind of transcription, part of the cache key
+        transcribe (async callable): produces the transcript on a miss
+
+    Returns:
+        transcription (str)
+    """
+    if result_cache is None:
+        return await transcribe()
+
+    key = await run_in_threadpool(cache_key, audio, kind)
+    transcription = await run_in_threadpool(result_cache.get, key)
+    if transcription is None:
+        transcription = str(await transcribe())
+        await run_in_threadpool(result_cache.put, key, transcription)
+
+    return transcription
+
+
+def as_model_input(audio, sample_rate: int):
+    return audio, sample_rate
+
+
+async def diarized_response(
+    file: UploadFile, kind: str, output_format: str, decode, prepare=as_model_input
+):
+    """
+    Diarized transcript of an upload. The text format is returned in an
+    ASRResponse, SRT, WebVTT and JSON are streamed segment by segment as they are
+    transcribed. Either way the finished transcript goes into the result cache,
+    keyed by the decoded audio
+
+    Inputs:
+        file (UploadFile): uploaded audio
+        kind (str): kind of transcription, part of the cache key
+        output_format (str): one of OUTPUT_FORMATS
+        decode (callable): decodes the upload, returning (audio, sample_rate)
+        prepare (callable): turns the decoded audio into the (audio, sample_rate)
+        the model runs on, e.g. by denoising it, only called on a cache miss
+
+    Returns:
+        ASRResponse dict, or a Response with the transcript as its body
+    """
+    try:
+        check_output_format(output_format)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+    # Decoded before returning, the upload is closed once the handler is done
+    audio, sample_rate = await run_in_threadpool(decode)
+
+    if output_format == "text":
+        transcription = await cached_transcription(
+            audio,
+            kind,
+            lambda: inference.run(
+                lambda: model.diar_inference(*prepare(audio, sample_rate))
+            ),
+        )
+        return {"transcription": str(transcription)}
+
+    kind = f"{kind}:{output_format}"
+    media_type = OUTPUT_MEDIA_TYPES[output_format]
+    key = None
+    if result_cache is not None:
+        key = await run_in_threadpool(cache_key, audio, kind)
+        transcription = await run_in_threadpool(result_cache.get, key)
+        if transcription is not None:
+            return Response(transcription, media_type=media_type)
+
+    # The request keeps its place in the executor until the stream ends, fails or
+    # the client goes away
+    inference.admit()
+    try:
+        audio, sample_rate = await inference.call(prepare, audio, sample_rate)
+    except BaseException:
+        inference.release()
+        raise
+    chunks = iter_transcript(
+        model.iter_diar_segments(audio, sample_rate),
+        output_format,
+        model.timestamp_format,
+    )
+    return StreamingResponse(
+        inference.stream(cache_chunks(chunks, key)),
+        media_type=media_type,
+    )
+
+
+def cache_chunks(chunks, key: str = None):
+    """
+    Pass the chunks of a streamed transcript through, caching the whole transcript
+    once the last one is sent. A stream cut short by the client is not cached
+    """
+    sent = []
+    for chunk in chunks:
+        sent.append(chunk)
+        yield chunk
+
+    if key is not None:
+        result_cache.put(key, "".join(sent))
+
+
+def denoise_job_audio(audio_path: str):
+    """
+    Denoise the audio of a job into a mono waveform at the model sample rate
+
+    Inputs:
+        audio_path (str): the uploaded audio
+
+    Returns:
+        waveform (np.ndarray) of shape (T,)
+    """
+    data, samplerate = sf.read(audio_path, dtype="float32", always_2d=True)
+    return model.prepare_waveform(
+        denoiser.denoise(data.T, samplerate), denoiser.sample_rate
+    )
+
+
+async def run_job(job: dict):
+    """Diarize and transcribe a claimed job, storing its segments as they come"""
+    try:
+        if job["kind"] == "denoise_diarize":
+            audio = await inference.call(denoise_job_audio, job["audio_path"])
+            duration = len(audio) / model.target_sr
+        else:
+            # Decoded by the model, window by window in windowed mode
+            audio = job["audio_path"]
+            duration = await run_in_threadpool(audio_duration, audio)
+        await run_in_threadpool(job_queue.set_duration, job["id"], duration)
+
+        # One segment at a time on the inference executor, API requests get the
+        # workers in between
+        index = 0
+        async for segment in inference.iterate(
+            model.iter_diar_segments(audio, model.target_sr)
+        ):
+            await run_in_threadpool(job_queue.add_segment, job["id"], index, segment)
+            await job_updates.notify()
+            index += 1
+    except Exception as error:
+        logging.exception("Job %s failed", job["id"])
+        await run_in_threadpool(job_queue.finish, job["id"], repr(error))
+    else:
+        await run_in_threadpool(job_queue.finish, job["id"])
+    await job_updates.notify()
+
+
+async def run_jobs():
+    """
+    Run the queued jobs one after the other, expiring old results in between. An
+    error in the queue itself, e.g. a locked database or a full disk, is logged
+    and the worker goes on with the next job
+    """
+    while True:
+        jobs_waiting.clear()
+        job = None
+        try:
+            await run_in_threadpool(job_queue.expire)
+            job = await run_in_threadpool(job_queue.claim)
+            if job is not None:
+                await run_job(job)
+                continue
+        except Exception as error:
+            logging.exception("Jobs worker error")
+            if job is not None:
+                await fail_job(job, error)
+            # A queue still failing is not retried in a busy loop
+            await asyncio.sleep(JOBS_ERROR_BACKOFF)
+            continue
+
+        try:
+            await asyncio.wait_for(jobs_waiting.wait(), 60)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def fail_job(job: dict, error: Exception):
+    """Mark a job failed after an error outside of its run, when the queue allows it"""
+    try:
+        await run_in_threadpool(job_queue.finish, job["id"], repr(error))
+    except Exception:
+        logging.exception("Job %s could not be marked failed", job["id"])
+    await job_updates.notify()
+
+
+def job_response(job: dict) -> dict:
+    """JobResponse of a job row"""
+    if job["state"] == "done":
+        progress = 1.0
+    elif job["audio_seconds"]:
+        progress = min(1.0, job["processed_seconds"] / job["audio_seconds"])
+    else:
+        progress = 0.0
+
+    return {
+        "job_id": job["id"],
+        "state": job["state"],
+        "output_format": job["output_format"],
+        "progress": round(progress, 4),
+        "segments": job["segments"],
+        "audio_seconds": job["audio_seconds"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+    }
+
+
+async def get_job(job_id: str) -> dict:
+    """The job row of an id, 404 when it is unknown or expired"""
+    job = await run_in_threadpool(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired.")
+    return job
+
+
+def server_sent_event(event: str, data: dict, event_id: int = None) -> str:
+    lines = [] if event_id is None else [f"id: {event_id}"]
+    lines += [f"event: {event}", f"data: {json.dumps(data)}"]
+    return "\n".join(lines) + "\n\n"
+
+
+async def job_events(job_id: str, after: int):
+    """
+    Server-sent events of a job: a segment event per transcribed segment with an
+    index above after, then a done or failed event with the job status
+    """
+    while True:
+        version = job_updates.version
+        for index, segment in await run_in_threadpool(
+            job_queue.segments, job_id, after
+        ):
+            after = index
+            yield server_sent_event("segment", segment._asdict(), index)
+
+        job = await run_in_threadpool(job_queue.get, job_id)
+        if job is None:
+            return
+        if job["state"] in FINISHED_STATES:
+            # Segments stored between the query above and the end of the job
+            for index, segment in await run_in_threadpool(
+                job_queue.segments, job_id, after
+            ):
+                yield server_sent_event("segment", segment._asdict(), index)
+            yield server_sent_event(job["state"], job_response(job))
+            return
+
+        if not await job_updates.wait(version, JOB_EVENTS_KEEPALIVE):
+            # Keeps proxies from closing an idle stream
+            yield ": keepalive\n\n"
+
 
 class AudioData(BaseModel):
-    '''
+    """
     Audio data class for transfering in Fastapi
-    '''
+    """
+
     array: list
 
 
+@app.exception_handler(Overloaded)
+async def reject_overloaded(request: Request, error: Overloaded):
+    """Turn a request away when the inference queue is full, with a Retry-After"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(error)},
+        headers={"Retry-After": str(error.retry_after)},
+    )
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """
+    Record the latency, status and concurrency of every request, labelled by
+    route template so path parameters do not add label values
+    """
+    for route in app.router.routes:
+        if route.matches(request.scope)[0] == Match.FULL:
+            endpoint = route.path
+            break
+    else:
+        endpoint = "unmatched"
+
+    in_progress = HTTP_REQUESTS_IN_PROGRESS.labels(endpoint)
+    in_progress.inc()
+    start = perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        in_progress.dec()
+        HTTP_REQUEST_SECONDS.labels(endpoint).observe(perf_counter() - start)
+        HTTP_REQUESTS.labels(endpoint, str(status)).inc()
+
+
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    """
+    Profile a request that asks for it, the saved profiles are named in the
+    X-Profile-Path response header. cProfile covers the model calls the request
+    runs on the inference executor, torch everything done while it is handled.
+    A streamed response is profiled until its body is sent. One request is
+    profiled at a time, others asking for it get a 409
+    """
+    requested = request.headers.get("X-Profile") or request.query_params.get("profile")
+    if not requested:
+        return await call_next(request)
+
+    if not ALLOW_PROFILING:
+        return JSONResponse(
+            status_code=403, content={"detail": "Profiling is not enabled."}
+        )
+    try:
+        profilers = parse_profilers(requested)
+    except ValueError as error:
+        return JSONResponse(status_code=400, content={"detail": str(error)})
+
+    name = f"{strftime('%Y%m%d-%H%M%S')}-{request.url.path.strip('/').replace('/', '_')}-{uuid.uuid4().hex[:8]}"
+    profile = RequestProfile(name, PROFILE_DIR, profilers)
+    if not profile.start():
+        return JSONResponse(
+            status_code=409, content={"detail": "Another request is being profiled."}
+        )
+    try:
+        with profile.active():
+            response = await call_next(request)
+    except BaseException:
+        profile.stop()
+        raise
+
+    response.headers["X-Profile-Path"] = profile.path
+    response.body_iterator = profiled_body(response.body_iterator, profile)
+    return response
+
+
+async def profiled_body(body_iterator, profile: RequestProfile):
+    """Pass a response body through, saving its profile once it is sent"""
+    try:
+        async for chunk in body_iterator:
+            yield chunk
+    finally:
+        profile.stop()
+
+
 @app.get("/", status_code=HTTP_200_OK)
 async def read_root():
     """Root Call"""
@@ -76,126 +528,263 @@ async def read_health() -> HealthResponse:
     return {"status": "HEALTHY"}
 
 
+@app.get("/metrics")
+async def read_metrics():
+    """
+    Prometheus metrics of the service: stage latencies, audio seconds processed,
+    real-time factor, model load times and request counts
+    """
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.post("/v1/transcribe_filepath", response_model=ASRResponse)
 async def transcribe(file: UploadFile = File(...)):
     """
-    Function call to takes in an audio file as bytes, 
+    Function call to takes in an audio file as bytes,
     and executes model inference
     """
     if not file.filename.lower().endswith(".wav"):
         raise HTTPException(status_code=400, detail="File uploaded is not a wav file.")
 
-    # Receive the audio bytes from the request
-    audio_bytes = file.file.read()
+    def decode_upload():
+        # Decoded, downmixed and resampled in a single pass
+        return load_audio(file.file, SAMPLE_RATE, model.resampler)
+
+    # Decoded off the inference workers, which only run the forward passes
+    waveform = await run_in_threadpool(decode_upload)
+
+    async def transcribe_upload():
+        if MICRO_BATCH_MAX_SIZE <= 1:
+            return await inference.run(model.infer, waveform, SAMPLE_RATE)
 
-    # load with soundfile, data will be a numpy array
-    data, samplerate = sf.read(io.BytesIO(audio_bytes))
-    transcription = model.infer(data, samplerate)
+        inference.admit()
+        try:
+            return await batcher.submit(waveform)
+        finally:
+            inference.release()
+
+    transcription = await cached_transcription(
+        waveform, "transcribe", transcribe_upload
+    )
 
     return {"transcription": str(transcription)}
 
 
-@app.post("/v1/denoise_filepath", response_model=DenoiseResponse)
-async def transcribe(file: UploadFile = File(...)):
+@app.post(
+    "/v1/denoise_filepath",
+    response_model=DenoiseResponse,
+    responses={
+        200: {
+            "content": {media_type: {} for media_type in AUDIO_MEDIA_TYPES.values()},
+            "description": "Denoised audio, JSON only when asked for",
+        }
+    },
+)
+async def transcribe(
+    request: Request,
+    file: UploadFile = File(...),
+    audio_format: str = Query(None, alias="format"),
+):
     """
     Function call to takes in an audio file as bytes,
-    and executes model inference
+    and executes model inference.
+    The denoised audio is streamed back as wav (the default), flac or raw float32,
+    picked by the format parameter or else the Accept header. format=json or
+    Accept: application/json returns the legacy DenoiseResponse
     """
     if not file.filename.lower().endswith(".wav"):
         raise HTTPException(status_code=400, detail="File uploaded is not a wav file.")
 
-    with tempfile.NamedTemporaryFile(delete=True, suffix=".wav") as temp_file:
-
-        shutil.copyfileobj(file.file, temp_file)
-
-        temp_file_path = temp_file.name
-
-        denoised = denoiser.denoise(temp_file_path)
-
-    return {"denoise_audio": denoised.tolist()}
+    try:
+        output_format = negotiate_audio_format(
+            request.headers.get("Accept"), audio_format
+        )
+    except ValueError as error:
+        raise HTTPException(status_code=400 if audio_format else 406, detail=str(error))
+
+    def denoise_upload():
+        data, samplerate = sf.read(file.file, dtype="float32", always_2d=True)
+        return denoiser.denoise(data.T, samplerate)
+
+    denoised = await inference.run(denoise_upload)
+
+    if output_format == "json":
+        return {"denoise_audio": denoised.tolist()}
+
+    headers = {"X-Sample-Rate": str(denoiser.sample_rate), "X-Channels": "1"}
+    size = encoded_size(denoised, output_format)
+    if size is not None:
+        headers["Content-Length"] = str(size)
+    return StreamingResponse(
+        iter_encoded_audio(denoised, denoiser.sample_rate, output_format),
+        media_type=AUDIO_MEDIA_TYPES[output_format],
+        headers=headers,
+    )
 
 
 @app.post("/v1/transcribe_diarize_filepath", response_model=ASRResponse)
-async def transcribe_diarize_filepath(file: UploadFile = File(...)):
+async def transcribe_diarize_filepath(
+    file: UploadFile = File(...), output_format: str = "text"
+):
     """
-    Function call to takes in an audio file as bytes, 
-    saves it as a temp .wav file and executes model inference
+    Function call to takes in an audio file as bytes,
+    decodes it in memory and executes model inference.
+    output_format is one of text, srt, vtt or json
     """
-    
+
     if not file.filename.lower().endswith(".wav"):
         raise HTTPException(status_code=400, detail="File uploaded is not a wav file.")
 
-    with tempfile.NamedTemporaryFile(delete=True, suffix=".wav") as temp_file:
-        # Write the content of the uploaded file to the temporary file
-        shutil.copyfileobj(file.file, temp_file)
-
-        temp_file_path = temp_file.name
-        transcription = model.diar_inference(temp_file_path)
-
-    return {"transcription": str(transcription)}
+    return await diarized_response(
+        file,
+        "diarize",
+        output_format,
+        lambda: (load_audio(file.file, SAMPLE_RATE, model.resampler), SAMPLE_RATE),
+    )
 
 
 @app.post("/v1/transcribe_diarize_denoise_filepath", response_model=ASRResponse)
-async def transcribe_diarize_denoise_filepath(file: UploadFile = File(...)):
+async def transcribe_diarize_denoise_filepath(
+    file: UploadFile = File(...), output_format: str = "text"
+):
     """
-    Function call to takes in an audio file as bytes, 
-    saves it as a temp .wav file and executes model inference
+    Function call to takes in an audio file as bytes,
+    decodes it in memory, denoises it and executes model inference.
+    output_format is one of text, srt, vtt or json
     """
     if not file.filename.lower().endswith(".wav"):
         raise HTTPException(status_code=400, detail="File uploaded is not a wav file.")
 
-    with tempfile.NamedTemporaryFile(delete=True, suffix=".wav") as temp_file:
-        # Write the content of the uploaded file to the temporary file
-        shutil.copyfileobj(file.file, temp_file)
-
-        temp_file_path = temp_file.name
-
-        denoised = denoiser.denoise(temp_file_path)
-
-        sf.write(temp_file_path, denoised, int(os.environ["SAMPLE_RATE"]))
+    def read_upload():
+        return sf.read(file.file, dtype="float32", always_2d=True)
 
-        transcription = model.diar_inference(temp_file_path)
+    def denoise(data, samplerate):
+        return denoiser.denoise(data.T, samplerate), denoiser.sample_rate
 
-    return {"transcription": str(transcription)}
+    # Keyed by the audio before denoising, a hit skips the denoiser too
+    kind = "denoise_diarize:" + fingerprint(
+        {"dry": denoiser.dry, "amplification_factor": denoiser.amplification_factor}
+    )
+    return await diarized_response(file, kind, output_format, read_upload, denoise)
 
 
 @app.post("/v1/transcribe_resample_diarize_filepath", response_model=ASRResponse)
-async def transcribe_resample_diarize_filepath(file: UploadFile = File(...)):
+async def transcribe_resample_diarize_filepath(
+    file: UploadFile = File(...), output_format: str = "text"
+):
     """
-    Function call to takes in an audio file as bytes, 
-    saves it as a temp .wav file and executes model inference
+    Function call to takes in an audio file as bytes,
+    resamples it in memory and executes model inference.
+    output_format is one of text, srt, vtt or json
     """
 
-    # Check mp4
-    if file.filename.lower().endswith(".mp4"):
-        audio_bytes = await file.read()
-        data, samplerate = get_numpy_array_from_mp4(audio_bytes)
+    # Error if it is not mp3, wav or mp4
+    if not file.filename.lower().endswith((".wav", ".mp3", ".mp4")):
+        raise HTTPException(
+            status_code=400,
+            detail="File uploaded is not an accepted file type. (mp3, wav, mp4)",
+        )
+
+    def decode_upload():
+        # Decoded, downmixed and resampled in a single pass, mp4 through ffmpeg
+        try:
+            y = load_audio(file.file, SAMPLE_RATE, model.resampler)
+        except ValueError as error:
+            raise HTTPException(status_code=400, detail=str(error))
+
+        return y, SAMPLE_RATE
 
-    # Check if not wav or mp3 (Error if it is not mp3, wav or mp4)
-    elif not (
-        file.filename.lower().endswith(".wav") or file.filename.lower().endswith(".mp3")
-    ):
+    return await diarized_response(file, "diarize", output_format, decode_upload)
+
+
+@app.post("/v2/jobs", status_code=202, response_model=JobResponse)
+async def create_job(
+    file: UploadFile = File(...), denoise: bool = False, output_format: str = "text"
+):
+    """
+    Queue an audio file for diarization and transcription and return its job at
+    once. Follow it with GET /v2/jobs/{job_id} or its /events stream, and fetch
+    the transcript in output_format from /result once it is done.
+    denoise runs the denoiser first, on wav files only
+    """
+    extension = os.path.splitext(file.filename.lower())[1]
+    if extension not in ((".wav",) if denoise else (".wav", ".mp3", ".mp4")):
         raise HTTPException(
             status_code=400,
-            detail="File uploaded is not an accepted file type. (mp3, wav)",
+            detail="File uploaded is not an accepted file type. (wav, or mp3 and mp4 without denoise)",
+        )
+    if denoise and not int(os.environ["DENOISER"]):
+        raise HTTPException(status_code=400, detail="The denoiser is not enabled.")
+    try:
+        check_output_format(output_format)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+    if await run_in_threadpool(job_queue.queued) >= JOBS_MAX_QUEUED:
+        raise Overloaded(inference.retry_after)
+
+    job_id = job_queue.new_id()
+    audio_path = job_queue.upload_path(job_id, extension)
+
+    def save_upload():
+        with open(audio_path, "wb") as f:
+            shutil.copyfileobj(file.file, f)
+        job_queue.submit(
+            job_id,
+            "denoise_diarize" if denoise else "diarize",
+            output_format,
+            audio_path,
         )
 
-    # Read it in if wav or mp3
-    else:
-        audio_bytes = file.file.read()
-        data, samplerate = sf.read(io.BytesIO(audio_bytes))
+    await run_in_threadpool(save_upload)
+    jobs_waiting.set()
 
-        print(data)
+    return job_response(await get_job(job_id))
 
-    y = resample_audio_array(data, samplerate, SAMPLE_RATE)
 
-    with tempfile.NamedTemporaryFile(delete=True, suffix=".wav") as temp_file:
+@app.get("/v2/jobs/{job_id}", response_model=JobResponse)
+async def read_job(job_id: str):
+    """Status and progress of a job"""
+    return job_response(await get_job(job_id))
 
-        sf.write(temp_file, y, SAMPLE_RATE)
-        temp_file_path = temp_file.name
-        transcription = model.diar_inference(temp_file_path)
 
-    return {"transcription": str(transcription)}
+@app.get("/v2/jobs/{job_id}/events")
+async def read_job_events(job_id: str, request: Request, after: int = -1):
+    """
+    Server-sent event stream of the segments of a job as they are transcribed,
+    ending with a done or failed event. Each segment event carries its index as
+    id, a reconnecting client resumes after the Last-Event-ID it sends
+    """
+    await get_job(job_id)
+    last_event_id = request.headers.get("Last-Event-ID")
+    if last_event_id and last_event_id.isdigit():
+        after = max(after, int(last_event_id))
+
+    return StreamingResponse(
+        job_events(job_id, after),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/v2/jobs/{job_id}/result")
+async def read_job_result(job_id: str):
+    """Transcript of a finished job, in the output format it was submitted with"""
+    job = await get_job(job_id)
+    if job["state"] != "done":
+        raise HTTPException(
+            status_code=409, detail=job["error"] or f"Job is {job['state']}, not done."
+        )
+
+    segments = await run_in_threadpool(job_queue.segments, job_id)
+    transcript = "".join(
+        iter_transcript(
+            (segment for _, segment in segments),
+            job["output_format"],
+            model.timestamp_format,
+        )
+    )
+    return Response(transcript, media_type=OUTPUT_MEDIA_TYPES[job["output_format"]])
 
 
 def start():
@@ -0,0 +1,105 @@
+"""
+Bounded executor for the blocking model calls of the API.
+
+The models are synchronous: called from an async endpoint they hold the event
+loop for the whole request, and /health stops answering with them. The API runs
+them on an InferenceExecutor instead, a pool of max_workers threads that admits
+at most max_workers + max_queue requests at once. Past that, admit raises
+Overloaded and the request is turned away with a Retry-After, rather than
+queueing without bound behind the GPU.
+"""
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from codes.asr_inference_service.metrics import INFERENCE_ADMITTED, INFERENCE_REJECTED
+from codes.asr_inference_service.profiling import profile_call
+
+_DONE = object()
+
+
+class Overloaded(Exception):
+    """Raised when the admission queue of an InferenceExecutor is full"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Inference queue is full, retry in {retry_after} seconds.")
+        self.retry_after = retry_after
+
+
+class InferenceExecutor:
+    """Thread pool for model calls with a bounded admission queue"""
+
+    def __init__(self, max_workers: int = 1, max_queue: int = 8, retry_after: int = 10):
+        """
+        Inputs:
+            max_workers (int): model calls running at once
+            max_queue (int): admitted requests waiting for a worker
+            retry_after (int): seconds a turned away client is told to wait
+        """
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="inference"
+        )
+
+        self.lock = threading.Lock()
+        self.admitted = 0
+
+    def admit(self):
+        """Take a place for a request, raises Overloaded when none is left"""
+        with self.lock:
+            if self.admitted >= self.max_workers + self.max_queue:
+                INFERENCE_REJECTED.inc()
+                raise Overloaded(self.retry_after)
+            self.admitted += 1
+            INFERENCE_ADMITTED.set(self.admitted)
+
+    def release(self):
+        """Give back the place of a finished request"""
+        with self.lock:
+            self.admitted -= 1
+            INFERENCE_ADMITTED.set(self.admitted)
+
+    async def call(self, fn, *args):
+        """
+        Run fn(*args) on the pool, for a request already admitted. It is profiled
+        with the request when the request is profiled
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.pool, profile_call(functools.partial(fn, *args))
+        )
+
+    async def run(self, fn, *args):
+        """Admit a request and run fn(*args) on the pool"""
+        self.admit()
+        try:
+            return await self.call(fn, *args)
+        finally:
+            self.release()
+
+    async def iterate(self, iterator):
+        """
+        Async iterator over a blocking iterator, each item produced on the pool,
+        for the body of a streaming response of a request already admitted
+        """
+        iterator = iter(iterator)
+        while True:
+            item = await self.call(next, iterator, _DONE)
+            if item is _DONE:
+                return
+            yield item
+
+    async def stream(self, iterator):
+        """
+        iterate for the body of a streaming response, giving back the place of
+        its request once the body ends, fails or is closed by a client going away
+        """
+        try:
+            async for item in self.iterate(iterator):
+                yield item
+        finally:
+            self.release()
@@ -0,0 +1,234 @@
+"""
+Persistent queue of asynchronous diarization jobs for the /v2/jobs API.
+
+Each job is a row in SQLite with its state, progress and timestamps, and its
+transcribed segments are stored as they are produced. Clients can follow a job
+while it runs and pick its result up later, even across a service restart.
+Uploads are kept under the jobs folder until their job has run. Jobs that
+finished more than result_ttl seconds ago are deleted by expire().
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from codes.asr_inference_service.transcript import TranscriptSegment
+
+JOB_STATES = ("queued", "running", "done", "failed")
+
+# States a job can no longer leave
+FINISHED_STATES = ("done", "failed")
+
+
+class JobQueue:
+    """SQLite-backed FIFO of transcription jobs and their segments"""
+
+    def __init__(self, jobs_dir: str, result_ttl: float):
+        """
+        Inputs:
+            jobs_dir (str): folder of the SQLite database and the uploaded audio
+            result_ttl (float): seconds a finished job and its result are kept
+        """
+        self.upload_dir = os.path.join(jobs_dir, "uploads")
+        os.makedirs(self.upload_dir, exist_ok=True)
+        self.result_ttl = result_ttl
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            os.path.join(jobs_dir, "jobs.sqlite3"), check_same_thread=False
+        )
+        self.conn.row_factory = sqlite3.Row
+        with self.conn:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    output_format TEXT NOT NULL,
+                    audio_path TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    audio_seconds REAL,
+                    processed_seconds REAL NOT NULL DEFAULT 0,
+                    segments INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+                """
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created_at)"
+            )
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS segments (
+                    job_id TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    start_time REAL NOT NULL,
+                    end_time REAL NOT NULL,
+                    speaker TEXT NOT NULL,
+                    transcription TEXT NOT NULL,
+                    PRIMARY KEY (job_id, idx)
+                )
+                """
+            )
+
+            # Jobs interrupted by a restart run again from the start
+            self.conn.execute(
+                "DELETE FROM segments WHERE job_id IN (SELECT id FROM jobs WHERE state = 'running')"
+            )
+            self.conn.execute(
+                """
+                UPDATE jobs SET state = 'queued', started_at = NULL, processed_seconds = 0, segments = 0
+                WHERE state = 'running'
+                """
+            )
+
+    def upload_path(self, job_id: str, extension: str) -> str:
+        """Path the audio of a job is saved to before submit"""
+        return os.path.join(self.upload_dir, job_id + extension)
+
+    @staticmethod
+    def new_id() -> str:
+        return uuid.uuid4().hex
+
+    def submit(self, job_id: str, kind: str, output_format: str, audio_path: str):
+        """
+        Queue a job
+
+        Inputs:
+            job_id (str): id from new_id
+            kind (str): how the audio is prepared before diarization
+            output_format (str): one of OUTPUT_FORMATS, for the result
+            audio_path (str): the uploaded audio
+        """
+        with self.lock, self.conn:
+            self.conn.execute(
+                """
+                INSERT INTO jobs (id, kind, output_format, audio_path, state, created_at)
+                VALUES (?, ?, ?, ?, 'queued', ?)
+                """,
+                (job_id, kind, output_format, audio_path, time.time()),
+            )
+
+    def queued(self) -> int:
+        """Number of jobs waiting to run"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE state = 'queued'"
+            ).fetchone()[0]
+
+    def claim(self):
+        """Move the oldest queued job to running and return it, None if none is queued"""
+        with self.lock, self.conn:
+            job = self.conn.execute(
+                "SELECT * FROM jobs WHERE state = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if job is None:
+                return None
+            self.conn.execute(
+                "UPDATE jobs SET state = 'running', started_at = ? WHERE id = ?",
+                (time.time(), job["id"]),
+            )
+            return dict(job)
+
+    def get(self, job_id: str):
+        """Return a job as a dict, None if it is unknown or expired"""
+        with self.lock:
+            job = self.conn.execute(
+                "SELECT * FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return None if job is None else dict(job)
+
+    def set_duration(self, job_id: str, audio_seconds: float):
+        """Record the length of the audio of a job, once decoded"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET audio_seconds = ? WHERE id = ?",
+                (audio_seconds, job_id),
+            )
+
+    def add_segment(self, job_id: str, index: int, segment: TranscriptSegment):
+        """Store the index-th transcribed segment of a running job"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO segments VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, index, *segment),
+            )
+            self.conn.execute(
+                "UPDATE jobs SET segments = ?, processed_seconds = MAX(processed_seconds, ?) WHERE id = ?",
+                (index + 1, segment.end_time, job_id),
+            )
+
+    def segments(self, job_id: str, after: int = -1) -> list:
+        """Segments of a job with an index above after, as (index, TranscriptSegment)"""
+        with self.lock:
+            rows = self.conn.execute(
+                """
+                SELECT idx, start_time, end_time, speaker, transcription FROM segments
+                WHERE job_id = ? AND idx > ? ORDER BY idx
+                """,
+                (job_id, after),
+            ).fetchall()
+        return [(row[0], TranscriptSegment(*row[1:])) for row in rows]
+
+    def finish(self, job_id: str, error: str = None):
+        """Move a running job to done, or to failed with an error, and drop its audio"""
+        with self.lock, self.conn:
+            job = self.conn.execute(
+                "SELECT audio_path FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            self.conn.execute(
+                "UPDATE jobs SET state = ?, error = ?, finished_at = ? WHERE id = ?",
+                ("failed" if error else "done", error, time.time(), job_id),
+            )
+        if job is not None and os.path.isfile(job["audio_path"]):
+            os.remove(job["audio_path"])
+
+    def expire(self) -> int:
+        """Delete the jobs finished more than result_ttl seconds ago, returns how many"""
+        cutoff = time.time() - self.result_ttl
+        with self.lock, self.conn:
+            expired = [
+                row[0]
+                for row in self.conn.execute(
+                    "SELECT id FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?",
+                    (cutoff,),
+                )
+            ]
+            self.conn.executemany(
+                "DELETE FROM segments WHERE job_id = ?",
+                [(job_id,) for job_id in expired],
+            )
+            self.conn.executemany(
+                "DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in expired]
+            )
+        return len(expired)
+
+
+class JobUpdates:
+    """Wakes the event streams of the jobs whenever a job makes progress"""
+
+    def __init__(self):
+        self.version = 0
+        self.condition = asyncio.Condition()
+
+    async def notify(self):
+        async with self.condition:
+            self.version += 1
+            self.condition.notify_all()
+
+    async def wait(self, version: int, timeout: float) -> bool:
+        """Wait for an update after version was read, False on timeout"""
+        async with self.condition:
+            try:
+                await asyncio.wait_for(
+                    self.condition.wait_for(lambda: self.version != version), timeout
+                )
+            except asyncio.TimeoutError:
+                return False
+        return True
@@ -0,0 +1,115 @@
+"""
+Prometheus metrics of the ASR service.
+
+The metrics live in the default registry of prometheus_client, which the /metrics
+route of fastapi_main and the metrics server of the Drive listener both expose.
+Stages are the steps audio goes through: decode, denoise, diarize and asr.
+"""
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Latency of a single stage call, from a short segment up to an hours-long file
+STAGE_SECONDS_BUCKETS = (
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+    300,
+    600,
+    1800,
+)
+
+# Processing time over audio duration, below 1 is faster than real time
+REAL_TIME_FACTOR_BUCKETS = (0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5)
+
+STAGE_SECONDS = Histogram(
+    "asr_stage_seconds",
+    "Processing time of one call of a stage",
+    ["stage"],
+    buckets=STAGE_SECONDS_BUCKETS,
+)
+AUDIO_SECONDS = Counter(
+    "asr_audio_seconds",
+    "Seconds of audio processed by a stage",
+    ["stage"],
+)
+REAL_TIME_FACTOR = Histogram(
+    "asr_real_time_factor",
+    "Processing time over audio duration of one call of a stage",
+    ["stage"],
+    buckets=REAL_TIME_FACTOR_BUCKETS,
+)
+MODEL_LOAD_SECONDS = Gauge(
+    "asr_model_load_seconds",
+    "Time taken to load a model",
+    ["model"],
+)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "asr_http_request_seconds",
+    "Latency of the API requests",
+    ["endpoint"],
+    buckets=STAGE_SECONDS_BUCKETS,
+)
+HTTP_REQUESTS = Counter(
+    "asr_http_requests",
+    "API requests by response status",
+    ["endpoint", "status"],
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "asr_http_requests_in_progress",
+    "API requests being processed or waiting for the model",
+    ["endpoint"],
+)
+
+INFERENCE_ADMITTED = Gauge(
+    "asr_inference_admitted",
+    "API requests admitted to the inference executor, running or queued",
+)
+INFERENCE_REJECTED = Counter(
+    "asr_inference_rejected",
+    "API requests turned away because the inference queue was full",
+)
+
+MICRO_BATCH_SIZE = Histogram(
+    "asr_micro_batch_size",
+    "Requests transcribed together in one micro-batch",
+    buckets=(1, 2, 4, 8, 16, 32),
+)
+
+RESULT_CACHE_REQUESTS = Counter(
+    "asr_result_cache_requests",
+    "Result cache lookups by outcome, hit or miss",
+    ["result"],
+)
+RESULT_CACHE_BYTES = Gauge(
+    "asr_result_cache_bytes",
+    "Size of the transcripts in the result cache",
+)
+
+
+def observe_stage(stage: str, seconds: float, audio_seconds: float = None):
+    """
+    Record one call of a stage
+
+    Inputs:
+        stage (str): name of the stage
+        seconds (float): processing time of the call
+        audio_seconds (float): duration of the audio it processed, if known
+    """
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    if audio_seconds:
+        AUDIO_SECONDS.labels(stage).inc(audio_seconds)
+        REAL_TIME_FACTOR.labels(stage).observe(seconds / audio_seconds)
+
+
+def observe_model_load(model: str, seconds: float):
+    """Record the load time of a model"""
+    MODEL_LOAD_SECONDS.labels(model).set(seconds)
@@ -0,0 +1,74 @@
+"""
+Dynamic micro-batching of concurrent requests.
+
+Short clips sent by many clients at once would each go through the model at
+batch size 1. MicroBatcher collects the items submitted on the event loop for up
+to max_wait seconds, or until max_batch_size of them are waiting, runs them as
+one batch and hands each caller its own result. A lone request waits at most
+max_wait, a burst fills batches at once.
+"""
+
+import asyncio
+
+from codes.asr_inference_service.metrics import MICRO_BATCH_SIZE
+
+
+class MicroBatcher:
+    """Groups items submitted concurrently into batches for a batch function"""
+
+    def __init__(self, run_batch, max_batch_size: int = 8, max_wait: float = 0.005):
+        """
+        Inputs:
+            run_batch (async callable): takes a list of items and returns the list
+            of their results, in the same order
+            max_batch_size (int): most items run in one batch
+            max_wait (float): seconds the first item of a batch waits for others
+        """
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self.pending = []
+        self.timer = None
+        # Running batches, referenced so they are not garbage collected
+        self.tasks = set()
+
+    async def submit(self, item):
+        """Add an item to the next batch and return its result"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((item, future))
+
+        if len(self.pending) >= self.max_batch_size:
+            self._flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.max_wait, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        while self.pending:
+            batch = self.pending[: self.max_batch_size]
+            self.pending = self.pending[self.max_batch_size :]
+            task = asyncio.get_running_loop().create_task(self._run(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, batch: list):
+        MICRO_BATCH_SIZE.observe(len(batch))
+        try:
+            results = await self.run_batch([item for item, _ in batch])
+        except Exception as error:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        for (_, future), result in zip(batch, results):
+            # The caller may have gone away in the meantime
+            if not future.done():
+                future.set_result(result)
@@ -3,14 +3,28 @@
 import logging
 from time import perf_counter
 
-import librosa
 import numpy as np
 import torch
 
-from codes.asr_inference_service.asr_model import FasterWhisperASR, WhisperASR
-from codes.asr_inference_service.diarizer import PyannoteDiarizer
+from codes.asr_inference_service.asr_model import build_asr_model
+from codes.asr_inference_service.audio_ingest import (
+    DEFAULT_RESAMPLER,
+    iter_audio_chunks,
+    iter_windows,
+    load_audio,
+    resample,
+)
+from codes.asr_inference_service.diarizer import PyannoteDiarizer, SpeakerLinker
+from codes.asr_inference_service.metrics import observe_stage
+from codes.asr_inference_service.profiling import record_step
+from codes.asr_inference_service.result_cache import fingerprint
+from codes.asr_inference_service.segments import Segments
+from codes.asr_inference_service.transcript import (
+    TIMESTAMP_FORMATS,
+    TranscriptSegment,
+    format_segment,
+)
 
-from moviepy.video.io.VideoFileClip import VideoFileClip
 
 logging.basicConfig(
     format="%(levelname)s | %(asctime)s | %(message)s", level=logging.INFO
@@ -30,31 +44,60 @@ class ASRModelForInference:
         timestamp_format: str = "seconds",
         min_segment_length=0.5,
         min_silence_length=0,
+        asr_batch_size: int = 8,
+        resampler: str = DEFAULT_RESAMPLER,
+        diar_window_seconds: float = 0,
+        diar_window_overlap_seconds: float = 30,
+        asr_backend: str = "hf",
+        asr_compute_type: str = None,
     ):
         """
         Inputs:
             model_dir (str): path to model directory
             sample_rate (int): the target sample rate in which the model accepts
+            asr_batch_size (int): number of diarized segments transcribed at once
+            resampler (str): resampler used to bring audio to the target sample rate
+            diar_window_seconds (float): length of the windows long recordings are
+            diarized and transcribed in, 0 processes the whole recording at once
+            diar_window_overlap_seconds (float): overlap between consecutive windows
+            asr_backend (str): ASR backend from ASR_BACKENDS, hf or ctranslate2
+            asr_compute_type (str): precision of the ASR model, chosen per device if None
         """
 
         device = (
             device
             if device in ["cuda", "cpu"]
-            else "cuda" if torch.cuda.is_available() else "cpu"
+            else "cuda"
+            if torch.cuda.is_available()
+            else "cpu"
         )
         self.device_number = [0] if device == "cuda" else 1
         self.accelerator = "gpu" if device == "cuda" else "cpu"
 
-        self.asr_model = WhisperASR(model_dir, sample_rate, device)
-        # self.asr_model = FasterWhisperASR(model_dir, sample_rate, device)
+        self.asr_model = build_asr_model(
+            asr_backend, model_dir, sample_rate, device, asr_compute_type or None
+        )
 
         self.timestamp_format = (
-            timestamp_format
-            if timestamp_format in ["minutes", "seconds","hour-minute-second"]
-            else "seconds"
+            timestamp_format if timestamp_format in TIMESTAMP_FORMATS else "seconds"
         )
         logging.info("Running on device: %s", device)
         self.target_sr = sample_rate
+        self.resampler = resampler
+        logging.info("Resampler: %s", self.resampler)
+
+        self.asr_batch_size = max(1, int(asr_batch_size))
+        logging.info("ASR Batch Size: %s", self.asr_batch_size)
+
+        self.diar_window_seconds = max(0.0, float(diar_window_seconds))
+        self.diar_window_overlap_seconds = min(
+            max(0.0, float(diar_window_overlap_seconds)), self.diar_window_seconds / 2
+        )
+        logging.info(
+            "Diarization Window: %s s, Overlap: %s s",
+            self.diar_window_seconds,
+            self.diar_window_overlap_seconds,
+        )
 
         self.diar_model = PyannoteDiarizer(
             device=device,
@@ -62,6 +105,28 @@ class ASRModelForInference:
             min_silence_length=min_silence_length,
         )
 
+        # Everything that shapes a transcript, for the result cache
+        self.config = {
+            "model_dir": model_dir,
+            "device": device,
+            "sample_rate": sample_rate,
+            "timestamp_format": self.timestamp_format,
+            "min_segment_length": min_segment_length,
+            "min_silence_length": min_silence_length,
+            "resampler": self.resampler,
+            "diar_window_seconds": self.diar_window_seconds,
+            "diar_window_overlap_seconds": self.diar_window_overlap_seconds,
+            "asr_backend": asr_backend,
+            "asr_compute_type": asr_compute_type or None,
+        }
+
+    def config_fingerprint(self) -> str:
+        """
+        Fingerprint of the model config, part of the result cache keys so a change
+        of model or settings does not return stale transcripts
+        """
+        return fingerprint(self.config)
+
     def load_audio(self, audio_filepath: str) -> np.ndarray:
         """Method to load an audio filepath to generate a waveform, it automatically
         standardises the waveform to the target sample rate and channel
@@ -72,83 +137,212 @@ class ASRModelForInference:
         Returns:
             waveform (np.ndarray) of shape (T,)
         """
-        waveform, _ = librosa.load(audio_filepath, sr=self.target_sr, mono=True)
+        return load_audio(audio_filepath, self.target_sr, self.resampler)
 
-        return waveform
+    def prepare_waveform(self, audio, sample_rate: int = None) -> np.ndarray:
+        """Method to standardise a filepath, numpy array or tensor into a float32
+        mono waveform at the target sample rate. Arrays already in that form
+        are passed through without a copy.
 
-    def infer(self, filepath: str):
+        Inputs:
+            audio (str/np.ndarray/torch.Tensor): filepath, or waveform of shape
+            (T,) or (C, T)
+            sample_rate (int): sample rate of the waveform, defaults to the target
+
+        Returns:
+            waveform (np.ndarray) of shape (T,)
         """
-        Infer from filepath method
+        with record_step("decode"):
+            if isinstance(audio, str):
+                return self.load_audio(audio)
+
+            if isinstance(audio, torch.Tensor):
+                audio = audio.detach().cpu().numpy()
+
+            # Downmixes (C, T) waveforms, then resamples if needed
+            return resample(
+                audio, sample_rate or self.target_sr, self.target_sr, self.resampler
+            )
+
+    def infer(self, audio, sample_rate: int = None):
+        """
+        Infer from a filepath or waveform
         """
 
-        ar, sr = self.load_audio(filepath)
-        transcription = self.asr_model.infer(ar, sr)
+        waveform = self.prepare_waveform(audio, sample_rate)
+        transcription = self.asr_model.infer(waveform, self.target_sr)
 
         return transcription
 
-    def diar_inference(self, filepath: str):
+    def infer_batch(self, waveforms: list) -> list:
+        """
+        Infer from several waveforms at the target sample rate in one batched
+        forward pass, e.g. short clips of concurrent API requests
+
+        Inputs:
+            waveforms (list): mono waveforms of shape (T,)
+
+        Returns:
+            transcriptions (list): in the same order as waveforms
+        """
+        return self.asr_model.infer_batch(
+            waveforms, self.target_sr, batch_size=max(1, len(waveforms))
+        )
+
+    def diar_inference(self, audio, sample_rate: int = None):
         """
-        Method to call vad methods and using segments 
+        Method to call vad methods and using segments
         of speech to transcribe using the infer method
 
         Inputs:
-            waveform (np.ndarray): Takes in waveform of shape (T,)
-            input_sr (int): Sample rate of input waveform
+            audio (str/np.ndarray/torch.Tensor): filepath or waveform of shape (T,),
+            decoded once and shared in memory by the diarizer and the ASR model
+            sample_rate (int): Sample rate of input waveform, defaults to the target
 
         Returns:
             final_transcription (str): transcription with timestamps attached to it
         """
+        return "".join(self.iter_diar_inference(audio, sample_rate))
+
+    def iter_diar_inference(self, audio, sample_rate: int = None):
+        """
+        Same as diar_inference, but yields the transcription segment by segment
+
+        Inputs:
+            audio (str/np.ndarray/torch.Tensor): filepath or waveform of shape (T,)
+            sample_rate (int): Sample rate of input waveform, defaults to the target
+
+        Returns:
+            generator of segment strings, with timestamps attached to them
+        """
+        for segment in self.iter_diar_segments(audio, sample_rate):
+            yield self.format_segment(*segment)
+
+    def iter_diar_segments(self, audio, sample_rate: int = None):
+        """
+        Diarize and transcribe, yielding the transcribed segments unformatted, for
+        a TranscriptWriter. In windowed mode the segments of a window are yielded
+        as soon as it is done, and a filepath is decoded window by window, so
+        memory does not grow with the length of the recording.
+
+        Inputs:
+            audio (str/np.ndarray/torch.Tensor/iterable): filepath, waveform of shape
+            (T,) or, in windowed mode, chunks of a waveform at the target sample rate
+            such as the ones of iter_audio_chunks
+            sample_rate (int): Sample rate of input waveform, defaults to the target
+
+        Returns:
+            generator of TranscriptSegment
+        """
+        if not self.diar_window_seconds:
+            waveform = self.prepare_waveform(audio, sample_rate)
+            segments = self.diarize_segments(waveform)
+            yield from self.transcribe_segments(waveform, segments)
+            return
+
+        if isinstance(audio, str):
+            chunks = iter_audio_chunks(audio, self.target_sr, self.resampler)
+        elif isinstance(audio, (np.ndarray, torch.Tensor)):
+            chunks = [self.prepare_waveform(audio, sample_rate)]
+        else:
+            chunks = audio
+
+        window_samples = int(self.diar_window_seconds * self.target_sr)
+        hop_samples = window_samples - int(
+            self.diar_window_overlap_seconds * self.target_sr
+        )
+        half_overlap = self.diar_window_overlap_seconds / 2
+        linker = SpeakerLinker()
+
+        for start_sample, window, is_last in iter_windows(
+            chunks, window_samples, hop_samples
+        ):
+            window_start = start_sample / self.target_sr
+            segments, embeddings = self.diarize_segments(window, with_embeddings=True)
+            segments = segments.map_speakers(linker.link(embeddings))
+
+            # Each window keeps the segments centred in its share of the overlaps,
+            # so a turn in an overlap is transcribed once
+            own_start = half_overlap if start_sample else 0.0
+            own_end = np.inf if is_last else hop_samples / self.target_sr + half_overlap
+            segments = segments[
+                (segments.centre >= own_start) & (segments.centre < own_end)
+            ]
+
+            yield from self.transcribe_segments(window, segments, offset=window_start)
+            logging.info(
+                "Window at %.1f s done, %s segments", window_start, len(segments)
+            )
+
+    def diarize_segments(self, waveform: np.ndarray, with_embeddings: bool = False):
+        """
+        Diarize a waveform at the target sample rate, timing the diarizer
+        """
         diarizer_start = perf_counter()
         logging.info("Diarization Model triggered.")
 
-        segments = self.diar_model.diarize(filepath)
-        waveform = self.load_audio(filepath)
+        with record_step("diarize"):
+            if with_embeddings:
+                result = self.diar_model.diarize_with_embeddings(
+                    waveform, self.target_sr
+                )
+            else:
+                result = self.diar_model.diarize(waveform, self.target_sr)
 
         diarizer_end = perf_counter()
         logging.info(
             "Diarization Model Done. Elapsed time: %s",
             diarizer_end - diarizer_start,
         )
+        observe_stage(
+            "diarize", diarizer_end - diarizer_start, len(waveform) / self.target_sr
+        )
 
-        final_transcription = ""
-
-        for x in range(len(segments)):
-            start_time = segments["start_time"][x]
-            end_time = segments["end_time"][x]
-
-            start_frame = int(start_time * self.target_sr)
-            end_frame = int(end_time * self.target_sr)
-
-            split_audio = waveform[start_frame:end_frame]
-
-            transcription = self.asr_model.infer(split_audio, self.target_sr)
-
-            if self.timestamp_format == "minutes":
-                start_time = start_time / 60
-                end_time = end_time / 60
-                segment_string = f"[{start_time:.2f} - {end_time:.2f}] [{segments['speaker'][x]}] : {transcription}\n\n"
-            elif self.timestamp_format == "hour-minute-second":
-                start_time = int(start_time)
-                end_time = int(end_time)
-                
-                start_hours = start_time // 3600
-                start_minutes = (start_time % 3600) // 60
-                start_seconds = start_time % 60
-                
-                end_hours = end_time // 3600
-                end_minutes = (end_time % 3600) // 60
-                end_seconds = end_time % 60
-                
-                segment_string = f"[{start_hours:02d}:{start_minutes:02d}:{start_seconds:02d} - {end_hours:02d}:{end_minutes:02d}:{end_seconds:02d}] [{segments['speaker'][x]}] : {transcription}\n\n"       
-            else:
-                segment_string = f"[{start_time:.2f} - {end_time:.2f}] [{segments['speaker'][x]}] : {transcription}\n\n"
+        return result
 
+    def transcribe_segments(
+        self, waveform: np.ndarray, segments: Segments, offset: float = 0.0
+    ) -> list:
+        """
+        Transcribe the diarized segments of a waveform in batches
 
-            final_transcription = "".join([final_transcription, segment_string])
+        Inputs:
+            waveform (np.ndarray): waveform of shape (T,) at the target sample rate
+            segments (Segments): speaker turns of the waveform
+            offset (float): seconds added to the timestamps, the start of the window
 
-        return final_transcription
-        
-        
+        Returns:
+            segments (list): one TranscriptSegment per speaker turn
+        """
+        start_frames, end_frames = segments.sample_bounds(self.target_sr)
+        segment_audios = [
+            waveform[start_frame:end_frame]
+            for start_frame, end_frame in zip(
+                start_frames.tolist(), end_frames.tolist()
+            )
+        ]
+
+        with record_step("asr"):
+            transcriptions = self.asr_model.infer_batch(
+                segment_audios, self.target_sr, batch_size=self.asr_batch_size
+            )
+
+        return [
+            TranscriptSegment(start_time, end_time, speaker, transcription)
+            for (start_time, end_time, speaker), transcription in zip(
+                segments.shift(offset), transcriptions
+            )
+        ]
+
+    def format_segment(
+        self, start_time: float, end_time: float, speaker: str, transcription: str
+    ) -> str:
+        """
+        Format one transcribed segment with timestamps in timestamp_format
+        """
+        return format_segment(
+            start_time, end_time, speaker, transcription, self.timestamp_format
+        )
 
 
 if __name__ == "__main__":
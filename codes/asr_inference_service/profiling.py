@@ -0,0 +1,213 @@
+"""
+Opt-in profiling of inference jobs.
+
+profile_job wraps a block of work in cProfile and/or torch.profiler and saves
+<name>.pstats and <name>.trace.json (a Chrome trace, open it in chrome://tracing
+or Perfetto) in an output folder. With no profiler asked for it returns a
+nullcontext, so disabled profiling costs nothing.
+
+cProfile only sees the thread it was started in, so profile the code on the
+thread that runs it. A RequestProfile follows the model calls of one API request
+instead: profile_call wraps each call the request makes, on whichever thread it
+runs, into the same cProfile. record_step labels a step of the work in the torch
+trace, and is a nullcontext too unless a torch profiler is running.
+"""
+
+import contextlib
+import contextvars
+import cProfile
+import functools
+import logging
+import os
+import threading
+
+logging.basicConfig(
+    format="%(levelname)s | %(asctime)s | %(message)s", level=logging.INFO
+)
+
+PROFILERS = ("cprofile", "torch")
+
+
+class _Counter:
+    """Thread-safe count of the profilers running"""
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def add(self, delta: int):
+        with self.lock:
+            self.value += delta
+
+
+_torch_profiles = _Counter()
+
+# The RequestProfile of the request being handled, in its context
+_request_profile = contextvars.ContextVar("request_profile", default=None)
+# Held by the RequestProfile running, one request is profiled at a time
+_request_profile_lock = threading.Lock()
+
+
+def parse_profilers(value: str) -> tuple:
+    """
+    Parse a comma separated list of profilers, such as "cprofile,torch"
+
+    Inputs:
+        value (str): profiler names, empty or None for no profiling
+
+    Returns:
+        profilers (tuple): names in PROFILERS, empty when profiling is off
+    """
+    profilers = tuple(
+        name.strip().lower() for name in (value or "").split(",") if name.strip()
+    )
+    unknown = [name for name in profilers if name not in PROFILERS]
+    if unknown:
+        raise ValueError(f"Unknown profilers {unknown}, expected some of {PROFILERS}")
+    return profilers
+
+
+def profile_job(name: str, output_dir: str, profilers: tuple = ()):
+    """
+    Context manager profiling the work done inside it
+
+    Inputs:
+        name (str): file name of the saved profiles, without extension
+        output_dir (str): folder the profiles are saved in
+        profilers (tuple): names in PROFILERS, nothing is profiled when empty
+
+    Returns:
+        context manager
+    """
+    if not profilers:
+        return contextlib.nullcontext()
+    return _profile(name, output_dir, profilers)
+
+
+def profile_call(fn):
+    """
+    fn wrapped to run in the cProfile of the request being handled, fn itself when
+    the request is not profiled. Wrap it on the event loop, then run it anywhere
+    """
+    profile = _request_profile.get()
+    if profile is None or profile.cprofile is None:
+        return fn
+    return functools.partial(profile.run, fn)
+
+
+class RequestProfile:
+    """
+    Profile of one API request: a cProfile of the calls wrapped with profile_call
+    while it is active, on any thread, and a torch trace of the whole time it is
+    active. Only one request is profiled at a time, the profilers are process wide
+    """
+
+    def __init__(self, name: str, output_dir: str, profilers: tuple):
+        """
+        Inputs:
+            name (str): file name of the saved profiles, without extension
+            output_dir (str): folder the profiles are saved in
+            profilers (tuple): names in PROFILERS
+        """
+        self.name = name
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, name)
+        self.cprofile = cProfile.Profile() if "cprofile" in profilers else None
+        self.torch = "torch" in profilers
+        # Calls of the request running on several threads are profiled one at a time
+        self.lock = threading.Lock()
+        self.stack = contextlib.ExitStack()
+
+    def start(self) -> bool:
+        """Start the profilers, False when another request is being profiled"""
+        if not _request_profile_lock.acquire(blocking=False):
+            return False
+        self.stack.callback(_request_profile_lock.release)
+
+        if self.torch:
+            self.stack.enter_context(_profile(self.name, self.output_dir, ("torch",)))
+        return True
+
+    @contextlib.contextmanager
+    def active(self):
+        """
+        Make this the profile of the code run inside, and of the tasks it starts,
+        which keep it after the block is left
+        """
+        token = _request_profile.set(self)
+        try:
+            yield self
+        finally:
+            _request_profile.reset(token)
+
+    def run(self, fn):
+        """Run fn in the cProfile of the request"""
+        with self.lock:
+            self.cprofile.enable()
+            try:
+                return fn()
+            finally:
+                self.cprofile.disable()
+
+    def stop(self):
+        """Save the profiles, once the request is over"""
+        if self.cprofile is not None:
+            os.makedirs(self.output_dir, exist_ok=True)
+            # After a call still running for a client that went away
+            with self.lock:
+                self.cprofile.dump_stats(self.path + ".pstats")
+            logging.info("cProfile stats saved : %s.pstats", self.path)
+        self.stack.close()
+
+
+def record_step(name: str):
+    """Label a step of the work in the torch trace, when a torch profiler is running"""
+    if not _torch_profiles.value:
+        return contextlib.nullcontext()
+
+    from torch.profiler import record_function
+
+    return record_function(name)
+
+
+@contextlib.contextmanager
+def _profile(name: str, output_dir: str, profilers: tuple):
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, name)
+
+    with contextlib.ExitStack() as stack:
+        if "torch" in profilers:
+            import torch
+            from torch.profiler import ProfilerActivity, profile
+
+            activities = [ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(ProfilerActivity.CUDA)
+            torch_profile = profile(activities=activities)
+            torch_profile.start()
+
+            _torch_profiles.add(1)
+
+            @stack.callback
+            def save_torch_trace():
+                _torch_profiles.add(-1)
+                torch_profile.stop()
+                torch_profile.export_chrome_trace(path + ".trace.json")
+                logging.info("Torch trace saved : %s.trace.json", path)
+
+        if "cprofile" in profilers:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError as error:
+                # Another profiler is already active on this thread
+                logging.warning("cProfile not started for %s : %s", name, error)
+            else:
+
+                @stack.callback
+                def save_pstats():
+                    profiler.disable()
+                    profiler.dump_stats(path + ".pstats")
+                    logging.info("cProfile stats saved : %s.pstats", path)
+
+        yield path
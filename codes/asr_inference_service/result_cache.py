@@ -0,0 +1,255 @@
+"""
+Content-addressed cache of transcription results.
+
+Results are keyed by a hash of the audio content plus a fingerprint of everything
+else that shapes the transcript: the kind of transcription and the model config.
+The content hash is taken over the decoded samples rather than the file bytes, so
+the same audio in another container or encoding, e.g. a wav and its flac copy or
+a video and its remuxed audio track, is transcribed once, and so is a recording
+uploaded twice under different names.
+
+Transcripts are stored as files under the cache folder, indexed in SQLite with
+their size and last access time. Once the cache grows past max_bytes the least
+recently used entries are evicted.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from codes.asr_inference_service.metrics import (
+    RESULT_CACHE_BYTES,
+    RESULT_CACHE_REQUESTS,
+)
+
+logging.basicConfig(
+    format="%(levelname)s | %(asctime)s | %(message)s", level=logging.INFO
+)
+
+
+def hash_audio(audio) -> str:
+    """
+    md5 of decoded audio, over its samples as little-endian float32
+
+    Inputs:
+        audio (np.ndarray/iterable): waveform, or consecutive chunks of one such as
+        the ones of iter_audio_chunks, hashed as they come so the whole waveform is
+        never held in memory
+
+    Returns:
+        md5 (str): hex digest
+    """
+    md5 = hashlib.md5()
+    for _ in hashed_chunks([audio] if isinstance(audio, np.ndarray) else audio, md5):
+        pass
+    return md5.hexdigest()
+
+
+def hashed_chunks(chunks, md5):
+    """
+    Pass chunks of decoded audio through, updating md5 with each as hash_audio
+    does, so audio can be hashed while it is consumed instead of in a pass of its own
+    """
+    for chunk in chunks:
+        md5.update(np.ascontiguousarray(chunk, dtype="<f4").data)
+        yield chunk
+
+
+def fingerprint(config: dict) -> str:
+    """Stable hash of a config dict, for use as part of a cache key"""
+    encoded = json.dumps(config, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class ResultCache:
+    """Size-bounded on-disk LRU cache of transcripts"""
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        """
+        Inputs:
+            cache_dir (str): folder of the transcripts and their SQLite index
+            max_bytes (int): total size of the transcripts kept, the least recently
+            used ones are evicted past it
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            os.path.join(cache_dir, "index.sqlite3"), check_same_thread=False
+        )
+        with self.conn:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed_at)"
+            )
+
+        RESULT_CACHE_BYTES.set(self.total_bytes())
+        logging.info("Result cache: %s, %s bytes max", cache_dir, max_bytes)
+
+    @staticmethod
+    def key(content_hash: str, kind: str, config_fingerprint: str) -> str:
+        """
+        Cache key of a result
+
+        Inputs:
+            content_hash (str): hash of the audio, from hash_audio or a file checksum
+            kind (str): kind of transcription, e.g. transcribe or diarize
+            config_fingerprint (str): fingerprint of the model config
+
+        Returns:
+            key (str)
+        """
+        return hashlib.sha256(
+            f"{content_hash}:{kind}:{config_fingerprint}".encode()
+        ).hexdigest()
+
+    def path(self, key: str) -> str:
+        """Path of the transcript file of a key"""
+        return os.path.join(self.cache_dir, key[:2], key + ".txt")
+
+    def get(self, key: str):
+        """Return the cached transcript of a key, None on a miss"""
+        path = self._lookup(key)
+        if path is None:
+            return None
+        try:
+            with open(path) as f:
+                return f.read()
+        except FileNotFoundError:
+            # Evicted by another thread since the lookup
+            self._forget(key)
+            return None
+
+    def get_file(self, key: str, destination: str) -> bool:
+        """Copy the cached transcript of a key to destination, False on a miss"""
+        path = self._lookup(key)
+        if path is None:
+            return False
+        try:
+            shutil.copyfile(path, destination)
+        except FileNotFoundError:
+            # Evicted by another thread since the lookup
+            self._forget(key)
+            return False
+        return True
+
+    def put(self, key: str, text: str):
+        """Store a transcript"""
+        self._store(key, lambda f: f.write(text.encode()))
+
+    def put_file(self, key: str, source: str):
+        """Store the transcript written to a file"""
+        with open(source, "rb") as src:
+            self._store(key, lambda f: shutil.copyfileobj(src, f))
+
+    def total_bytes(self) -> int:
+        """Total size of the cached transcripts"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM results"
+            ).fetchone()[0]
+
+    def stats(self) -> dict:
+        """Hits, misses and size of the cache since start"""
+        with self.lock:
+            entries, size = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results"
+            ).fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def _lookup(self, key: str):
+        path = self.path(key)
+        with self.lock, self.conn:
+            found = self.conn.execute(
+                "SELECT 1 FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if found and os.path.isfile(path):
+                self.conn.execute(
+                    "UPDATE results SET accessed_at = ? WHERE key = ?",
+                    (time.time(), key),
+                )
+                self.hits += 1
+                RESULT_CACHE_REQUESTS.labels("hit").inc()
+                return path
+
+            # The index may outlive a transcript deleted by hand
+            if found:
+                self.conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            self.misses += 1
+            RESULT_CACHE_REQUESTS.labels("miss").inc()
+            return None
+
+    def _forget(self, key: str):
+        """Drop the index row of a transcript found missing after its lookup"""
+        with self.lock, self.conn:
+            # Unless stored again in the meantime
+            if not os.path.isfile(self.path(key)):
+                self.conn.execute("DELETE FROM results WHERE key = ?", (key,))
+
+    def _store(self, key: str, write):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Written next to its final path and moved in place, readers never see half a file
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as f:
+            write(f)
+        size = os.path.getsize(f.name)
+        if size > self.max_bytes:
+            os.remove(f.name)
+            return
+        os.replace(f.name, path)
+
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                """
+                INSERT OR REPLACE INTO results (key, size, created_at, accessed_at)
+                VALUES (?, ?, ?, ?)
+                """,
+                (key, size, now, now),
+            )
+            self._evict()
+
+    def _evict(self):
+        """Drop the least recently used transcripts until the cache fits max_bytes"""
+        total = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM results"
+        ).fetchone()[0]
+        if total > self.max_bytes:
+            for key, size in self.conn.execute(
+                "SELECT key, size FROM results ORDER BY accessed_at"
+            ).fetchall():
+                if total <= self.max_bytes:
+                    break
+                self.conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                if os.path.isfile(self.path(key)):
+                    os.remove(self.path(key))
+                total -= size
+                logging.info("Result cache evicted %s", key)
+        RESULT_CACHE_BYTES.set(total)
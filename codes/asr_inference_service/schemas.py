@@ -15,6 +15,7 @@ class ASRResponse(BaseModel):
     status_code: int = 200
     transcription: str
 
+
 class DenoiseResponse(BaseModel):
     """Denoiser service response format
 
@@ -26,6 +27,36 @@ class DenoiseResponse(BaseModel):
     status_code: int = 200
     denoise_audio: list
 
+
+# pylint: disable=too-few-public-methods
+class JobResponse(BaseModel):
+    """Asynchronous job status format
+
+    Attributes:
+        job_id (str): id of the job, used in its /v2/jobs URLs
+        state (str): queued, running, done or failed
+        output_format (str): format of the result, one of OUTPUT_FORMATS
+        progress (float): share of the audio transcribed, from 0 to 1
+        segments (int): number of segments transcribed so far
+        audio_seconds (float): length of the audio, once decoded
+        error (str): why the job failed
+        created_at (float): submission time, as a unix timestamp
+        started_at (float): start time of the run
+        finished_at (float): end time of the run, the result expires a TTL after it
+    """
+
+    job_id: str
+    state: str
+    output_format: str
+    progress: float = 0.0
+    segments: int = 0
+    audio_seconds: float | None = None
+    error: str | None = None
+    created_at: float
+    started_at: float | None = None
+    finished_at: float | None = None
+
+
 # pylint: disable=too-few-public-methods
 class HealthResponse(BaseModel):
     """
@@ -0,0 +1,130 @@
+"""
+Array-backed diarization segments.
+
+A diarization is held as three parallel numpy arrays (start and end times in
+seconds, and speaker labels) instead of a DataFrame grown row by row, so
+building, filtering and merging thousands of turns are single vectorised passes.
+"""
+
+import numpy as np
+
+
+class Segments:
+    """Speaker turns of a recording, in time order"""
+
+    __slots__ = ("start", "end", "speaker")
+
+    def __init__(self, start, end, speaker):
+        """
+        Inputs:
+            start (array-like): start of each turn in seconds
+            end (array-like): end of each turn in seconds
+            speaker (array-like): speaker label of each turn
+        """
+        self.start = np.asarray(start, dtype=np.float64)
+        self.end = np.asarray(end, dtype=np.float64)
+        self.speaker = np.asarray(speaker, dtype=str)
+
+    @classmethod
+    def from_turns(cls, turns):
+        """Build from an iterable of (start, end, speaker) tuples"""
+        turns = list(turns)
+        if not turns:
+            return cls.empty()
+        start, end, speaker = zip(*turns)
+        return cls(start, end, speaker)
+
+    @classmethod
+    def from_annotation(cls, diarization, decimals: int = None):
+        """
+        Build from a pyannote Annotation
+
+        Inputs:
+            diarization (pyannote.core.Annotation): output of the diarization pipeline
+            decimals (int): round the times to this many decimals, if set
+        """
+        segments = cls.from_turns(
+            (turn.start, turn.end, speaker)
+            for turn, _, speaker in diarization.itertracks(yield_label=True)
+        )
+        if decimals is not None:
+            segments.start = np.round(segments.start, decimals)
+            segments.end = np.round(segments.end, decimals)
+        return segments
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0), np.empty(0), np.empty(0, dtype=str))
+
+    def __len__(self) -> int:
+        return len(self.start)
+
+    def __iter__(self):
+        """Yield (start, end, speaker) of every turn, as Python scalars"""
+        return zip(self.start.tolist(), self.end.tolist(), self.speaker.tolist())
+
+    def __getitem__(self, index):
+        """Select turns by slice, boolean mask or index array"""
+        return Segments(self.start[index], self.end[index], self.speaker[index])
+
+    def __repr__(self) -> str:
+        return f"Segments({len(self)} turns)"
+
+    @property
+    def duration(self) -> np.ndarray:
+        return self.end - self.start
+
+    @property
+    def centre(self) -> np.ndarray:
+        return (self.start + self.end) / 2
+
+    def filter_min_length(self, min_length: float):
+        """Drop the turns shorter than min_length seconds"""
+        return self[self.duration >= min_length]
+
+    def merge_same_speaker(self, min_silence: float):
+        """
+        Merge each run of consecutive turns of one speaker into a single turn,
+        unless a turn starts more than min_silence seconds after the previous one
+        ended. A merged turn ends where the last turn of its run ends.
+        """
+        if len(self) <= 1:
+            return self
+
+        same_speaker = self.speaker[1:] == self.speaker[:-1]
+        within_silence = self.start[1:] - self.end[:-1] <= min_silence
+        run_starts = np.flatnonzero(
+            np.concatenate(([True], ~(same_speaker & within_silence)))
+        )
+        run_ends = np.concatenate((run_starts[1:], [len(self)])) - 1
+
+        return Segments(
+            self.start[run_starts], self.end[run_ends], self.speaker[run_starts]
+        )
+
+    def map_speakers(self, mapping: dict):
+        """Relabel the speakers through a label to label mapping"""
+        labels, inverse = np.unique(self.speaker, return_inverse=True)
+        mapped = np.asarray(
+            [mapping.get(label, label) for label in labels.tolist()], dtype=str
+        )
+        return Segments(self.start, self.end, mapped[inverse])
+
+    def shift(self, offset: float):
+        """Move every turn by offset seconds"""
+        return Segments(self.start + offset, self.end + offset, self.speaker)
+
+    def sample_bounds(self, sample_rate: int):
+        """Start and end sample index of every turn, for slicing a waveform"""
+        return (
+            (self.start * sample_rate).astype(np.int64),
+            (self.end * sample_rate).astype(np.int64),
+        )
+
+    def to_dataframe(self):
+        """pandas DataFrame with the ['start_time', 'end_time', 'speaker'] columns"""
+        import pandas as pd
+
+        return pd.DataFrame(
+            {"start_time": self.start, "end_time": self.end, "speaker": self.speaker}
+        )
@@ -0,0 +1,254 @@
+"""
+Transcript formatting, kept free of model dependencies so it can be used and
+benchmarked without loading torch.
+
+Segments are formatted as plain text (with the TIMESTAMPS_FORMAT options), SRT,
+WebVTT or JSON. TranscriptWriter streams them to a sink as they are transcribed,
+iter_transcript yields the same chunks for a streaming HTTP response.
+"""
+
+import json
+from typing import NamedTuple
+
+TIMESTAMP_FORMATS = ("minutes", "seconds", "hour-minute-second")
+
+OUTPUT_FORMATS = ("text", "srt", "vtt", "json")
+
+OUTPUT_EXTENSIONS = {"text": ".txt", "srt": ".srt", "vtt": ".vtt", "json": ".json"}
+
+OUTPUT_MEDIA_TYPES = {
+    "text": "text/plain",
+    "srt": "application/x-subrip",
+    "vtt": "text/vtt",
+    "json": "application/json",
+}
+
+
+class TranscriptSegment(NamedTuple):
+    """One transcribed speaker turn, times in seconds from the start of the recording"""
+
+    start_time: float
+    end_time: float
+    speaker: str
+    transcription: str
+
+
+def format_segment(
+    start_time: float,
+    end_time: float,
+    speaker: str,
+    transcription: str,
+    timestamp_format: str,
+) -> str:
+    """
+    Format one transcribed segment as "[start - end] [speaker] : text"
+
+    Inputs:
+        start_time (float): start of the segment in seconds
+        end_time (float): end of the segment in seconds
+        speaker (str): speaker label
+        transcription (str): text of the segment
+        timestamp_format (str): one of TIMESTAMP_FORMATS
+
+    Returns:
+        segment_string (str): formatted segment followed by a blank line
+    """
+    if timestamp_format == "minutes":
+        start_time = start_time / 60
+        end_time = end_time / 60
+        return f"[{start_time:.2f} - {end_time:.2f}] [{speaker}] : {transcription}\n\n"
+
+    if timestamp_format == "hour-minute-second":
+        start_time = int(start_time)
+        end_time = int(end_time)
+
+        start_hours = start_time // 3600
+        start_minutes = (start_time % 3600) // 60
+        start_seconds = start_time % 60
+
+        end_hours = end_time // 3600
+        end_minutes = (end_time % 3600) // 60
+        end_seconds = end_time % 60
+
+        return f"[{start_hours:02d}:{start_minutes:02d}:{start_seconds:02d} - {end_hours:02d}:{end_minutes:02d}:{end_seconds:02d}] [{speaker}] : {transcription}\n\n"
+
+    return f"[{start_time:.2f} - {end_time:.2f}] [{speaker}] : {transcription}\n\n"
+
+
+def format_cue_timestamp(seconds: float, separator: str) -> str:
+    """HH:MM:SS<separator>mmm, as SRT (",") and WebVTT (".") cues need"""
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3_600_000)
+    minutes, milliseconds = divmod(milliseconds, 60_000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}{separator}{milliseconds:03d}"
+
+
+def check_output_format(output_format: str):
+    """Raise a ValueError for an output format not in OUTPUT_FORMATS"""
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(
+            f"Output format {output_format} is not supported, choose one of {OUTPUT_FORMATS}"
+        )
+
+
+def transcript_header(output_format: str) -> str:
+    """Text written before the first segment"""
+    if output_format == "vtt":
+        return "WEBVTT\n\n"
+    if output_format == "json":
+        return '{"segments": ['
+    return ""
+
+
+def transcript_footer(output_format: str, count: int) -> str:
+    """Text written after the last of count segments"""
+    if output_format == "json":
+        return "\n]}\n" if count else "]}\n"
+    return ""
+
+
+def format_output_segment(
+    segment: TranscriptSegment, index: int, output_format: str, timestamp_format: str
+) -> str:
+    """
+    Format the index-th segment (from 0) of a transcript in an output format
+
+    Inputs:
+        segment (TranscriptSegment): segment to format
+        index (int): position of the segment, numbers SRT cues and separates JSON items
+        output_format (str): one of OUTPUT_FORMATS
+        timestamp_format (str): one of TIMESTAMP_FORMATS, used by the text format
+
+    Returns:
+        segment_string (str)
+    """
+    start_time, end_time, speaker, transcription = segment
+
+    if output_format == "text":
+        return format_segment(
+            start_time, end_time, speaker, transcription, timestamp_format
+        )
+
+    # Cues and JSON items hold a single line of text
+    text = " ".join(transcription.split())
+
+    if output_format == "srt":
+        return (
+            f"{index + 1}\n"
+            f"{format_cue_timestamp(start_time, ',')} --> {format_cue_timestamp(end_time, ',')}\n"
+            f"{speaker}: {text}\n\n"
+        )
+
+    if output_format == "vtt":
+        text = text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+        return (
+            f"{format_cue_timestamp(start_time, '.')} --> {format_cue_timestamp(end_time, '.')}\n"
+            f"<v {speaker}>{text}\n\n"
+        )
+
+    item = json.dumps(
+        {
+            "start": round(start_time, 3),
+            "end": round(end_time, 3),
+            "speaker": speaker,
+            "text": text,
+        },
+        ensure_ascii=False,
+    )
+    return ("\n" if index == 0 else ",\n") + item
+
+
+class TranscriptWriter:
+    """
+    Streams transcript segments to a sink in one of OUTPUT_FORMATS. The sink is
+    anything with a write(str) method, e.g. an open file or an io.StringIO buffer.
+    Each segment is written once, in order, so writing a transcript is linear in
+    its length. Use as a context manager, or call close() to finish the transcript.
+    """
+
+    def __init__(
+        self,
+        sink,
+        output_format: str = "text",
+        timestamp_format: str = "seconds",
+        flush: bool = False,
+    ):
+        """
+        Inputs:
+            sink: object with a write(str) method
+            output_format (str): one of OUTPUT_FORMATS
+            timestamp_format (str): one of TIMESTAMP_FORMATS, used by the text format
+            flush (bool): flush the sink after every segment, so readers see it at once
+        """
+        check_output_format(output_format)
+        self.sink = sink
+        self.output_format = output_format
+        self.timestamp_format = timestamp_format
+        self.flush = flush and hasattr(sink, "flush")
+        self.count = 0
+        self.closed = False
+
+        header = transcript_header(output_format)
+        if header:
+            self.sink.write(header)
+
+    def write(self, segment: TranscriptSegment):
+        """Write one segment"""
+        self.sink.write(
+            format_output_segment(
+                segment, self.count, self.output_format, self.timestamp_format
+            )
+        )
+        self.count += 1
+        if self.flush:
+            self.sink.flush()
+
+    def write_all(self, segments):
+        """Write every segment of an iterable, as it is produced"""
+        for segment in segments:
+            self.write(segment)
+
+    def close(self):
+        """Finish the transcript, the sink itself is left open"""
+        if self.closed:
+            return
+        footer = transcript_footer(self.output_format, self.count)
+        if footer:
+            self.sink.write(footer)
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def iter_transcript(
+    segments, output_format: str = "text", timestamp_format: str = "seconds"
+):
+    """
+    Yield a transcript chunk by chunk as its segments are produced, e.g. as the
+    body of a streaming HTTP response
+
+    Inputs:
+        segments (iterable): TranscriptSegment items
+        output_format (str): one of OUTPUT_FORMATS
+        timestamp_format (str): one of TIMESTAMP_FORMATS, used by the text format
+
+    Returns:
+        generator of str
+    """
+    check_output_format(output_format)
+    header = transcript_header(output_format)
+    if header:
+        yield header
+
+    count = 0
+    for count, segment in enumerate(segments, start=1):
+        yield format_output_segment(segment, count - 1, output_format, timestamp_format)
+
+    footer = transcript_footer(output_format, count)
+    if footer:
+        yield footer
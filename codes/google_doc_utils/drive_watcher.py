@@ -0,0 +1,88 @@
+import os
+
+from codes.google_doc_utils.utils import (
+    MEDIA_MIME_TYPES,
+    get_all_media_files,
+    get_start_page_token,
+    list_changes,
+    read_txt_file,
+    to_file_entry,
+)
+
+
+class DriveChangeWatcher:
+    '''
+    Watches a Drive folder for new media files through the Drive changes feed.
+
+    The first poll lists the folder once to pick up existing files, every poll after
+    that only reads the changes since the last committed page token. The token is
+    persisted to token_filepath so a restart carries on where it stopped.
+    '''
+
+    def __init__(self, folder_id, service, token_filepath, mime_types=MEDIA_MIME_TYPES):
+        self.folder_id = folder_id
+        self.service = service
+        self.token_filepath = token_filepath
+        self.mime_types = set(mime_types)
+
+        self.page_token = self.load_page_token()
+        self.pending_page_token = None
+
+    def load_page_token(self):
+        '''Read the persisted page token, None if the watcher never ran'''
+
+        if not os.path.isfile(self.token_filepath):
+            return None
+
+        return read_txt_file(self.token_filepath).strip() or None
+
+    def poll(self):
+        '''
+        Return the media files added to or changed in the folder since the last commit.
+        The new page token only takes effect once commit() is called.
+        '''
+
+        if self.page_token is None:
+            # Take the token before listing so nothing added during the listing is missed
+            self.pending_page_token = get_start_page_token(self.service)
+            return get_all_media_files(
+                self.folder_id, self.service, tuple(self.mime_types)
+            )
+
+        changes, self.pending_page_token = list_changes(self.page_token, self.service)
+
+        # A file can appear several times in one poll, keep its latest state only
+        changed_files = {}
+        for change in changes:
+            file = change.get('file')
+            if change.get('removed') or not self.is_watched(file):
+                changed_files.pop(change.get('fileId'), None)
+                continue
+            changed_files[file['id']] = to_file_entry(file)
+
+        return list(changed_files.values())
+
+    def is_watched(self, file):
+        '''Check if a changed file is a media file sitting in the watched folder'''
+
+        return (
+            file is not None
+            and not file.get('trashed', False)
+            and file.get('mimeType') in self.mime_types
+            and self.folder_id in file.get('parents', [])
+        )
+
+    def commit(self):
+        '''Persist the page token of the last poll once its files have been handled'''
+
+        if self.pending_page_token is None:
+            return
+
+        os.makedirs(os.path.dirname(self.token_filepath) or '.', exist_ok=True)
+        tmp_filepath = self.token_filepath + '.tmp'
+        with open(tmp_filepath, 'w') as f:
+            f.write(self.pending_page_token)
+        os.replace(tmp_filepath, self.token_filepath)
+
+        self.page_token = self.pending_page_token
+        self.pending_page_token = None
@@ -13,6 +13,10 @@ def get_status_message(filename, step='downloading'):
         
         status_message = f'{current_time} : {filename} has been downloaded, transcription in progress \n'
     
+    elif step == 'cached':
+
+        status_message = f'{current_time} : {filename} has been transcribed before, the stored transcript is being uploaded to Outputs folder \n'
+
     elif step == 'transcribed':
         
         status_message = f'{current_time} : {filename} has been transcribed, text file being uploaded to Outputs folder \n'
@@ -25,6 +29,10 @@ def get_status_message(filename, step='downloading'):
         
         status_message = f'{current_time} : DH Transcription Service started up! \n\n'
     
+    elif step == 'reset':
+
+        status_message = f'{current_time} : Older status messages have been archived, DH Transcription Service is online and running! \n\n'
+
     elif step == 'error':
         
         status_message = f'{current_time} : DH Transcription Service has faced an error with {filename} and has shut down! \n\n'
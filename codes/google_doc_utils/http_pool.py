@@ -0,0 +1,72 @@
+import queue
+import threading
+from time import perf_counter
+
+import google_auth_httplib2  # type: ignore
+import httplib2  # type: ignore
+
+from codes.google_doc_utils.metrics import observe_drive_request
+
+
+class PooledHttp:
+    '''
+    Thread-safe stand-in for httplib2.Http, for use as the transport of a Drive service.
+
+    httplib2.Http objects are not thread safe, so each request checks out an authorized
+    Http from a pool of up to pool_size and returns it afterwards. The pooled objects
+    keep their connections open, so workers sharing one service reuse connections
+    instead of opening a new one per request.
+    '''
+
+    def __init__(self, credentials, pool_size=8, timeout=120):
+        self.credentials = credentials
+        self.pool_size = max(1, pool_size)
+        self.timeout = timeout
+
+        self.pool = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.created = 0
+
+    def _checkout(self):
+        try:
+            return self.pool.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self.lock:
+            if self.created < self.pool_size:
+                self.created += 1
+                return google_auth_httplib2.AuthorizedHttp(
+                    self.credentials, http=httplib2.Http(timeout=self.timeout)
+                )
+
+        # Every connection is busy, wait for one to come back
+        return self.pool.get()
+
+    def request(self, uri, method='GET', *args, **kwargs):
+        '''Same signature as httplib2.Http.request, every request is recorded in the Drive metrics'''
+
+        http = self._checkout()
+        start = perf_counter()
+        try:
+            response, content = http.request(uri, method, *args, **kwargs)
+        except Exception as error:
+            observe_drive_request(uri, method, perf_counter() - start, error=error)
+            raise
+        finally:
+            self.pool.put(http)
+
+        observe_drive_request(
+            uri, method, perf_counter() - start, status=response.status
+        )
+        return response, content
+
+    def close(self):
+        '''Close the connections of every idle pooled Http'''
+
+        while True:
+            try:
+                http = self.pool.get_nowait()
+            except queue.Empty:
+                return
+            http.close()
@@ -0,0 +1,207 @@
+import os
+import sqlite3
+import threading
+import time
+
+JOB_STATES = ('queued', 'downloading', 'transcribed', 'uploaded', 'failed', 'removed')
+
+# States a job can be left in by a crash, these are picked up again on restart
+UNFINISHED_STATES = ('queued', 'downloading', 'transcribed')
+
+
+def revision_of(file):
+    '''Identify a version of a Drive file, by content checksum when Drive has one'''
+
+    return file.get('md5Checksum') or file.get('modifiedTime') or ''
+
+
+def migrate_legacy_downloads(ledger, files, download_folder):
+    '''
+    Record the files the listener processed before the ledger existed as uploaded.
+
+    That listener kept every download and skipped the files already in its download
+    folder, so on the first listing after an upgrade the files found there are
+    marked uploaded instead of being transcribed and uploaded a second time.
+    Returns the names of the migrated files
+    '''
+
+    if not os.path.isdir(download_folder):
+        return []
+
+    downloaded = {
+        name
+        for name in os.listdir(download_folder)
+        if os.path.isfile(os.path.join(download_folder, name))
+    }
+    migrated = []
+    for file in files:
+        if file['name'] in downloaded and ledger.enqueue(file):
+            ledger.mark(file, 'uploaded')
+            migrated.append(file['name'])
+    return migrated
+
+
+class JobLedger:
+    '''
+    SQLite-backed record of every Drive file the listener has seen.
+
+    Jobs are keyed by Drive file id plus revision (md5Checksum, falling back to
+    modifiedTime), so a modified or re-uploaded file is a new job while an unchanged
+    one is skipped with a single indexed lookup. Each job records its state, the
+    number of attempts and when it reached each state. Jobs whose file was deleted or
+    trashed in Drive before they ran end up in the removed state. The Drive id of the
+    transcript of a job is kept once it exists, so a retry updates that file.
+    '''
+
+    def __init__(self, db_filepath, max_attempts=3, retry_delay=300):
+        os.makedirs(os.path.dirname(db_filepath) or '.', exist_ok=True)
+
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_filepath, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+
+        with self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    file_id TEXT NOT NULL,
+                    revision TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    mime_type TEXT,
+                    md5_checksum TEXT,
+                    modified_time TEXT,
+                    state TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    queued_at REAL,
+                    downloading_at REAL,
+                    transcribed_at REAL,
+                    uploaded_at REAL,
+                    failed_at REAL,
+                    removed_at REAL,
+                    output_txt_id TEXT,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (file_id, revision)
+                )
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)')
+
+            # Ledgers created before a state was added lack its timestamp column
+            columns = {
+                row['name'] for row in self.conn.execute('PRAGMA table_info(jobs)')
+            }
+            for state in JOB_STATES:
+                if f'{state}_at' not in columns:
+                    self.conn.execute(f'ALTER TABLE jobs ADD COLUMN {state}_at REAL')
+            if 'output_txt_id' not in columns:
+                self.conn.execute('ALTER TABLE jobs ADD COLUMN output_txt_id TEXT')
+
+    def enqueue(self, file):
+        '''Queue a Drive file unless this revision of it is already known, True if queued'''
+
+        now = time.time()
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                '''
+                INSERT OR IGNORE INTO jobs (
+                    file_id, revision, name, mime_type, md5_checksum, modified_time,
+                    state, queued_at, updated_at
+                ) VALUES (?, ?, ?, ?, ?, ?, 'queued', ?, ?)
+                ''',
+                (
+                    file['id'],
+                    revision_of(file),
+                    file['name'],
+                    file.get('mimeType'),
+                    file.get('md5Checksum'),
+                    file.get('modifiedTime'),
+                    now,
+                    now,
+                ),
+            )
+        return cursor.rowcount == 1
+
+    def mark(self, file, state, error=None):
+        '''
+        Move a job to a new state. A move to failed counts an attempt, whichever stage
+        the job failed in, a cached job fails without ever downloading
+        '''
+
+        if state not in JOB_STATES:
+            raise ValueError(f'Unknown job state: {state}')
+
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                f'''
+                UPDATE jobs SET
+                    state = ?,
+                    {state}_at = ?,
+                    attempts = attempts + ?,
+                    last_error = COALESCE(?, last_error),
+                    updated_at = ?
+                WHERE file_id = ? AND revision = ?
+                ''',
+                (
+                    state,
+                    now,
+                    int(state == 'failed'),
+                    error,
+                    now,
+                    file['id'],
+                    revision_of(file),
+                ),
+            )
+
+    def set_output_id(self, file, drive_id):
+        '''Record the Drive id of the transcript of a job, partial or final'''
+
+        with self.lock, self.conn:
+            self.conn.execute(
+                'UPDATE jobs SET output_txt_id = ? WHERE file_id = ? AND revision = ?',
+                (drive_id, file['id'], revision_of(file)),
+            )
+
+    def get(self, file):
+        '''Return the ledger row of a Drive file revision, None if it was never seen'''
+
+        with self.lock:
+            return self.conn.execute(
+                'SELECT * FROM jobs WHERE file_id = ? AND revision = ?',
+                (file['id'], revision_of(file)),
+            ).fetchone()
+
+    def pending(self):
+        '''
+        Return the jobs still to be processed as file entries: queued jobs, jobs
+        interrupted by a restart, and failed jobs due for another attempt
+        '''
+
+        placeholders = ', '.join('?' for _ in UNFINISHED_STATES)
+        with self.lock:
+            rows = self.conn.execute(
+                f'''
+                SELECT * FROM jobs
+                WHERE state IN ({placeholders})
+                   OR (state = 'failed' AND attempts < ? AND failed_at <= ?)
+                ORDER BY queued_at
+                ''',
+                (*UNFINISHED_STATES, self.max_attempts, time.time() - self.retry_delay),
+            ).fetchall()
+
+        return [
+            {
+                'name': row['name'],
+                'id': row['file_id'],
+                'mimeType': row['mime_type'],
+                'md5Checksum': row['md5_checksum'],
+                'modifiedTime': row['modified_time'],
+                'output_txt_id': row['output_txt_id'],
+            }
+            for row in rows
+        ]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
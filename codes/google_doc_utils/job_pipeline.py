@@ -0,0 +1,217 @@
+import logging
+import queue
+import threading
+import time
+from time import perf_counter
+
+_STOP = object()
+
+
+class Stage:
+    '''
+    One step of a JobPipeline: a pool of worker threads taking jobs from a bounded
+    input queue, running fn on them and handing the result to the next stage
+    '''
+
+    def __init__(self, name, fn, workers, input_queue):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.input_queue = input_queue
+        self.next_stage = None
+        self.threads = []
+
+        self.lock = threading.Lock()
+        self.busy_seconds = 0.0
+        self.jobs_done = 0
+        self.jobs_failed = 0
+
+    def record(self, elapsed, failed):
+        with self.lock:
+            self.busy_seconds += elapsed
+            if failed:
+                self.jobs_failed += 1
+            else:
+                self.jobs_done += 1
+
+
+class JobPipeline:
+    '''
+    Staged producer/consumer pipeline for listener jobs.
+
+    Stages run in order, each with its own worker threads, and are connected by
+    bounded queues of prefetch_depth jobs. While one stage works on a job the
+    earlier stages already prepare the next ones, and a full queue holds the
+    earlier stages back so only a bounded number of jobs is in memory at once.
+
+    A stage function takes a job dict and returns it (or None to drop the job).
+    If it raises, on_error(job, stage_name, error) is called and the job is dropped.
+    Once stop() is called, jobs are dropped between stages rather than handed on.
+    '''
+
+    def __init__(self, prefetch_depth=2, on_error=None):
+        self.prefetch_depth = max(1, prefetch_depth)
+        self.on_error = on_error
+        self.stages = []
+
+        self.in_flight_lock = threading.Lock()
+        self.in_flight = set()
+        self.idle = threading.Condition(self.in_flight_lock)
+        self.started_at = None
+        self.stopping = False
+
+    def add_stage(self, name, fn, workers=1):
+        '''Append a stage, stages run in the order they are added'''
+
+        stage = Stage(
+            name, fn, max(1, workers), queue.Queue(maxsize=self.prefetch_depth)
+        )
+        if self.stages:
+            self.stages[-1].next_stage = stage
+        self.stages.append(stage)
+        return stage
+
+    def start(self):
+        '''Start the worker threads of every stage'''
+
+        self.started_at = perf_counter()
+        for stage in self.stages:
+            for index in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._work,
+                    args=(stage,),
+                    name=f'{stage.name}-{index}',
+                    daemon=True,
+                )
+                thread.start()
+                stage.threads.append(thread)
+
+    def submit(self, job, key):
+        '''
+        Hand a job to the first stage without blocking. Returns False if a job with
+        the same key is still in the pipeline, the first queue is full or the
+        pipeline is stopping.
+        '''
+
+        with self.in_flight_lock:
+            if self.stopping or key in self.in_flight:
+                return False
+            try:
+                self.stages[0].input_queue.put_nowait((key, job))
+            except queue.Full:
+                return False
+            self.in_flight.add(key)
+        return True
+
+    def is_in_flight(self, key):
+        '''Check if a job with this key is still in the pipeline'''
+
+        with self.in_flight_lock:
+            return key in self.in_flight
+
+    def queue_depths(self):
+        '''Number of jobs waiting in front of each stage'''
+
+        return {stage.name: stage.input_queue.qsize() for stage in self.stages}
+
+    def wait_until_idle(self, timeout=None):
+        '''Block until every submitted job has left the pipeline'''
+
+        with self.idle:
+            return self.idle.wait_for(lambda: not self.in_flight, timeout=timeout)
+
+    def stop(self, timeout=None):
+        '''
+        Stop taking jobs and stop the workers. Jobs waiting in a queue are dropped,
+        jobs being run get up to timeout seconds to finish their current stage and
+        are not handed to the next one. Returns the keys of the jobs left unfinished,
+        their workers are daemon threads and do not hold the process up.
+        '''
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        def remaining():
+            return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+        with self.in_flight_lock:
+            self.stopping = True
+        for stage in self.stages:
+            self._drain(stage)
+
+        for stage in self.stages:
+            for _ in stage.threads:
+                try:
+                    stage.input_queue.put(_STOP, timeout=remaining())
+                except queue.Full:
+                    break
+        for stage in self.stages:
+            for thread in stage.threads:
+                thread.join(remaining())
+
+        with self.in_flight_lock:
+            return set(self.in_flight)
+
+    def stats(self):
+        '''Busy time, job counts and utilisation of each stage since start()'''
+
+        wall_seconds = perf_counter() - self.started_at if self.started_at else 0.0
+        return {
+            stage.name: {
+                'workers': stage.workers,
+                'jobs_done': stage.jobs_done,
+                'jobs_failed': stage.jobs_failed,
+                'busy_seconds': round(stage.busy_seconds, 3),
+                'utilisation': (
+                    round(stage.busy_seconds / (wall_seconds * stage.workers), 3)
+                    if wall_seconds
+                    else 0.0
+                ),
+            }
+            for stage in self.stages
+        }
+
+    def _work(self, stage):
+        while True:
+            item = stage.input_queue.get()
+            if item is _STOP:
+                return
+
+            key, job = item
+            if self.stopping:
+                self._finish(key)
+                continue
+
+            start = perf_counter()
+            try:
+                job = stage.fn(job)
+            except Exception as error:
+                stage.record(perf_counter() - start, failed=True)
+                logging.exception('Job %s failed in the %s stage', key, stage.name)
+                if self.on_error is not None:
+                    try:
+                        self.on_error(job, stage.name, error)
+                    except Exception:
+                        logging.exception('Error handler failed for job %s', key)
+                self._finish(key)
+                continue
+
+            stage.record(perf_counter() - start, failed=False)
+            if job is None or stage.next_stage is None or self.stopping:
+                self._finish(key)
+            else:
+                # Blocks while the next stage is full, which holds this stage back
+                stage.next_stage.input_queue.put((key, job))
+
+    def _drain(self, stage):
+        while True:
+            try:
+                item = stage.input_queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not _STOP:
+                self._finish(item[0])
+
+    def _finish(self, key):
+        with self.in_flight_lock:
+            self.in_flight.discard(key)
+            self.idle.notify_all()
@@ -0,0 +1,107 @@
+import datetime
+import json
+import os
+import threading
+
+from codes.google_doc_utils.utils import upload_txt_file
+
+
+class StatusArchive:
+    '''
+    Rotated archive of old status messages.
+
+    Messages are appended to date-segmented part files (archive_status_<date>_<n>.txt)
+    that are capped at max_part_bytes. Each part is created in Drive once, after that
+    only the part being written to is re-uploaded, through the status writer. The cost
+    of archiving is bounded by the part size however long the service has been running.
+    The Drive id of every part is kept in index.json next to the parts.
+    '''
+
+    def __init__(
+        self,
+        archive_folder,
+        drive_folder_id,
+        status_writer,
+        service,
+        max_part_bytes=1_000_000,
+        prefix='archive_status',
+    ):
+        self.archive_folder = archive_folder
+        self.drive_folder_id = drive_folder_id
+        self.status_writer = status_writer
+        self.service = service
+        self.max_part_bytes = max_part_bytes
+        self.prefix = prefix
+
+        self.lock = threading.Lock()
+        self.index_filepath = os.path.join(archive_folder, 'index.json')
+        os.makedirs(archive_folder, exist_ok=True)
+        self.drive_ids = self.load_index()
+
+    def load_index(self):
+        '''Drive ids of the parts already created, keyed by part filename'''
+
+        if not os.path.isfile(self.index_filepath):
+            return {}
+        with open(self.index_filepath, 'r') as f:
+            return json.load(f)
+
+    def save_index(self):
+        tmp_filepath = self.index_filepath + '.tmp'
+        with open(tmp_filepath, 'w') as f:
+            json.dump(self.drive_ids, f, indent=2)
+        os.replace(tmp_filepath, self.index_filepath)
+
+    def archive(self, text):
+        '''Append old status messages to the archive, rotating parts as they fill up'''
+
+        if not text:
+            return
+
+        with self.lock:
+            for chunk in self.split(text):
+                part_filepath = self.current_part(len(chunk.encode()))
+                part_filename = os.path.basename(part_filepath)
+
+                if part_filename in self.drive_ids:
+                    self.status_writer.append(
+                        chunk, part_filepath, self.drive_ids[part_filename]
+                    )
+                else:
+                    # A part left without a Drive id by a failed upload is created again
+                    with open(part_filepath, 'a') as f:
+                        f.write(chunk)
+                    self.drive_ids[part_filename] = upload_txt_file(
+                        part_filepath, self.drive_folder_id, self.service
+                    )
+                    self.save_index()
+
+    def split(self, text):
+        '''Split text at line boundaries into chunks no larger than a part'''
+
+        chunks = ['']
+        for line in text.splitlines(keepends=True):
+            if chunks[-1] and len((chunks[-1] + line).encode()) > self.max_part_bytes:
+                chunks.append('')
+            chunks[-1] += line
+        return chunks
+
+    def current_part(self, incoming_bytes):
+        '''Today's latest part if the incoming text fits in it, else the next new part'''
+
+        date = datetime.date.today().isoformat()
+        number = 1
+        while os.path.isfile(self.part_filepath(date, number + 1)):
+            number += 1
+
+        part_filepath = self.part_filepath(date, number)
+        if os.path.isfile(part_filepath) and (
+            os.path.getsize(part_filepath) + incoming_bytes > self.max_part_bytes
+        ):
+            part_filepath = self.part_filepath(date, number + 1)
+        return part_filepath
+
+    def part_filepath(self, date, number):
+        return os.path.join(
+            self.archive_folder, f'{self.prefix}_{date}_{number:03d}.txt'
+        )
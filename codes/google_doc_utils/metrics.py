@@ -0,0 +1,100 @@
+from http import HTTPStatus
+
+from prometheus_client import Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import REGISTRY
+
+DRIVE_REQUEST_SECONDS = Histogram(
+    'drive_api_request_seconds',
+    'Latency of the Drive API requests',
+    ['kind'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+DRIVE_REQUESTS = Counter(
+    'drive_api_requests',
+    'Drive API requests by response status',
+    ['kind', 'method', 'status'],
+)
+DRIVE_ERRORS = Counter(
+    'drive_api_errors',
+    'Drive API requests that failed, with an error status or without a response',
+    ['kind', 'error'],
+)
+
+
+def request_kind(uri):
+    '''Coarse kind of a Drive API request, file ids would make too many label values'''
+
+    if '/upload/' in uri:
+        return 'upload'
+    if 'alt=media' in uri:
+        return 'download'
+    if '/batch' in uri:
+        return 'batch'
+    return 'metadata'
+
+
+def observe_drive_request(uri, method, seconds, status=None, error=None):
+    '''
+    Record one Drive API request, with the HTTP status of its response or the
+    exception that left it without one
+    '''
+
+    kind = request_kind(uri)
+    DRIVE_REQUEST_SECONDS.labels(kind).observe(seconds)
+    DRIVE_REQUESTS.labels(
+        kind, method, str(status) if status is not None else 'none'
+    ).inc()
+    if error is not None:
+        DRIVE_ERRORS.labels(kind, type(error).__name__).inc()
+    elif status >= HTTPStatus.BAD_REQUEST:
+        DRIVE_ERRORS.labels(kind, str(status)).inc()
+
+
+class PipelineCollector:
+    '''
+    Prometheus collector reading queue depths and stage counters of a JobPipeline
+    at scrape time, so the pipeline itself does not know about metrics
+    '''
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+
+    def collect(self):
+        depth = GaugeMetricFamily(
+            'listener_queue_depth',
+            'Jobs waiting in front of a pipeline stage',
+            labels=['stage'],
+        )
+        for stage, size in self.pipeline.queue_depths().items():
+            depth.add_metric([stage], size)
+
+        in_flight = GaugeMetricFamily(
+            'listener_jobs_in_flight',
+            'Jobs submitted to the pipeline and not finished yet',
+        )
+        with self.pipeline.in_flight_lock:
+            in_flight.add_metric([], len(self.pipeline.in_flight))
+
+        jobs = CounterMetricFamily(
+            'listener_stage_jobs',
+            'Jobs a pipeline stage is done with',
+            labels=['stage', 'result'],
+        )
+        busy = CounterMetricFamily(
+            'listener_stage_busy_seconds',
+            'Time the workers of a pipeline stage spent on jobs',
+            labels=['stage'],
+        )
+        for stage in self.pipeline.stages:
+            jobs.add_metric([stage.name, 'done'], stage.jobs_done)
+            jobs.add_metric([stage.name, 'failed'], stage.jobs_failed)
+            busy.add_metric([stage.name], stage.busy_seconds)
+
+        return [depth, in_flight, jobs, busy]
+
+
+def track_pipeline(pipeline, registry=REGISTRY):
+    '''Expose the queue depths and stage counters of a pipeline'''
+
+    registry.register(PipelineCollector(pipeline))
@@ -0,0 +1,84 @@
+import time
+
+
+class PartialTranscript:
+    '''
+    Publishes a transcript to Drive while it is still being written.
+
+    The Drive file is created in folder_id with the first segment, then refreshed in
+    place every `every_segments` segments or `every_seconds` seconds, whichever comes
+    first (0 turns either cadence off, both 0 turn publishing off). Creation and
+    refreshes both go through the StatusWriter, so a long job never waits on Drive
+    and its file is uploaded at most once per StatusWriter interval. finish() drops
+    the pending refresh, the caller then replaces the partial copy with the final
+    transcript. The Drive file is named file_name, the name of the local file if None.
+    With a drive_id, such as the partial transcript of a failed attempt, that file is
+    refreshed instead of a new one created.
+    '''
+
+    def __init__(
+        self,
+        local_path,
+        folder_id,
+        status_writer,
+        every_segments=0,
+        every_seconds=0.0,
+        mimetype='text/plain',
+        suffix='',
+        file_name=None,
+        drive_id=None,
+    ):
+        self.local_path = local_path
+        self.file_name = file_name
+        self.drive_id = drive_id
+        self.folder_id = folder_id
+        self.status_writer = status_writer
+        self.every_segments = every_segments
+        self.every_seconds = every_seconds
+        self.mimetype = mimetype
+        # Closes a partial copy, e.g. the end of the JSON document
+        self.suffix = suffix
+
+        self.enabled = bool(every_segments or every_seconds)
+        self.published = False
+        self.segments = 0
+        self.published_segments = 0
+        self.published_at = time.monotonic()
+
+    def segment_written(self):
+        '''Count a segment flushed to the local file, publishing it when due'''
+
+        self.segments += 1
+        now = time.monotonic()
+        # The first text is published as soon as it is transcribed
+        if not self.enabled or (self.published and not self._is_due(now)):
+            return
+
+        self.status_writer.publish(
+            self.local_path,
+            self.drive_id,
+            self.suffix,
+            self.mimetype,
+            folder_id=self.folder_id,
+            file_name=self.file_name,
+        )
+        self.published = True
+        self.published_segments = self.segments
+        self.published_at = now
+
+    def _is_due(self, now):
+        if (
+            self.every_segments
+            and self.segments - self.published_segments >= self.every_segments
+        ):
+            return True
+        return (
+            bool(self.every_seconds) and now - self.published_at >= self.every_seconds
+        )
+
+    def finish(self):
+        '''Stop publishing, returns the id of the partial Drive file, None if there is none'''
+
+        if not self.published:
+            return self.drive_id
+        return self.status_writer.discard(self.local_path)
@@ -0,0 +1,245 @@
+import logging
+import os
+import threading
+import time
+
+from codes.google_doc_utils.utils import update_txt_content, upload_txt_content
+
+
+class StatusWriter:
+    '''
+    Background writer for the status txt files kept in Drive.
+
+    Status messages are written to the local txt file straight away, the Drive copy
+    is refreshed by a background thread. Updates to the same file are coalesced:
+    an upload waits until the file has been quiet for `debounce` seconds (or has
+    been waiting for `interval` seconds), and each Drive file is uploaded at most
+    once per `interval` seconds. Callers never wait on Drive.
+
+    Files written by someone else, such as partial transcripts, are scheduled with
+    publish() and go through the same coalescing. A published file without a Drive
+    copy yet is created in a folder by the background thread, as soon as it can.
+
+    A Drive copy is named after its local file unless given a file_name, so local
+    files can be named uniquely while their Drive copies keep readable names.
+    '''
+
+    def __init__(self, service, debounce=2.0, interval=10.0):
+        self.service = service
+        self.debounce = debounce
+        self.interval = interval
+
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.entries = {}
+        self.uploading = set()
+        self.closed = False
+        self.thread = threading.Thread(
+            target=self._run, name='status-writer', daemon=True
+        )
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def append(self, text, local_path, drive_id, file_name=None):
+        '''Append text to a local status file and schedule its upload'''
+
+        self._update(text, local_path, drive_id, mode='a', file_name=file_name)
+
+    def write(self, text, local_path, drive_id, file_name=None):
+        '''Overwrite a local status file and schedule its upload'''
+
+        self._update(text, local_path, drive_id, mode='w', file_name=file_name)
+
+    def publish(
+        self,
+        local_path,
+        drive_id,
+        suffix='',
+        mimetype='text/plain',
+        folder_id=None,
+        file_name=None,
+    ):
+        '''
+        Schedule the upload of a local file written elsewhere, suffix is added to the
+        end of the uploaded copy only. With no drive_id the Drive file is created in
+        folder_id by the first upload, and updated by the next ones
+        '''
+
+        with self.lock:
+            entry = self._mark_dirty(local_path, drive_id, file_name)
+            entry['suffix'] = suffix
+            entry['mimetype'] = mimetype
+            entry['folder_id'] = folder_id
+
+    def discard(self, local_path):
+        '''
+        Wait for an upload of a file in progress to finish and drop its pending one, so
+        the caller can replace the Drive copy without a stale upload landing after it.
+        Returns the id of the Drive copy, None if it was never created
+        '''
+
+        with self.lock:
+            while local_path in self.uploading:
+                self.wakeup.wait()
+            entry = self.entries.pop(local_path, None)
+        return None if entry is None else entry['drive_id']
+
+    def close(self, retries=3):
+        '''Stop the background thread and upload every pending file, ignoring the interval'''
+
+        with self.lock:
+            self.closed = True
+            self.wakeup.notify_all()
+        if self.thread.is_alive():
+            self.thread.join()
+
+        for _ in range(retries):
+            if not self._upload_ready(force=True):
+                return
+        logging.error('Status files left unflushed: %s', list(self._dirty_paths()))
+
+    def _update(self, text, local_path, drive_id, mode, file_name=None):
+        with self.lock:
+            os.makedirs(os.path.dirname(local_path) or '.', exist_ok=True)
+            with open(local_path, mode) as f:
+                f.write(text)
+            self._mark_dirty(local_path, drive_id, file_name)
+
+    def _mark_dirty(self, local_path, drive_id, file_name=None):
+        now = time.monotonic()
+        entry = self.entries.setdefault(
+            local_path,
+            {
+                'drive_id': drive_id,
+                'folder_id': None,
+                'dirty_since': None,
+                'last_upload': 0.0,
+                'suffix': '',
+                'mimetype': 'text/plain',
+                'file_name': os.path.basename(local_path),
+            },
+        )
+        if file_name is not None:
+            entry['file_name'] = file_name
+        # A file created by the background thread keeps its id
+        if drive_id is not None:
+            entry['drive_id'] = drive_id
+        entry['last_change'] = now
+        if entry['dirty_since'] is None:
+            entry['dirty_since'] = now
+        self.wakeup.notify_all()
+        return entry
+
+    def _dirty_paths(self):
+        with self.lock:
+            return [
+                path
+                for path, entry in self.entries.items()
+                if entry['dirty_since'] is not None
+            ]
+
+    def _is_ready(self, entry, now):
+        if entry['dirty_since'] is None:
+            return False
+        if entry['drive_id'] is None:
+            # Files to create go out at once, retries of a failed one once per interval
+            return now - entry['last_upload'] >= self.interval
+        quiet = now - entry['last_change'] >= self.debounce
+        waited = now - entry['dirty_since'] >= self.interval
+        return (quiet or waited) and now - entry['last_upload'] >= self.interval
+
+    def _upload_ready(self, force=False):
+        '''
+        Upload every file due for an upload (every dirty file if force), returns
+        the number of uploads that failed and stay pending
+        '''
+
+        now = time.monotonic()
+        uploads = []
+        with self.lock:
+            for local_path, entry in self.entries.items():
+                if entry['dirty_since'] is not None and (
+                    force or self._is_ready(entry, now)
+                ):
+                    with open(local_path, 'r') as f:
+                        content = f.read() + entry['suffix']
+                    uploads.append((local_path, dict(entry), content))
+                    entry['dirty_since'] = None
+                    entry['last_upload'] = now
+                    self.uploading.add(local_path)
+
+        failed = 0
+        for local_path, uploaded, content in uploads:
+            try:
+                self._upload(local_path, uploaded, content)
+            except Exception:
+                logging.exception(
+                    'Status upload of %s failed, retrying later', local_path
+                )
+                failed += 1
+                with self.lock:
+                    # Unless discarded in the meantime
+                    entry = self.entries.get(local_path)
+                    if entry is not None and entry['dirty_since'] is None:
+                        entry['dirty_since'] = now
+            finally:
+                with self.lock:
+                    self.uploading.discard(local_path)
+                    self.wakeup.notify_all()
+        return failed
+
+    def _upload(self, local_path, entry, content):
+        file_name = entry['file_name']
+        if entry['drive_id'] is not None:
+            update_txt_content(
+                content,
+                file_name,
+                entry['drive_id'],
+                self.service,
+                mimetype=entry['mimetype'],
+            )
+            return
+
+        drive_id = upload_txt_content(
+            content,
+            file_name,
+            entry['folder_id'],
+            self.service,
+            mimetype=entry['mimetype'],
+        )
+        with self.lock:
+            # discard() waits for this upload, so the entry is still there
+            self.entries[local_path]['drive_id'] = drive_id
+
+    def _next_deadline(self, now):
+        deadlines = [
+            self._deadline(entry)
+            for entry in self.entries.values()
+            if entry['dirty_since'] is not None
+        ]
+        return min(deadlines) - now if deadlines else None
+
+    def _deadline(self, entry):
+        if entry['drive_id'] is None:
+            return entry['last_upload'] + self.interval
+        return max(
+            min(
+                entry['last_change'] + self.debounce,
+                entry['dirty_since'] + self.interval,
+            ),
+            entry['last_upload'] + self.interval,
+        )
+
+    def _run(self):
+        while True:
+            with self.lock:
+                if self.closed:
+                    return
+                timeout = self._next_deadline(time.monotonic())
+                if timeout is None or timeout > 0:
+                    self.wakeup.wait(timeout)
+                if self.closed:
+                    return
+            self._upload_ready()
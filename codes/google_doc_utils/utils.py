@@ -1,20 +1,40 @@
 import os
 import io
 import re
+import hashlib
+import logging
+import time
+from http import HTTPStatus
 
 from google.auth.transport.requests import Request # type: ignore
 from google.oauth2.credentials import Credentials # type: ignore
 from google_auth_oauthlib.flow import InstalledAppFlow # type: ignore
 from googleapiclient.discovery import build # type: ignore
-from googleapiclient.http import MediaIoBaseDownload, MediaFileUpload # type: ignore
+from googleapiclient.errors import HttpError # type: ignore
+import httplib2 # type: ignore
+from googleapiclient.http import MediaFileUpload, MediaIoBaseUpload # type: ignore
 
-from moviepy.video.io.VideoFileClip import VideoFileClip
+from codes.google_doc_utils.http_pool import PooledHttp
 
 # If modifying these SCOPES, delete the file token.json.
 SCOPES = ['https://www.googleapis.com/auth/drive']
 
-def authenticate():
-    """Authenticate the user and return the service object."""
+DOWNLOAD_CHUNK_SIZE = 32 * 1024 * 1024
+DOWNLOAD_RETRIES = 5
+# Seconds between two progress log lines of a download or upload
+PROGRESS_LOG_INTERVAL = 10
+
+# Resumable upload chunks must be a multiple of 256 KB
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_RETRIES = 5
+# Files up to this size are sent in a single simple upload request
+SIMPLE_UPLOAD_MAX_BYTES = 5 * 1024 * 1024
+
+def authenticate(pool_size=8):
+    """
+    Authenticate the user and return the service object. The service runs on a pooled
+    transport, so it can be shared by worker threads and reuses its connections.
+    """
     creds = None
     credentials_path = 'credentials.json'
     if os.path.exists('token.json'):
@@ -27,7 +47,7 @@ def authenticate():
             creds = flow.run_local_server(port=0)
         with open('token.json', 'w') as token:
             token.write(creds.to_json())
-    service = build('drive', 'v3', credentials=creds)
+    service = build('drive', 'v3', http=PooledHttp(creds, pool_size=pool_size))
     return service
 
 def extract_root_folder_id(drive_url):
@@ -37,68 +57,266 @@ def extract_root_folder_id(drive_url):
         raise ValueError('Invalid Google Drive folder URL')
     return match.group(1)
 
-def get_all_audio_files(folder_id, service):
-    """Extract name and ids of all wav and mp3 (mpeg) files in folder id"""
+AUDIO_MIME_TYPES = ('audio/wav', 'audio/mpeg', 'audio/x-wav')
+VIDEO_MIME_TYPES = ('video/mp4',)
+MEDIA_MIME_TYPES = AUDIO_MIME_TYPES + VIDEO_MIME_TYPES
+
+# Metadata requested for every listed file, later stages reuse it instead of refetching
+FILE_FIELDS = 'id, name, mimeType, parents, trashed, md5Checksum, modifiedTime'
+
+def mime_type_query(mime_types):
+    """Build a single query clause matching any of the mime types"""
 
-    query = f"'{folder_id}' in parents and (mimeType='audio/wav' or mimeType='audio/mpeg' or mimeType = 'audio/x-wav')"
-    results = service.files().list(q=query, fields="files(id, name)").execute()
-    files = results.get('files', [])
+    return (
+        '(' + ' or '.join(f"mimeType = '{mime_type}'" for mime_type in mime_types) + ')'
+    )
 
-    list_of_wav = []
-    for file in files:
-        wav_entry = {'name':file['name'], 'id':file['id']}
-        list_of_wav.append(wav_entry)
+
+def list_files(query, service, page_size=1000):
+    """List every file matching a query, following nextPageToken across pages"""
+
+    files = []
+    page_token = None
+    while True:
+        results = service.files().list(
+            q=query,
+            fields=f"nextPageToken, files({FILE_FIELDS})",
+            pageSize=page_size,
+            pageToken=page_token,
+        ).execute()
+        files.extend(results.get('files', []))
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return files
+
+def to_file_entry(file):
+    """Keep the listing metadata of a Drive file that the listener needs"""
     
-    return list_of_wav
+    return {
+        'name': file['name'],
+        'id': file['id'],
+        'mimeType': file.get('mimeType'),
+        'md5Checksum': file.get('md5Checksum'),
+        'modifiedTime': file.get('modifiedTime'),
+    }
+
+def get_all_media_files(folder_id, service, mime_types=MEDIA_MIME_TYPES):
+    """Extract name and ids of all audio and video files in folder id with a single query"""
+
+    query = f"'{folder_id}' in parents and trashed = false and {mime_type_query(mime_types)}"
+
+    return [to_file_entry(file) for file in list_files(query, service)]
+
+def get_all_audio_files(folder_id, service):
+    """Extract name and ids of all wav and mp3 (mpeg) files in folder id"""
+
+    return get_all_media_files(folder_id, service, AUDIO_MIME_TYPES)
 
 def get_all_mp4_files(folder_id, service):
     """Extract name and ids of all mp4 files in folder id"""
 
-    query = f"'{folder_id}' in parents and mimeType='video/mp4'"
-    results = service.files().list(q=query, fields="files(id, name)").execute()
-    files = results.get('files', [])
+    return get_all_media_files(folder_id, service, VIDEO_MIME_TYPES)
 
-    list_of_mp4 = []
-    for file in files:
-        wav_entry = {'name':file['name'], 'id':file['id']}
-        list_of_mp4.append(wav_entry)
+def get_start_page_token(service):
+    """Get the changes feed token marking the current state of the Drive"""
     
-    return list_of_mp4
+    return service.changes().getStartPageToken().execute()['startPageToken']
+
+def list_changes(page_token, service, page_size=1000):
+    """
+    List every change since page_token, following nextPageToken across pages.
+    Returns the changes and the token to start the next poll from.
+    """
+
+    changes = []
+    while True:
+        results = (
+            service.changes()
+            .list(
+                pageToken=page_token,
+                fields=f"nextPageToken, newStartPageToken, changes(fileId, removed, file({FILE_FIELDS}))",
+                pageSize=page_size,
+                spaces='drive',
+            )
+            .execute()
+        )
+        changes.extend(results.get('changes', []))
+        if 'newStartPageToken' in results:
+            return changes, results['newStartPageToken']
+        page_token = results['nextPageToken']
+
+def get_files_metadata(file_ids, service, batch_size=100):
+    """
+    Fetch the metadata of several files with batched requests, one HTTP round-trip
+    per batch_size files. Files that no longer exist are left out of the result.
+    """
+
+    metadata = {}
+
+    def callback(request_id, response, exception):
+        if exception is None:
+            metadata[request_id] = response
+
+    for start in range(0, len(file_ids), batch_size):
+        batch = service.new_batch_http_request(callback=callback)
+        for file_id in file_ids[start:start + batch_size]:
+            batch.add(
+                service.files().get(fileId=file_id, fields=FILE_FIELDS),
+                request_id=file_id,
+            )
+        batch.execute()
+
+    return metadata
+
+def download_file(file_id, output_folder, service, file_name=None, md5_checksum=None,
+                  chunk_size=DOWNLOAD_CHUNK_SIZE, num_retries=DOWNLOAD_RETRIES):
+    '''
+    Download file from Google Drive, file_name from the listing saves a metadata call.
+
+    The file is fetched in chunk_size HTTP Range requests into a .part file named
+    after the file id and md5Checksum, so downloads of same-named files or of two
+    revisions of a file never share one. A failed chunk is retried from the last good
+    offset, and a download left unfinished by an earlier failure resumes where it
+    stopped. The file is checked against Drive's md5Checksum and only renamed to its
+    final name once complete.
+    '''
+
+    if file_name is None or md5_checksum is None:
+        file_metadata = (
+            service.files().get(fileId=file_id, fields='name, md5Checksum').execute()
+        )
+        file_name = file_name or file_metadata['name']
+        md5_checksum = md5_checksum or file_metadata.get('md5Checksum')
 
-def download_file(file_id, output_folder, service):
-    ''' Download file from Google Drive'''
-    
-    file_metadata = service.files().get(fileId=file_id).execute()
-    file_name = file_metadata['name']
-    print(file_metadata)
-    
     request = service.files().get_media(fileId = file_id)
-    
+
     file_path = os.path.join(output_folder, file_name)
+    part_path = part_file_path(output_folder, file_id, md5_checksum)
     os.makedirs(output_folder, exist_ok=True)
-    
-    with io.FileIO(file_path, 'wb') as fh:
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while not done:
-            status, done = downloader.next_chunk()
-            print(f"Download {int(status.progress() * 100)}% complete.")
-            print("done",done)
-            
+
+    md5, offset = read_part_file(part_path)
+    if offset:
+        logging.info("Resuming download of %s at %s bytes", file_name, offset)
+
+    with open(part_path, 'ab') as fh:
+        md5, offset = download_ranges(
+            request, fh, md5, offset, file_name, chunk_size, num_retries
+        )
+
+    if md5_checksum and md5.hexdigest() != md5_checksum:
+        os.remove(part_path)
+        raise ValueError(
+            f"Checksum mismatch for {file_name}, the download will start over"
+        )
+
+    os.replace(part_path, file_path)
+    logging.info("Download of %s complete, %s bytes", file_name, offset)
+
     return file_path
+
+def part_file_path(output_folder, file_id, md5_checksum=None):
+    ''' Path of the .part file of a download, one per Drive file revision '''
+
+    if md5_checksum:
+        return os.path.join(output_folder, f'{file_id}.{md5_checksum}.part')
+    return os.path.join(output_folder, f'{file_id}.part')
+
+def read_part_file(part_path):
+    ''' md5 and size of what an earlier download left in a .part file, to resume it '''
+
+    md5 = hashlib.md5()
+    offset = 0
+    if os.path.isfile(part_path):
+        with open(part_path, 'rb') as fh:
+            for block in iter(lambda: fh.read(1024 * 1024), b''):
+                md5.update(block)
+                offset += len(block)
+    return md5, offset
+
+def download_ranges(request, fh, md5, offset, file_name, chunk_size, num_retries):
+    '''
+    Append the rest of a file to the open .part file fh from offset on, one Range
+    request per chunk_size bytes. Returns the md5 and the size of the whole file
+    '''
+
+    total_size = None
+    last_log = time.monotonic()
+    while total_size is None or offset < total_size:
+        headers = dict(request.headers)
+        headers['range'] = f'bytes={offset}-{offset + chunk_size - 1}'
+        resp, content = request_with_retries(
+            request.http, request.uri, headers, num_retries
+        )
+
+        if resp.status == HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE:
+            if offset <= content_range_total(resp, offset):
+                # The part file already holds the whole file
+                break
+            # The part file is larger than the file, it is not a part of it
+            logging.warning(
+                "Part file of %s is larger than the file, starting over", file_name
+            )
+            md5, offset = restart_part_file(fh)
+            continue
+        if resp.status not in (HTTPStatus.OK, HTTPStatus.PARTIAL_CONTENT):
+            raise HttpError(resp, content, uri=request.uri)
+        if resp.status == HTTPStatus.OK and offset:
+            # The range was ignored and the whole file sent, start the part over
+            md5, offset = restart_part_file(fh)
+
+        fh.write(content)
+        md5.update(content)
+        offset += len(content)
+        total_size = content_range_total(resp, offset)
+
+        if time.monotonic() - last_log >= PROGRESS_LOG_INTERVAL:
+            last_log = time.monotonic()
+            logging.info(
+                "Download of %s %d%% complete",
+                file_name,
+                100 * offset // max(total_size, 1),
+            )
+
+    return md5, offset
+
+def restart_part_file(fh):
+    ''' Empty an open .part file, returns the md5 and offset to start over from '''
+
+    fh.seek(0)
+    fh.truncate()
+    return hashlib.md5(), 0
+
+def content_range_total(resp, default):
+    '''Full size of a file from the Content-Range of a response, default without one'''
+
+    if 'content-range' not in resp:
+        return default
+    return int(resp['content-range'].rsplit('/', 1)[1])
+
+def request_with_retries(http, uri, headers, num_retries):
+    '''GET a uri, retrying connection errors and 429/5xx responses with exponential backoff'''
+
+    for attempt in range(num_retries + 1):
+        try:
+            resp, content = http.request(uri, 'GET', headers=headers)
+            if (
+                resp.status != HTTPStatus.TOO_MANY_REQUESTS
+                and resp.status < HTTPStatus.INTERNAL_SERVER_ERROR
+            ):
+                return resp, content
+            error = HttpError(resp, content, uri=uri)
+        except (
+            ConnectionError,
+            TimeoutError,
+            httplib2.HttpLib2Error,
+        ) as connection_error:
+            error = connection_error
+
+        if attempt == num_retries:
+            raise error
+        logging.warning("Request to %s failed (%s), retrying", uri, error)
+        time.sleep(2 ** attempt)
             
-def check_if_file_in_folder(filename, folder_path):
-    ''' check if a file is in a folder , return True if in, return False if not '''
-    
-    onlyfiles = [f for f in os.listdir(folder_path) if os.path.isfile(os.path.join(folder_path, f))]
-    
-    if (filename in onlyfiles):
-        #print(f"{filename} is in {folder_path}")
-        return True
-    else:
-        #print(f"{filename} is not in {folder_path}")
-        return False
-    
 def write_text_to_txt(text, output_text_filepath):
     ''' Write a string into a txt file '''
 
@@ -113,83 +331,166 @@ def append_text_to_txt(text, output_text_filepath):
         
         f.write(text)
         
-def audio_from_mp4(mp4_filepath):
-    ''' Read an mp4's audio file into a numpy array'''
+def upload_txt_file(
+    file_path,
+    folder_id,
+    service,
+    mimetype="text/plain",
+    chunk_size=UPLOAD_CHUNK_SIZE,
+    file_name=None,
+):
+    """Uploads a TXT file to a specific Google Drive folder, as file_name if given."""
     
-    video_clip = VideoFileClip(mp4_filepath)
+    file_metadata = {
+        "name": file_name or os.path.basename(file_path),  # Keep the original file name
+        "parents": [folder_id]  # Upload to the specified folder
+    }
 
-    if not video_clip.audio:
-        return {"error": "No audio found in the MP4 file"}
+    media = media_from_file(file_path, mimetype, chunk_size)
 
-    audio_clip = video_clip.audio
-    audio_array = audio_clip.to_soundarray()
-    sample_rate = audio_clip.fps
+    uploaded_file = execute_upload(service.files().create(
+        body=file_metadata,
+        media_body=media,
+        fields="id, name"
+    ), file_metadata["name"])
 
-    audio_clip.close()
-    video_clip.close()
+    print(f"Uploaded {uploaded_file['name']} with ID: {uploaded_file['id']}")
+    return uploaded_file['id']
 
-    os.remove(mp4_filepath)
+def update_txt_file(
+    file_path,
+    file_id,
+    service,
+    mimetype="text/plain",
+    chunk_size=UPLOAD_CHUNK_SIZE,
+    file_name=None,
+):
+    """Overwrites a TXT file in Google Drive with a local file, named file_name if given."""
 
-    audio_array = audio_array.T
+    file_metadata = {
+        "name": file_name or os.path.basename(file_path),  # Keep the original file name
+    }
 
-    return audio_array, sample_rate
+    media = media_from_file(file_path, mimetype, chunk_size)
 
-def audio_from_mp4(mp4_filepath):
-    ''' Read an mp4's audio file into a numpy array'''
-    
-    video_clip = VideoFileClip(mp4_filepath)
+    uploaded_file = execute_upload(service.files().update(
+        body=file_metadata,
+        media_body=media,
+        fields="id, name",
+        fileId = file_id,
+    ), file_metadata["name"])
 
-    if not video_clip.audio:
-        return {"error": "No audio found in the MP4 file"}
+    print(f"Uploaded {uploaded_file['name']} with ID: {uploaded_file['id']}")
+    return 
 
-    audio_clip = video_clip.audio
-    audio_array = audio_clip.to_soundarray()
-    sample_rate = audio_clip.fps
+def rename_file(file_id, file_name, service):
+    """Renames a file in Google Drive, its content is left as it is."""
 
-    audio_clip.close()
-    video_clip.close()
+    service.files().update(
+        fileId=file_id, body={"name": file_name}, fields="id, name"
+    ).execute()
 
-    audio_array = audio_array.T
 
-    return audio_array, sample_rate
+def upload_txt_content(
+    text,
+    file_name,
+    folder_id,
+    service,
+    mimetype="text/plain",
+    chunk_size=UPLOAD_CHUNK_SIZE,
+):
+    """Uploads text held in memory as a new TXT file in a specific Google Drive folder."""
 
-def upload_txt_file(file_path, folder_id, service):
-    """Uploads a TXT file to a specific Google Drive folder."""
-    
     file_metadata = {
-        "name": os.path.basename(file_path),  # Keep the original file name
-        "parents": [folder_id]  # Upload to the specified folder
+        "name": file_name,
+        "parents": [folder_id]
     }
 
-    media = MediaFileUpload(file_path, mimetype="text/plain")
-
-    uploaded_file = service.files().create(
+    uploaded_file = execute_upload(service.files().create(
         body=file_metadata,
-        media_body=media,
+        media_body=media_from_text(text, mimetype, chunk_size),
         fields="id, name"
-    ).execute()
+    ), file_name)
 
     print(f"Uploaded {uploaded_file['name']} with ID: {uploaded_file['id']}")
     return uploaded_file['id']
 
-def update_txt_file(file_path, file_id, service):
-    """Uploads a TXT file to a specific Google Drive folder."""
-    
+def update_txt_content(
+    text,
+    file_name,
+    file_id,
+    service,
+    mimetype="text/plain",
+    chunk_size=UPLOAD_CHUNK_SIZE,
+):
+    """Overwrites a TXT file in Google Drive with text held in memory."""
+
     file_metadata = {
-        "name": os.path.basename(file_path),  # Keep the original file name
+        "name": file_name,
     }
 
-    media = MediaFileUpload(file_path, mimetype="text/plain")
+    media = media_from_text(text, mimetype, chunk_size)
 
-    uploaded_file = service.files().update(
+    execute_upload(service.files().update(
         body=file_metadata,
         media_body=media,
         fields="id, name",
         fileId = file_id,
-    ).execute()
-
-    print(f"Uploaded {uploaded_file['name']} with ID: {uploaded_file['id']}")
-    return 
+    ), file_name)
+
+def media_from_text(text, mimetype, chunk_size=UPLOAD_CHUNK_SIZE):
+    ''' Media body for text held in memory, resumable past SIMPLE_UPLOAD_MAX_BYTES '''
+
+    data = text.encode()
+    return MediaIoBaseUpload(
+        io.BytesIO(data), mimetype=mimetype, chunksize=chunk_size,
+        resumable=len(data) > SIMPLE_UPLOAD_MAX_BYTES,
+    )
+
+def media_from_file(file_path, mimetype, chunk_size=UPLOAD_CHUNK_SIZE):
+    '''
+    Media body for a local file: a simple upload for small files, a resumable
+    session sent in chunks of chunk_size bytes for larger ones
+    '''
+
+    resumable = os.path.getsize(file_path) > SIMPLE_UPLOAD_MAX_BYTES
+    return MediaFileUpload(
+        file_path, mimetype=mimetype, chunksize=chunk_size, resumable=resumable
+    )
+
+
+def execute_upload(request, file_name, num_retries=UPLOAD_RETRIES):
+    '''
+    Run an upload request and return its response. Resumable uploads are sent chunk
+    by chunk, 429/5xx responses are retried by the client and after a dropped
+    connection the session is resumed from the last byte Drive acknowledged
+    '''
+
+    if request.resumable is None or not request.resumable.resumable():
+        return request.execute(num_retries=num_retries)
+
+    response = None
+    failures = 0
+    last_log = time.monotonic()
+    while response is None:
+        try:
+            status, response = request.next_chunk(num_retries=num_retries)
+        except (ConnectionError, TimeoutError, httplib2.HttpLib2Error) as error:
+            failures += 1
+            if failures > num_retries:
+                raise
+            logging.warning("Upload of %s interrupted (%s), resuming", file_name, error)
+            time.sleep(2 ** failures)
+            continue
+
+        failures = 0
+        if status and time.monotonic() - last_log >= PROGRESS_LOG_INTERVAL:
+            last_log = time.monotonic()
+            logging.info(
+                "Upload of %s %d%% complete", file_name, status.progress() * 100
+            )
+
+    return response
 
 def read_txt_file(txt_filepath):
     ''' Read contents of a txt file '''
@@ -1,19 +1,48 @@
+import hashlib
 import os
-import tempfile
+import signal
+import sys
 import time
-from codes.asr_inference_service.audio_preprocessing import resample_audio_array
+from codes.asr_inference_service.audio_ingest import (
+    extract_audio_ffmpeg,
+    iter_audio_chunks,
+    load_audio,
+    prefetch_audio_chunks,
+)
 from codes.asr_inference_service.model import ASRModelForInference
-from codes.google_doc_utils.utils import (audio_from_mp4, authenticate,
-                                         check_if_file_in_folder,
-                                         download_file, write_text_to_txt,
+from codes.asr_inference_service.profiling import parse_profilers, profile_job
+from codes.asr_inference_service.result_cache import (
+    ResultCache,
+    hash_audio,
+    hashed_chunks,
+)
+from codes.asr_inference_service.transcript import (
+    OUTPUT_EXTENSIONS,
+    OUTPUT_MEDIA_TYPES,
+    TranscriptWriter,
+    check_output_format,
+    transcript_footer,
+)
+from codes.google_doc_utils.utils import (VIDEO_MIME_TYPES, authenticate,
+                                         download_file, get_files_metadata,
+                                         write_text_to_txt,
                                          extract_root_folder_id, read_txt_file,
-                                         get_all_audio_files, append_text_to_txt,
-                                         get_all_mp4_files, upload_txt_file, update_txt_file)
+                                         rename_file, update_txt_file, upload_txt_file)
+from codes.google_doc_utils.drive_watcher import DriveChangeWatcher
 from codes.google_doc_utils.error_handling import get_status_message
+from codes.google_doc_utils.job_ledger import (
+    JobLedger,
+    migrate_legacy_downloads,
+    revision_of,
+)
+from codes.google_doc_utils.job_pipeline import JobPipeline
+from codes.google_doc_utils.log_rotation import StatusArchive
+from codes.google_doc_utils.metrics import track_pipeline
+from codes.google_doc_utils.partial_upload import PartialTranscript
+from codes.google_doc_utils.status_writer import StatusWriter
 
-import librosa
-import soundfile as sf
 from dotenv import load_dotenv
+from prometheus_client import start_http_server
 
 load_dotenv()
 
@@ -24,19 +53,46 @@ AUDIO_VIDEO_URL = '#'
 
 LOCAL_DOWNLOAD_FOLDER = 'downloads'
 LOCAL_OUTPUT_FOLDER = 'outputs'
+# Transcript format uploaded to the outputs folder: text, srt, vtt or json
+OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", "text")
+check_output_format(OUTPUT_FORMAT)
 LOCAL_LOGS_TXT_FILE = 'logs'
+LOCAL_STATE_FOLDER = 'state'
 SAMPLE_RATE = 16000
+RESAMPLER = os.getenv("RESAMPLER", "soxr_hq")
 ROOT_FOLDER_ID = extract_root_folder_id(DRIVE_URL)
 AUDIO_VIDEO_FOLDER_ID = extract_root_folder_id(AUDIO_VIDEO_URL)
 UPLOAD_OUTPUTS_FOLDER_ID = extract_root_folder_id(OUTPUTS_URL)
 UPLOAD_LOGS_FOLDER_ID = extract_root_folder_id(LOGS_URL)
 
 STATUS_TXT_FILE = 'status.txt'
-ARCHIVE_STATUS_TXT_FILE = 'archive_status.txt'
 STATUS_TXT_ID = '#'
-ARCHIVE_STATUS_TXT_ID = '#'
 
 OVERALL_STATUS_TXT_FILE = os.path.join(LOCAL_LOGS_TXT_FILE, STATUS_TXT_FILE)
+LOCAL_ARCHIVE_FOLDER = os.path.join(LOCAL_LOGS_TXT_FILE, 'archive')
+# status.txt is archived and started afresh once it grows past this size
+STATUS_TXT_MAX_BYTES = int(os.getenv("STATUS_TXT_MAX_BYTES", "1000000"))
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE_MB", "32")) * 1024 * 1024
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE_MB", "8")) * 1024 * 1024
+DRIVE_PAGE_TOKEN_FILE = os.path.join(LOCAL_STATE_FOLDER, 'drive_page_token.txt')
+JOB_LEDGER_FILE = os.path.join(LOCAL_STATE_FOLDER, 'jobs.sqlite3')
+# Port of the Prometheus metrics server, 0 to turn it off
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+# Profilers run on every stage of every job, e.g. "cprofile,torch", empty to turn them off.
+# The profiles are saved in LOCAL_OUTPUT_FOLDER as <local name>.<stage>.pstats / .trace.json
+PROFILERS = parse_profilers(os.getenv("PROFILE", ""))
+# Transcripts kept by content hash, so a re-uploaded recording is not transcribed again.
+# 0 turns the cache off
+RESULT_CACHE_DIR = os.path.join(LOCAL_STATE_FOLDER, 'result_cache')
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_MB", "1024")) * 1024 * 1024
+# Transcripts are published to the outputs folder while they are written, every N
+# segments or every M seconds, 0 turns either cadence off. The final upload replaces them
+PARTIAL_EVERY_SEGMENTS = int(os.getenv("PARTIAL_EVERY_SEGMENTS", "0"))
+PARTIAL_EVERY_SECONDS = float(os.getenv("PARTIAL_EVERY_SECONDS", "60"))
+# Added to the name of the partial transcript of a failed job until a retry replaces it
+INCOMPLETE_MARKER = ' (incomplete)'
+# Seconds running jobs get to finish on shutdown, before the statuses are flushed
+PIPELINE_STOP_TIMEOUT = float(os.getenv("PIPELINE_STOP_TIMEOUT_SECONDS", "5"))
 
 model = ASRModelForInference(
     model_dir=os.getenv("PRETRAINED_MODEL_DIR"),
@@ -45,106 +101,324 @@ model = ASRModelForInference(
     timestamp_format=os.getenv("TIMESTAMPS_FORMAT"),
     min_segment_length=float(os.getenv("MIN_SEGMENT_LENGTH")),
     min_silence_length=float(os.getenv("MIN_SILENCE_LENGTH")),
+    asr_batch_size=int(os.getenv("ASR_BATCH_SIZE", "8")),
+    resampler=RESAMPLER,
+    diar_window_seconds=float(os.getenv("DIAR_WINDOW_SECONDS", "0")),
+    diar_window_overlap_seconds=float(os.getenv("DIAR_WINDOW_OVERLAP_SECONDS", "30")),
+    asr_backend=os.getenv("ASR_BACKEND", "hf"),
+    asr_compute_type=os.getenv("ASR_COMPUTE_TYPE", ""),
+)
+
+result_cache = (
+    ResultCache(RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES)
+    if RESULT_CACHE_MAX_BYTES
+    else None
+)
+# Listener transcripts are diarized, with the model config as it is for this run
+RESULT_CACHE_KIND = 'diarize' if OUTPUT_FORMAT == 'text' else f'diarize:{OUTPUT_FORMAT}'
+MODEL_FINGERPRINT = model.config_fingerprint()
+
+# One service shared by every pipeline worker, on a pool of reused connections
+service = authenticate(pool_size=int(os.getenv("DRIVE_HTTP_POOL_SIZE", "8")))
+watcher = DriveChangeWatcher(AUDIO_VIDEO_FOLDER_ID, service, DRIVE_PAGE_TOKEN_FILE)
+ledger = JobLedger(
+    JOB_LEDGER_FILE,
+    max_attempts=int(os.getenv("MAX_JOB_ATTEMPTS", "3")),
+    retry_delay=float(os.getenv("JOB_RETRY_DELAY", "300")),
 )
 
-service = authenticate()
+status_writer = StatusWriter(
+    service,
+    debounce=float(os.getenv("STATUS_DEBOUNCE_SECONDS", "2")),
+    interval=float(os.getenv("STATUS_UPLOAD_INTERVAL_SECONDS", "10")),
+)
+status_archive = StatusArchive(
+    LOCAL_ARCHIVE_FOLDER,
+    UPLOAD_LOGS_FOLDER_ID,
+    status_writer,
+    service,
+    max_part_bytes=int(os.getenv("ARCHIVE_PART_MAX_BYTES", "1000000")),
+)
 
-def handle_statuses(filename: str ='none', step:str  ='', status_filepath = '', status_txt_id = STATUS_TXT_ID):
-    ''' Update and upload status.txt '''
-    archive_status_filepath = os.path.join(LOCAL_LOGS_TXT_FILE, ARCHIVE_STATUS_TXT_FILE)
+def handle_statuses(
+    filename: str = 'none',
+    step: str = '',
+    status_filepath='',
+    status_txt_id=STATUS_TXT_ID,
+    status_file_name=None,
+):
+    '''Update and upload status.txt, status_file_name names the Drive copy of a job status file'''
     status_message = get_status_message(filename, step=step)
 
+    # Local files are updated now, the Drive copies by the background status writer
     if step == 'started_up' or step == 'reset':
-        # Archiving old status messages
-        old_messages = read_txt_file(status_filepath)
-        append_text_to_txt(old_messages, archive_status_filepath)
-        update_txt_file( archive_status_filepath, ARCHIVE_STATUS_TXT_ID, service)
+        # Archiving old status messages, only the newest archive part is uploaded
+        if os.path.isfile(status_filepath):
+            status_archive.archive(read_txt_file(status_filepath))
         # Upload current status messages and overwrites old ones
-        write_text_to_txt(status_message, status_filepath)
-        update_txt_file(status_filepath, STATUS_TXT_ID, service)
-    
+        status_writer.write(status_message, status_filepath, STATUS_TXT_ID)
+
     else:
-        append_text_to_txt(status_message, status_filepath)
-        update_txt_file(status_filepath, status_txt_id, service)
-    
+        status_writer.append(
+            status_message, status_filepath, status_txt_id, file_name=status_file_name
+        )
+
     return
     
-def audio_loop(list_of_audio_in_drive: list):
+def handle_job_status(job: dict, step: str, filename: str = None):
+    ''' Update the status txt of a job '''
+    handle_statuses(
+        filename or job['name'], step=step, status_filepath=job['status_filepath'],
+        status_txt_id=job['status_txt_id'], status_file_name=job['status_txt_name'],
+    )
+
+def remove_download(filepath):
+    ''' Delete a downloaded file once its job is over '''
+    if filepath and os.path.isfile(filepath):
+        os.remove(filepath)
+
+def download_stage(job: dict):
     ''' 
-    Audio loop where checking of:
-    1. new mp3/wav files in drive
-    2. downloading the file
-    3. resampling + rechannleing + diarization + transcription
-    4. uploading the transcription txt to drive
+    Download stage:
+    1. creating the status txt of the file in drive
+    2. looking the file up in the result cache by its md5Checksum, which skips the
+    download of a file transcribed before
+    3. downloading the file
+    Local files are named after the job key, jobs of same-named files or of two
+    revisions of a file run side by side. The Drive copies keep the file name
     '''
-    for audio in list_of_audio_in_drive:
-        if not check_if_file_in_folder(audio['name'], LOCAL_DOWNLOAD_FOLDER):
-            
-            pre, _ = os.path.splitext(audio['name'])
-            audio_status_filepath = os.path.join(LOCAL_LOGS_TXT_FILE, pre+'_status.txt')
-            write_text_to_txt(f'Transcription process of {pre}:\n\n', audio_status_filepath)
-            status_txt_id = upload_txt_file(audio_status_filepath, UPLOAD_LOGS_FOLDER_ID, service)
-            
-            try:
-                handle_statuses(audio['name'], step = 'downloading', status_filepath=audio_status_filepath, status_txt_id=status_txt_id)
-                output_filepath = download_file(audio['id'], LOCAL_DOWNLOAD_FOLDER, service)
-                handle_statuses(audio['name'], step = 'downloaded', status_filepath=audio_status_filepath, status_txt_id=status_txt_id)
-                
-                # Transcription 
-                data, samplerate = librosa.load(output_filepath)
-                y = resample_audio_array(data, samplerate, SAMPLE_RATE)
-                with tempfile.NamedTemporaryFile(delete=True, suffix=".wav") as temp_file:
-                    sf.write(temp_file, y, SAMPLE_RATE)
-                    temp_filepath = temp_file.name
-                    transcriptions = model.diar_inference(filepath=temp_filepath)
-                    handle_statuses(audio['name'], step = 'transcribed', status_filepath=audio_status_filepath, status_txt_id=status_txt_id)
-                
-                #
-                output_txt_path = os.path.join(LOCAL_OUTPUT_FOLDER, pre + '.txt')
-                write_text_to_txt(transcriptions, output_txt_path)
-                upload_txt_file(output_txt_path, UPLOAD_OUTPUTS_FOLDER_ID, service)
-                handle_statuses(output_txt_path, step = 'uploaded', status_filepath=audio_status_filepath, status_txt_id=status_txt_id)
-                handle_statuses(output_txt_path, step = 'uploaded', status_filepath=OVERALL_STATUS_TXT_FILE, status_txt_id=STATUS_TXT_ID)
-                
-            except:
-                handle_statuses(audio['name'], step = 'error', status_filepath=pre, status_txt_id=status_txt_id)
-                
-def video_loop(list_of_mp4_in_drive: list):
+    pre, extension = os.path.splitext(job['name'])
+    job['pre'] = pre
+    name = local_name(job)
+    job['status_filepath'] = os.path.join(LOCAL_LOGS_TXT_FILE, name + '_status.txt')
+    job['status_txt_name'] = pre + '_status.txt'
+    job['output_txt_path'] = os.path.join(
+        LOCAL_OUTPUT_FOLDER, name + OUTPUT_EXTENSIONS[OUTPUT_FORMAT]
+    )
+    job['output_txt_name'] = pre + OUTPUT_EXTENSIONS[OUTPUT_FORMAT]
+    write_text_to_txt(f'Transcription process of {pre}:\n\n', job['status_filepath'])
+    job['status_txt_id'] = upload_txt_file(
+        job['status_filepath'],
+        UPLOAD_LOGS_FOLDER_ID,
+        service,
+        file_name=job['status_txt_name'],
+    )
+
+    # Keys the transcript is stored under once transcribed
+    job['cache_keys'] = []
+    if (
+        result_cache is not None
+        and job.get('md5Checksum')
+        and cached_result(job, job['md5Checksum'])
+    ):
+        job['filepath'] = None
+        return job
+
+    ledger.mark(job, 'downloading')
+    handle_job_status(job, 'downloading')
+    job['filepath'] = download_file(
+        job['id'], LOCAL_DOWNLOAD_FOLDER, service, file_name=name + extension,
+        md5_checksum=job.get('md5Checksum'), chunk_size=DOWNLOAD_CHUNK_SIZE,
+    )
+    handle_job_status(job, 'downloaded')
+
+    return job
+
+def decode_stage(job: dict):
     ''' 
-    Video loop where checking of:
-    1. new mp4 files in drive
-    2. downloading the file
-    3. resampling + rechannleing + diarization + transcription
-    4. uploading the transcription txt to drive
+    Decode stage, resampling + rechannleing of mp3/wav/mp4 into a float32
+    mono waveform at SAMPLE_RATE that stays in memory for the inference stage.
+    In windowed mode only the first window is decoded here, the inference stage
+    decodes the rest of the file window by window as it goes.
+    The decoded audio is looked up in the result cache, so the same recording in
+    another file format is not transcribed again. In windowed mode the file is
+    decoded once only: its audio is hashed as the inference stage reads it, and
+    the transcript stored under that hash too
+    '''
+    if job.get('cached'):
+        return job
+
+    if model.diar_window_seconds:
+        # The download is removed by the inference stage, once it has been read through
+        chunks = iter_audio_chunks(job['filepath'], SAMPLE_RATE, RESAMPLER)
+        if result_cache is not None:
+            job['audio_md5'] = hashlib.md5()
+            chunks = hashed_chunks(chunks, job['audio_md5'])
+        job['audio_chunks'] = prefetch_audio_chunks(
+            chunks, int(model.diar_window_seconds * SAMPLE_RATE)
+        )
+        return job
+
+    try:
+        if job['mimeType'] in VIDEO_MIME_TYPES:
+            # ffmpeg streams the audio track already downmixed and resampled
+            job['waveform'] = extract_audio_ffmpeg(job['filepath'], SAMPLE_RATE)
+        else:
+            # Decoded, downmixed and resampled in a single pass
+            job['waveform'] = load_audio(job['filepath'], SAMPLE_RATE, RESAMPLER)
+    finally:
+        # The ledger is the record of what was processed, downloads are not kept
+        remove_download(job['filepath'])
+
+    if result_cache is not None and cached_result(job, hash_audio(job['waveform'])):
+        del job['waveform']
+
+    return job
+
+def cached_result(job: dict, content_hash: str):
+    '''
+    Copy the cached transcript of a job to its output path, True if there is one.
+    On a miss the key is kept for the inference stage to store the transcript under
+    '''
+    key = result_cache.key(content_hash, RESULT_CACHE_KIND, MODEL_FINGERPRINT)
+    if not result_cache.get_file(key, job['output_txt_path']):
+        job['cache_keys'].append(key)
+        return False
+
+    # Same content transcribed before, the next stages pass it through
+    job['cached'] = True
+    handle_job_status(job, 'cached')
+    return True
+
+def inference_stage(job: dict):
+    '''
+    Inference stage, diarization + transcription. It runs on a single worker,
+    the only thread using the models. Segments are written out as soon as they are
+    transcribed, and published to the outputs folder as a partial transcript, in
+    place of the one of a failed attempt. Finished transcripts go into the result cache
+    '''
+    if job.get('cached'):
+        ledger.mark(job, 'transcribed')
+        return job
+
+    audio = job.pop('waveform', None)
+    if audio is None:
+        audio = job.pop('audio_chunks')
+    partial = PartialTranscript(
+        job['output_txt_path'],
+        UPLOAD_OUTPUTS_FOLDER_ID,
+        status_writer,
+        every_segments=PARTIAL_EVERY_SEGMENTS,
+        every_seconds=PARTIAL_EVERY_SECONDS,
+        mimetype=OUTPUT_MEDIA_TYPES[OUTPUT_FORMAT],
+        suffix=transcript_footer(OUTPUT_FORMAT, 1),
+        file_name=job['output_txt_name'],
+        drive_id=job.get('output_txt_id'),
+    )
+    try:
+        with (
+            open(job['output_txt_path'], 'w') as f,
+            TranscriptWriter(
+                f, OUTPUT_FORMAT, model.timestamp_format, flush=True
+            ) as writer,
+        ):
+            for segment in model.iter_diar_segments(audio, SAMPLE_RATE):
+                writer.write(segment)
+                partial.segment_written()
+        if 'audio_md5' in job:
+            # Read through, so the hash covers the whole file
+            for _ in audio:
+                pass
+            content_hash = job.pop('audio_md5').hexdigest()
+            job['cache_keys'].append(
+                result_cache.key(content_hash, RESULT_CACHE_KIND, MODEL_FINGERPRINT)
+            )
+    finally:
+        remove_download(job['filepath'])
+        # The upload stage overwrites the partial transcript with the final one
+        job['output_txt_id'] = partial.finish()
+        if job['output_txt_id']:
+            ledger.set_output_id(job, job['output_txt_id'])
+    for key in job['cache_keys']:
+        result_cache.put_file(key, job['output_txt_path'])
+    ledger.mark(job, 'transcribed')
+    handle_job_status(job, 'transcribed')
+
+    return job
+
+def upload_stage(job: dict):
+    '''
+    Upload stage, uploading the transcription txt to drive, in place of its
+    partial transcript when one was published
+    '''
+    output_txt_path = job['output_txt_path']
+    if job.get('output_txt_id'):
+        update_txt_file(
+            output_txt_path,
+            job['output_txt_id'],
+            service,
+            mimetype=OUTPUT_MEDIA_TYPES[OUTPUT_FORMAT],
+            chunk_size=UPLOAD_CHUNK_SIZE,
+            file_name=job['output_txt_name'],
+        )
+    else:
+        upload_txt_file(
+            output_txt_path,
+            UPLOAD_OUTPUTS_FOLDER_ID,
+            service,
+            mimetype=OUTPUT_MEDIA_TYPES[OUTPUT_FORMAT],
+            chunk_size=UPLOAD_CHUNK_SIZE,
+            file_name=job['output_txt_name'],
+        )
+    ledger.mark(job, 'uploaded')
+    handle_job_status(job, 'uploaded', job['output_txt_name'])
+    handle_statuses(
+        job['output_txt_name'],
+        step='uploaded',
+        status_filepath=OVERALL_STATUS_TXT_FILE,
+        status_txt_id=STATUS_TXT_ID,
+    )
+
+
+def handle_job_error(job: dict, stage: str, error: Exception):
     '''
-    for video in list_of_mp4_in_drive:
-            if not check_if_file_in_folder(video['name'], LOCAL_DOWNLOAD_FOLDER):
-                pre, _ = os.path.splitext(video['name'])
-                video_status_filepath = os.path.join(LOCAL_LOGS_TXT_FILE, pre+'_status.txt')
-                write_text_to_txt(f'Transcription process of {pre}:\n\n', video_status_filepath)
-                status_txt_id = upload_txt_file(video_status_filepath, UPLOAD_LOGS_FOLDER_ID, service)
-                
-                try:
-                    handle_statuses(video['name'], step = 'downloading', status_filepath=video_status_filepath, status_txt_id=status_txt_id)
-                    output_filepath = download_file(video['id'], LOCAL_DOWNLOAD_FOLDER, service)
-                    handle_statuses(video['name'], step = 'downloaded', status_filepath=video_status_filepath, status_txt_id=status_txt_id)
-                    
-                    numpy_audio_array, sample_rate = audio_from_mp4(output_filepath)
-                    numpy_audio_array = resample_audio_array(numpy_audio_array, sample_rate, SAMPLE_RATE)
-                    
-                    with tempfile.NamedTemporaryFile(delete=True, suffix=".wav") as temp_file:
-                        sf.write(temp_file, numpy_audio_array, SAMPLE_RATE)
-                        temp_file_path = temp_file.name
-                        transcription = model.diar_inference(temp_file_path)
-                        handle_statuses(video['name'], step = 'transcribed', status_filepath=video_status_filepath, status_txt_id=status_txt_id)
-                    
-                    output_txt_path = os.path.join(LOCAL_OUTPUT_FOLDER, pre + '.txt')
-                    write_text_to_txt(transcription, output_txt_path)
-                    upload_txt_file(output_txt_path, UPLOAD_OUTPUTS_FOLDER_ID, service)
-                    handle_statuses(output_txt_path, step = 'uploaded', status_filepath=video_status_filepath, status_txt_id=status_txt_id)
-                    handle_statuses(output_txt_path, step = 'uploaded', status_filepath=OVERALL_STATUS_TXT_FILE, status_txt_id=STATUS_TXT_ID)
-                except:
-                    handle_statuses(video['name'], step = 'error', status_filepath=video_status_filepath, status_txt_id=status_txt_id)
+    Record a failed job in the ledger and in its status txt. Its partial transcript
+    is marked as incomplete in the outputs folder, a retry updates it in place
+    '''
+    ledger.mark(job, 'failed', error=f'{stage}: {error!r}')
+    remove_download(job.get('filepath'))
+    if 'status_txt_id' in job:
+        handle_job_status(job, 'error')
+    if job.get('output_txt_id') and 'output_txt_name' in job:
+        pre, extension = os.path.splitext(job['output_txt_name'])
+        rename_file(job['output_txt_id'], pre + INCOMPLETE_MARKER + extension, service)
+
+pipeline = JobPipeline(
+    prefetch_depth=int(os.getenv("PIPELINE_PREFETCH_DEPTH", "2")),
+    on_error=handle_job_error,
+)
+def profiled(stage: str, fn):
+    '''
+    Stage function wrapped in the PROFILERS, the function itself when profiling is off.
+    Each stage runs on its own worker thread, so each is profiled on its own
+    '''
+    if not PROFILERS:
+        return fn
+
+    def run(job: dict):
+        name = f"{local_name(job)}.{stage}"
+        with profile_job(name, LOCAL_OUTPUT_FOLDER, PROFILERS):
+            return fn(job)
+
+    return run
+
+pipeline.add_stage(
+    'download',
+    profiled('download', download_stage),
+    workers=int(os.getenv("DOWNLOAD_WORKERS", "2")),
+)
+pipeline.add_stage(
+    'decode',
+    profiled('decode', decode_stage),
+    workers=int(os.getenv("DECODE_WORKERS", "2")),
+)
+pipeline.add_stage('inference', profiled('inference', inference_stage), workers=1)
+pipeline.add_stage(
+    'upload',
+    profiled('upload', upload_stage),
+    workers=int(os.getenv("UPLOAD_WORKERS", "1")),
+)
+track_pipeline(pipeline)
 
 def list_files_in_folder(service, folder_id):
     query = f"'{folder_id}' in parents"
@@ -157,35 +431,89 @@ def list_files_in_folder(service, folder_id):
         for file in files:
             print(f"Name: {file['name']}, MIME Type: {file['mimeType']}")
 
+def job_key(job: dict):
+    ''' Pipeline key of a job, one Drive file revision '''
+    return (job['id'], revision_of(job))
+
+def local_name(job: dict):
+    ''' Name of the local files of a job, from its job key '''
+    return '_'.join(job_key(job)).replace(':', '-')
+
 def main():
 
     #list_files_in_folder(service, ROOT_FOLDER_ID)
     
-    list_of_audio_in_drive = get_all_audio_files(AUDIO_VIDEO_FOLDER_ID, service)
-    list_of_mp4_in_drive = get_all_mp4_files(AUDIO_VIDEO_FOLDER_ID, service)
-    
-    # print(list_of_audio_in_drive)
-    # print(list_of_mp4_in_drive)
-    
-    audio_loop(list_of_audio_in_drive)
-    video_loop(list_of_mp4_in_drive)
+    # Only files added or changed since the last poll, the full folder is listed once.
+    # Once they are in the ledger the page token can move on
+    first_listing = watcher.page_token is None
+    files = watcher.poll()
+    if first_listing:
+        # Files kept in the download folder by the listener before the ledger were
+        # already transcribed and uploaded, they go in the ledger as done
+        migrate_legacy_downloads(ledger, files, LOCAL_DOWNLOAD_FOLDER)
+
+    polled_ids = set()
+    for file in files:
+        ledger.enqueue(file)
+        polled_ids.add(file['id'])
+    watcher.commit()
+
+    # Queued jobs, jobs interrupted by a restart and failed jobs due for a retry.
+    # Jobs still in the pipeline or not fitting in its first queue are skipped here
+    # and submitted again on a later poll
+    pending_jobs = [
+        job for job in ledger.pending() if not pipeline.is_in_flight(job_key(job))
+    ]
+
+    # Jobs not seen in this poll may have been deleted since, refresh them in one batch
+    stale_jobs = [job for job in pending_jobs if job['id'] not in polled_ids]
+    current_metadata = get_files_metadata([job['id'] for job in stale_jobs], service)
+    for job in stale_jobs:
+        metadata = current_metadata.get(job['id'])
+        if metadata is None or metadata.get('trashed'):
+            ledger.mark(job, 'removed')
+            pending_jobs.remove(job)
+
+    for job in pending_jobs:
+        pipeline.submit(job, key=job_key(job))
 
 
 if __name__ == '__main__':
     
+    # docker stop sends SIGTERM, exit through the finally below so statuses get flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT)
+
     # Reset the status
+    status_writer.start()
     handle_statuses('', 'started_up', OVERALL_STATUS_TXT_FILE)
+    pipeline.start()
     count = 0
     sleepy_time = 10
     status_update_interval_in_sec = 600
     
-    while (True):
-    
-        main()
-        time.sleep(sleepy_time)
-        count+=1
+    try:
+        while (True):
         
-        # Heartbeat status update
-        if (sleepy_time * count) >= status_update_interval_in_sec:
-            count=0
-            handle_statuses(status_filepath=OVERALL_STATUS_TXT_FILE)
\ No newline at end of file
+            main()
+            time.sleep(sleepy_time)
+            count+=1
+
+            # Heartbeat status update
+            if (sleepy_time * count) >= status_update_interval_in_sec:
+                count=0
+                handle_statuses(status_filepath=OVERALL_STATUS_TXT_FILE)
+
+                # Rotate status.txt so it stays bounded between restarts too
+                if os.path.getsize(OVERALL_STATUS_TXT_FILE) > STATUS_TXT_MAX_BYTES:
+                    handle_statuses('', 'reset', OVERALL_STATUS_TXT_FILE)
+    finally:
+        # docker stop kills the container 10 seconds after SIGTERM. Jobs still running
+        # after the timeout stay unfinished in the ledger and are resumed on restart
+        unfinished = pipeline.stop(timeout=PIPELINE_STOP_TIMEOUT)
+        if unfinished:
+            print(f"{len(unfinished)} jobs left for the next start")
+        status_writer.close()
+        ledger.close()
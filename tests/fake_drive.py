@@ -0,0 +1,328 @@
+import collections
+import hashlib
+import itertools
+import re
+
+
+class FakeRequest:
+    '''
+    Stand-in for googleapiclient's HttpRequest, runs a callable on execute. Requests
+    are counted when executed rather than when built, so requests sent inside a
+    batch only count as part of the batch.
+    '''
+
+    def __init__(self, fn, drive=None, name=None):
+        self.fn = fn
+        self.drive = drive
+        self.name = name
+        self.resumable = None
+
+    def execute(self, num_retries=0, http=None):
+        if self.drive is not None:
+            self.drive.call_counts[self.name] += 1
+        return self.fn()
+
+
+class FakeDriveService:
+    '''
+    Local in-memory stand-in for the Drive v3 service returned by authenticate().
+
+    Supports the parts of files() and changes() the listener uses, with real
+    pagination, ranged media downloads and chunked resumable uploads, so the watcher
+    and the Drive utils can run without credentials. Every API call is counted in
+    call_counts, keyed by "resource.method". Setting media_failures makes that many
+    upcoming media requests (download ranges or upload chunks) fail with a dropped
+    connection.
+    '''
+
+    def __init__(self, page_size=100):
+        self.page_size = page_size
+        self.media_failures = 0
+        self.files_by_id = {}
+        self.change_log = []
+        self.call_counts = collections.Counter()
+        self._ids = itertools.count(1)
+
+    # ---- helpers to set up the fake drive ----
+
+    def add_file(self, name, mime_type, parents, content=b''):
+        '''Add a file to the fake drive and record it in the changes feed'''
+
+        file_id = f'fake-{next(self._ids)}'
+        self.files_by_id[file_id] = {
+            'id': file_id,
+            'name': name,
+            'mimeType': mime_type,
+            'parents': list(parents),
+            'trashed': False,
+            'modifiedTime': f'2025-01-01T00:00:{len(self.change_log):02d}.000Z',
+            'content': content,
+        }
+        self.change_log.append(file_id)
+        return file_id
+
+    def trash_file(self, file_id):
+        '''Trash a file and record it in the changes feed'''
+
+        self.files_by_id[file_id]['trashed'] = True
+        self.change_log.append(file_id)
+
+    def total_calls(self):
+        return sum(self.call_counts.values())
+
+    def metadata(self, file_id):
+        file = self.files_by_id[file_id]
+        metadata = {key: value for key, value in file.items() if key != 'content'}
+        metadata['md5Checksum'] = hashlib.md5(file['content']).hexdigest()
+        metadata['size'] = str(len(file['content']))
+        return metadata
+
+    # ---- Drive v3 resources ----
+
+    def files(self):
+        return _FakeFilesResource(self)
+
+    def changes(self):
+        return _FakeChangesResource(self)
+
+    def new_batch_http_request(self, callback=None):
+        return _FakeBatch(self, callback)
+
+
+class _FakeBatch:
+    '''Stand-in for BatchHttpRequest, the whole batch counts as one call'''
+
+    def __init__(self, drive, callback):
+        self.drive = drive
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self.requests.append((request, callback or self.callback, request_id))
+
+    def execute(self, http=None):
+        for request, callback, request_id in self.requests:
+            try:
+                response, exception = request.fn(), None
+            except KeyError as error:
+                response, exception = None, error
+            callback(request_id, response, exception)
+
+
+class _FakeFilesResource:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def list(self, q='', fields=None, pageSize=100, pageToken=None, **kwargs):
+        def run():
+            matches = [
+                self.drive.metadata(file_id)
+                for file_id, file in self.drive.files_by_id.items()
+                if _matches_query(file, q)
+            ]
+            page_size = min(pageSize, self.drive.page_size)
+            start = int(pageToken or 0)
+            results = {'files': matches[start : start + page_size]}
+            if start + page_size < len(matches):
+                results['nextPageToken'] = str(start + page_size)
+            return results
+
+        return FakeRequest(run, self.drive, 'files.list')
+
+    def get(self, fileId, fields=None, **kwargs):
+        return FakeRequest(lambda: self.drive.metadata(fileId), self.drive, 'files.get')
+
+    def get_media(self, fileId, **kwargs):
+        return _FakeMediaRequest(self.drive, fileId)
+
+    def create(self, body=None, media_body=None, fields=None, **kwargs):
+        def run(content=None):
+            file_id = self.drive.add_file(
+                body['name'],
+                body.get('mimeType', 'text/plain'),
+                body.get('parents', []),
+                _read_media(media_body) if content is None else content,
+            )
+            return self.drive.metadata(file_id)
+
+        if _is_resumable(media_body):
+            return _FakeResumableUpload(run, self.drive, 'files.create', media_body)
+        return FakeRequest(run, self.drive, 'files.create')
+
+    def update(self, fileId, body=None, media_body=None, fields=None, **kwargs):
+        def run(content=None):
+            file = self.drive.files_by_id[fileId]
+            if body and 'name' in body:
+                file['name'] = body['name']
+            if media_body is not None:
+                file['content'] = (
+                    _read_media(media_body) if content is None else content
+                )
+            self.drive.change_log.append(fileId)
+            return self.drive.metadata(fileId)
+
+        if _is_resumable(media_body):
+            return _FakeResumableUpload(run, self.drive, 'files.update', media_body)
+        return FakeRequest(run, self.drive, 'files.update')
+
+
+class _FakeUploadProgress:
+    '''Stand-in for MediaUploadProgress'''
+
+    def __init__(self, resumable_progress, total_size):
+        self.resumable_progress = resumable_progress
+        self.total_size = total_size
+
+    def progress(self):
+        return self.resumable_progress / self.total_size if self.total_size else 0.0
+
+
+class _FakeResumableUpload:
+    '''
+    Stand-in for an HttpRequest with a resumable media body. Opening the session
+    counts as the request itself, every chunk sent counts as "<request>.chunk".
+    '''
+
+    def __init__(self, fn, drive, name, media_body):
+        self.fn = fn
+        self.drive = drive
+        self.name = name
+        self.resumable = media_body
+        self.received = b''
+        self.session_open = False
+
+    def execute(self, num_retries=0, http=None):
+        response = None
+        while response is None:
+            _, response = self.next_chunk(num_retries=num_retries)
+        return response
+
+    def next_chunk(self, http=None, num_retries=0):
+        if not self.session_open:
+            self.drive.call_counts[self.name] += 1
+            self.session_open = True
+
+        self.drive.call_counts[f'{self.name}.chunk'] += 1
+        if self.drive.media_failures:
+            self.drive.media_failures -= 1
+            raise ConnectionResetError('Fake dropped connection')
+
+        total_size = self.resumable.size()
+        self.received += self.resumable.getbytes(
+            len(self.received), self.resumable.chunksize()
+        )
+        if len(self.received) < total_size:
+            return _FakeUploadProgress(len(self.received), total_size), None
+        return None, self.fn(self.received)
+
+
+class _FakeResponse(dict):
+    '''Stand-in for httplib2.Response, a dict of lowercase headers with a status'''
+
+    def __init__(self, status, headers=None):
+        super().__init__(headers or {})
+        self.status = status
+
+
+class _FakeMediaRequest:
+    '''Stand-in for the HttpRequest of files().get_media, served by a fake http'''
+
+    def __init__(self, drive, file_id):
+        self.drive = drive
+        self.uri = f'fake://files/{file_id}?alt=media'
+        self.headers = {}
+        self.http = self
+        self.file_id = file_id
+
+    def execute(self, num_retries=0, http=None):
+        return self.request(self.uri)[1]
+
+    def request(self, uri, method='GET', headers=None, **kwargs):
+        '''Serve the file content, honouring a "bytes=start-end" range header'''
+
+        self.drive.call_counts['files.get_media'] += 1
+        if self.drive.media_failures:
+            self.drive.media_failures -= 1
+            raise ConnectionResetError('Fake dropped connection')
+
+        content = self.drive.files_by_id[self.file_id]['content']
+        byte_range = (headers or {}).get('range')
+        if byte_range is None:
+            return _FakeResponse(200, {'content-length': str(len(content))}), content
+
+        start, end = (int(value) for value in byte_range.split('=')[1].split('-'))
+        if start >= len(content):
+            return _FakeResponse(416, {'content-range': f'bytes */{len(content)}'}), b''
+        chunk = content[start : end + 1]
+        content_range = f'bytes {start}-{start + len(chunk) - 1}/{len(content)}'
+        return _FakeResponse(206, {'content-range': content_range}), chunk
+
+
+class _FakeChangesResource:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def getStartPageToken(self, **kwargs):
+        return FakeRequest(
+            lambda: {'startPageToken': str(len(self.drive.change_log))},
+            self.drive,
+            'changes.getStartPageToken',
+        )
+
+    def list(self, pageToken, fields=None, pageSize=100, **kwargs):
+        def run():
+            start = int(pageToken)
+            page_size = min(pageSize, self.drive.page_size)
+            file_ids = self.drive.change_log[start : start + page_size]
+            results = {
+                'changes': [
+                    {
+                        'fileId': file_id,
+                        'removed': False,
+                        'file': self.drive.metadata(file_id),
+                    }
+                    for file_id in file_ids
+                ]
+            }
+            if start + page_size < len(self.drive.change_log):
+                results['nextPageToken'] = str(start + page_size)
+            else:
+                results['newStartPageToken'] = str(len(self.drive.change_log))
+            return results
+
+        return FakeRequest(run, self.drive, 'changes.list')
+
+
+def _matches_query(file, query):
+    '''Evaluate the small subset of the Drive query language the listener uses'''
+
+    parent = re.search(r"'([^']+)' in parents", query)
+    if parent and parent.group(1) not in file['parents']:
+        return False
+
+    if re.search(r'trashed\s*=\s*false', query) and file['trashed']:
+        return False
+
+    mime_types = re.findall(r"mimeType\s*=\s*'([^']+)'", query)
+    if mime_types and file['mimeType'] not in mime_types:
+        return False
+
+    return True
+
+
+def _is_resumable(media_body):
+    return (
+        media_body is not None
+        and not isinstance(media_body, bytes)
+        and media_body.resumable()
+    )
+
+
+def _read_media(media_body):
+    '''Read the bytes of a MediaUpload, or accept raw bytes directly'''
+
+    if media_body is None:
+        return b''
+    if isinstance(media_body, bytes):
+        return media_body
+    return media_body.getbytes(0, media_body.size())
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("faster_whisper")
+
+from codes.asr_inference_service.asr_model import WHISPER_WINDOW_SECONDS, WhisperASR
+
+SAMPLE_RATE = 16000
+
+
+class StubPipeline:
+    """ASR pipeline returning the length of its input, and recording its calls"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, inputs, batch_size=None, chunk_length_s=None):
+        self.calls.append((inputs, chunk_length_s))
+        if isinstance(inputs, list):
+            return [{"text": f" {len(waveform)}"} for waveform in inputs]
+        return {"text": f" {len(inputs)}"}
+
+
+@pytest.fixture
+def asr():
+    # The model itself is not loaded, only the pipeline is called
+    asr = WhisperASR.__new__(WhisperASR)
+    asr.target_sr = SAMPLE_RATE
+    asr.pipe = StubPipeline()
+    return asr
+
+
+def test_long_segments_are_transcribed_in_chunks(asr):
+    window = WHISPER_WINDOW_SECONDS * SAMPLE_RATE
+    waveforms = [np.zeros(SAMPLE_RATE), np.zeros(3 * window), np.zeros(window)]
+
+    assert asr.infer_batch(waveforms, SAMPLE_RATE) == [
+        f" {SAMPLE_RATE}",
+        f" {3 * window}",
+        f" {window}",
+    ]
+
+    (batch, batch_chunk_length), (long_form, long_chunk_length) = asr.pipe.calls
+    assert [len(waveform) for waveform in batch] == [SAMPLE_RATE, window]
+    assert batch_chunk_length is None
+    assert len(long_form) == 3 * window
+    assert long_chunk_length == WHISPER_WINDOW_SECONDS
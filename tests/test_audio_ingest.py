@@ -0,0 +1,31 @@
+import numpy as np
+import soundfile as sf
+
+from codes.asr_inference_service import audio_ingest
+from codes.asr_inference_service.audio_ingest import (
+    iter_audio_chunks,
+    load_audio,
+    to_mono,
+)
+
+SAMPLE_RATE = 16000
+
+
+def test_to_mono_averages_the_given_axis():
+    # One frame of two channels, shorter in time than in channels
+    np.testing.assert_allclose(to_mono(np.array([[0.2, 0.4]]), channel_axis=1), [0.3])
+    assert to_mono(np.zeros((2, 1)), channel_axis=0).shape == (1,)
+
+
+def test_short_tail_block_is_downmixed_over_channels(tmp_path, monkeypatch):
+    monkeypatch.setattr(audio_ingest, "BLOCK_FRAMES", 4)
+    # 9 stereo frames, read as blocks of 4, 4 and a 1-frame tail
+    stereo = np.stack([np.linspace(0, 0.8, 9), np.linspace(0, -0.4, 9)], axis=1)
+    path = str(tmp_path / "stereo.wav")
+    sf.write(path, stereo, SAMPLE_RATE, subtype="FLOAT")
+
+    expected = stereo.mean(axis=1).astype(np.float32)
+    np.testing.assert_allclose(load_audio(path, SAMPLE_RATE), expected)
+    np.testing.assert_allclose(
+        np.concatenate(list(iter_audio_chunks(path, SAMPLE_RATE))), expected
+    )
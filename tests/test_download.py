@@ -0,0 +1,83 @@
+import hashlib
+from pathlib import Path
+
+import pytest
+
+from codes.google_doc_utils.utils import download_file, part_file_path
+from tests.fake_drive import FakeDriveService
+
+CONTENT = bytes(range(256)) * 40
+CONTENT_MD5 = hashlib.md5(CONTENT).hexdigest()
+CHUNK_SIZE = 1000
+
+
+@pytest.fixture
+def drive():
+    return FakeDriveService()
+
+
+@pytest.fixture
+def file_id(drive):
+    return drive.add_file('a.wav', 'audio/wav', ['audio-folder'], CONTENT)
+
+
+@pytest.fixture
+def part_path(file_id, tmp_path):
+    return Path(part_file_path(str(tmp_path), file_id, CONTENT_MD5))
+
+
+def test_download_in_ranges_retries_failed_chunks(
+    drive, file_id, part_path, tmp_path, monkeypatch
+):
+    monkeypatch.setattr('codes.google_doc_utils.utils.time.sleep', lambda seconds: None)
+    drive.media_failures = 2
+    path = download_file(
+        file_id, str(tmp_path), drive, chunk_size=CHUNK_SIZE, num_retries=2
+    )
+
+    assert open(path, 'rb').read() == CONTENT
+    assert not part_path.exists()
+
+
+@pytest.mark.parametrize('kept', [1234, len(CONTENT)])
+def test_download_resumes_a_part_file(drive, file_id, part_path, tmp_path, kept):
+    part_path.write_bytes(CONTENT[:kept])
+    path = download_file(file_id, str(tmp_path), drive, chunk_size=CHUNK_SIZE)
+    assert open(path, 'rb').read() == CONTENT
+
+
+def test_corrupt_part_file_fails_the_checksum(drive, file_id, part_path, tmp_path):
+    part_path.write_bytes(b'x' * 100)
+    with pytest.raises(ValueError, match='Checksum mismatch'):
+        download_file(
+            file_id,
+            str(tmp_path),
+            drive,
+            md5_checksum=CONTENT_MD5,
+            chunk_size=CHUNK_SIZE,
+        )
+    assert not part_path.exists()
+
+
+def test_part_file_larger_than_the_file_is_discarded(
+    drive, file_id, part_path, tmp_path
+):
+    part_path.write_bytes(CONTENT + b'x' * 100)
+    path = download_file(
+        file_id, str(tmp_path), drive, md5_checksum=CONTENT_MD5, chunk_size=CHUNK_SIZE
+    )
+    assert open(path, 'rb').read() == CONTENT
+
+
+def test_part_file_of_another_revision_is_left_alone(
+    drive, file_id, part_path, tmp_path
+):
+    # A download of the previous revision of the file, still unfinished
+    other_revision = Path(part_file_path(str(tmp_path), file_id, 'old-md5'))
+    other_revision.write_bytes(b'old take')
+
+    path = download_file(
+        file_id, str(tmp_path), drive, md5_checksum=CONTENT_MD5, chunk_size=CHUNK_SIZE
+    )
+    assert open(path, 'rb').read() == CONTENT
+    assert other_revision.read_bytes() == b'old take'
@@ -0,0 +1,183 @@
+import pytest
+
+from codes.google_doc_utils.drive_watcher import DriveChangeWatcher
+from codes.google_doc_utils.job_ledger import JobLedger, migrate_legacy_downloads
+from codes.google_doc_utils.utils import get_files_metadata
+from tests.fake_drive import FakeDriveService
+
+FOLDER_ID = 'audio-folder'
+# Files per page of the fake Drive, three files take two pages to list
+PAGE_SIZE = 2
+LISTING_PAGES = 2
+
+
+@pytest.fixture
+def drive():
+    return FakeDriveService(page_size=PAGE_SIZE)
+
+
+@pytest.fixture
+def token_filepath(tmp_path):
+    return str(tmp_path / 'state' / 'drive_page_token.txt')
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = JobLedger(
+        str(tmp_path / 'state' / 'jobs.sqlite3'), max_attempts=3, retry_delay=0
+    )
+    yield ledger
+    ledger.close()
+
+
+def poll_into(watcher, ledger):
+    '''One listener poll: queue the polled files, then move the page token on'''
+
+    files = watcher.poll()
+    queued = [file['name'] for file in files if ledger.enqueue(file)]
+    watcher.commit()
+    return sorted(queued)
+
+
+def test_first_run_lists_the_folder_once(drive, token_filepath, ledger):
+    drive.add_file('a.wav', 'audio/wav', [FOLDER_ID], b'a')
+    drive.add_file('b.mp3', 'audio/mpeg', [FOLDER_ID], b'b')
+    drive.add_file('c.mp4', 'video/mp4', [FOLDER_ID], b'c')
+    drive.add_file('notes.txt', 'text/plain', [FOLDER_ID], b'n')
+    drive.add_file('other.wav', 'audio/wav', ['other-folder'], b'o')
+
+    watcher = DriveChangeWatcher(FOLDER_ID, drive, token_filepath)
+    assert poll_into(watcher, ledger) == ['a.wav', 'b.mp3', 'c.mp4']
+    assert drive.call_counts['changes.getStartPageToken'] == 1
+    assert drive.call_counts['files.list'] == LISTING_PAGES
+
+    # Nothing changed since, the next poll reads the changes feed only
+    assert poll_into(watcher, ledger) == []
+    assert drive.call_counts['files.list'] == LISTING_PAGES
+    assert [job['name'] for job in ledger.pending()] == ['a.wav', 'b.mp3', 'c.mp4']
+
+
+def test_restart_resumes_from_the_persisted_token(drive, token_filepath, ledger):
+    drive.add_file('a.wav', 'audio/wav', [FOLDER_ID], b'a')
+    poll_into(DriveChangeWatcher(FOLDER_ID, drive, token_filepath), ledger)
+
+    drive.add_file('b.wav', 'audio/wav', [FOLDER_ID], b'b')
+    drive.add_file('c.wav', 'audio/wav', [FOLDER_ID], b'c')
+    drive.add_file('d.wav', 'audio/wav', [FOLDER_ID], b'd')
+
+    restarted = DriveChangeWatcher(FOLDER_ID, drive, token_filepath)
+    assert restarted.page_token is not None
+    assert poll_into(restarted, ledger) == ['b.wav', 'c.wav', 'd.wav']
+    assert drive.call_counts['changes.getStartPageToken'] == 1
+    assert drive.call_counts['files.list'] == 1
+
+
+def test_uncommitted_poll_is_read_again(drive, token_filepath, ledger):
+    watcher = DriveChangeWatcher(FOLDER_ID, drive, token_filepath)
+    poll_into(watcher, ledger)
+
+    drive.add_file('a.wav', 'audio/wav', [FOLDER_ID], b'a')
+    assert [file['name'] for file in watcher.poll()] == ['a.wav']
+
+    # Crashed before commit, a restart sees the same change again
+    restarted = DriveChangeWatcher(FOLDER_ID, drive, token_filepath)
+    assert [file['name'] for file in restarted.poll()] == ['a.wav']
+
+
+def test_revision_change_is_a_new_job(drive, token_filepath, ledger):
+    file_id = drive.add_file('a.wav', 'audio/wav', [FOLDER_ID], b'first take')
+    watcher = DriveChangeWatcher(FOLDER_ID, drive, token_filepath)
+    poll_into(watcher, ledger)
+    job = ledger.pending()[0]
+    ledger.mark(job, 'uploaded')
+    assert ledger.pending() == []
+
+    # Renamed only: same content, same revision, nothing to do
+    drive.files().update(fileId=file_id, body={'name': 'a.wav'}).execute()
+    assert poll_into(watcher, ledger) == []
+
+    # New content: a new revision of the same file
+    drive.files().update(fileId=file_id, media_body=b'second take').execute()
+    assert poll_into(watcher, ledger) == ['a.wav']
+    pending = ledger.pending()
+    assert [job['id'] for job in pending] == [file_id]
+    assert pending[0]['md5Checksum'] != job['md5Checksum']
+    assert ledger.get(job)['state'] == 'uploaded'
+
+
+def test_removed_file_is_dropped(drive, token_filepath, ledger):
+    kept_id = drive.add_file('kept.wav', 'audio/wav', [FOLDER_ID], b'k')
+    removed_id = drive.add_file('removed.wav', 'audio/wav', [FOLDER_ID], b'r')
+    watcher = DriveChangeWatcher(FOLDER_ID, drive, token_filepath)
+    poll_into(watcher, ledger)
+
+    # Trashed in the same poll it was added in: never queued
+    drive.trash_file(drive.add_file('brief.wav', 'audio/wav', [FOLDER_ID], b'b'))
+    assert poll_into(watcher, ledger) == []
+
+    # Trashed while its job was waiting: the listener refreshes queued jobs it did
+    # not see in the poll and marks the removed ones
+    drive.trash_file(removed_id)
+    polled_ids = {file['id'] for file in watcher.poll()}
+    watcher.commit()
+    assert removed_id not in polled_ids
+
+    stale_jobs = [job for job in ledger.pending() if job['id'] not in polled_ids]
+    metadata = get_files_metadata([job['id'] for job in stale_jobs], drive)
+    for job in stale_jobs:
+        if metadata.get(job['id'], {}).get('trashed'):
+            ledger.mark(job, 'removed')
+
+    assert [job['id'] for job in ledger.pending()] == [kept_id]
+    assert (
+        ledger.get(
+            {'id': removed_id, 'md5Checksum': metadata[removed_id]['md5Checksum']}
+        )['state']
+        == 'removed'
+    )
+
+
+def test_legacy_downloads_are_marked_uploaded(drive, token_filepath, ledger, tmp_path):
+    drive.add_file('done.wav', 'audio/wav', [FOLDER_ID], b'd')
+    drive.add_file('new.wav', 'audio/wav', [FOLDER_ID], b'n')
+    download_folder = tmp_path / 'downloads'
+    download_folder.mkdir()
+    (download_folder / 'done.wav').write_bytes(b'd')
+
+    watcher = DriveChangeWatcher(FOLDER_ID, drive, token_filepath)
+    files = watcher.poll()
+    assert migrate_legacy_downloads(ledger, files, str(download_folder)) == ['done.wav']
+    assert [file['name'] for file in files if ledger.enqueue(file)] == ['new.wav']
+    watcher.commit()
+
+    assert [job['name'] for job in ledger.pending()] == ['new.wav']
+    done = next(file for file in files if file['name'] == 'done.wav')
+    assert ledger.get(done)['state'] == 'uploaded'
+
+
+def test_job_failing_before_download_runs_out_of_attempts(
+    drive, token_filepath, ledger
+):
+    drive.add_file('a.wav', 'audio/wav', [FOLDER_ID], b'a')
+    poll_into(DriveChangeWatcher(FOLDER_ID, drive, token_filepath), ledger)
+
+    # e.g. its status file cannot be uploaded, or it is cached and its upload fails
+    for _ in range(ledger.max_attempts):
+        [job] = ledger.pending()
+        ledger.mark(job, 'failed', error='upload: ConnectionError()')
+
+    assert ledger.pending() == []
+    assert ledger.get(job)['attempts'] == ledger.max_attempts
+
+
+def test_failed_job_keeps_its_transcript_id(drive, token_filepath, ledger):
+    drive.add_file('a.wav', 'audio/wav', [FOLDER_ID], b'a')
+    poll_into(DriveChangeWatcher(FOLDER_ID, drive, token_filepath), ledger)
+
+    [job] = ledger.pending()
+    assert job['output_txt_id'] is None
+    ledger.set_output_id(job, 'partial-transcript')
+    ledger.mark(job, 'failed', error='inference: RuntimeError()')
+
+    [retry] = ledger.pending()
+    assert retry['output_txt_id'] == 'partial-transcript'
@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from codes.asr_inference_service.inference_executor import InferenceExecutor, Overloaded
+
+
+def failing_transcript():
+    yield "first segment\n"
+    raise RuntimeError("model error")
+
+
+def test_failed_stream_gives_its_place_back():
+    inference = InferenceExecutor(max_workers=1, max_queue=0)
+    app = FastAPI()
+
+    @app.get("/stream")
+    async def stream():
+        inference.admit()
+        return StreamingResponse(inference.stream(failing_transcript()))
+
+    # The model error is raised after the headers are sent, the body is cut short
+    TestClient(app, raise_server_exceptions=False).get("/stream")
+
+    assert inference.admitted == 0
+    inference.admit()
+    with pytest.raises(Overloaded):
+        inference.admit()
+
+
+def test_closed_stream_gives_its_place_back():
+    inference = InferenceExecutor(max_workers=1, max_queue=0)
+
+    async def read_first_chunk():
+        inference.admit()
+        body = inference.stream(iter(["a", "b", "c"]))
+        assert await body.__anext__() == "a"
+        # The client went away after the first chunk
+        await body.aclose()
+
+    asyncio.run(read_first_chunk())
+    assert inference.admitted == 0
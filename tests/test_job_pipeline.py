@@ -0,0 +1,44 @@
+import threading
+
+from codes.google_doc_utils.job_pipeline import JobPipeline
+
+
+def test_stop_leaves_unfinished_jobs_behind():
+    started = threading.Event()
+    release = threading.Event()
+    uploaded = []
+
+    def slow_inference(job):
+        started.set()
+        release.wait()
+        return job
+
+    pipeline = JobPipeline(prefetch_depth=4)
+    pipeline.add_stage('inference', slow_inference)
+    pipeline.add_stage('upload', uploaded.append)
+    pipeline.start()
+
+    assert pipeline.submit('a', key='a')
+    assert pipeline.submit('b', key='b')
+    assert started.wait(1)
+
+    # a is stuck in inference past the timeout, b never started
+    assert pipeline.stop(timeout=0.1) == {'a'}
+    assert not pipeline.submit('c', key='c')
+
+    # Once it finishes, a is dropped instead of being uploaded
+    release.set()
+    assert pipeline.wait_until_idle(timeout=1)
+    assert uploaded == []
+
+
+def test_stop_lets_quick_jobs_finish():
+    uploaded = []
+    pipeline = JobPipeline()
+    pipeline.add_stage('upload', uploaded.append)
+    pipeline.start()
+
+    assert pipeline.submit('a', key='a')
+    assert pipeline.wait_until_idle(timeout=1)
+    assert pipeline.stop(timeout=1) == set()
+    assert uploaded == ['a']
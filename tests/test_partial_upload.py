@@ -0,0 +1,135 @@
+import threading
+import time
+
+import pytest
+
+from codes.google_doc_utils.partial_upload import PartialTranscript
+from codes.google_doc_utils.status_writer import StatusWriter
+from tests.fake_drive import FakeDriveService
+
+FOLDER_ID = 'outputs-folder'
+
+
+class BlockingDrive(FakeDriveService):
+    '''Fake Drive whose file creation waits until released'''
+
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def files(self):
+        files = super().files()
+        create = files.create
+
+        def blocking_create(*args, **kwargs):
+            assert self.release.wait(5)
+            return create(*args, **kwargs)
+
+        files.create = blocking_create
+        return files
+
+
+@pytest.fixture
+def transcript_path(tmp_path):
+    path = tmp_path / 'recording.txt'
+    path.write_text('')
+    return path
+
+
+def test_first_segment_is_created_off_the_job_thread(transcript_path):
+    drive = BlockingDrive()
+    status_writer = StatusWriter(drive, debounce=0, interval=60).start()
+    partial = PartialTranscript(
+        str(transcript_path), FOLDER_ID, status_writer, every_seconds=60
+    )
+
+    # Returns while Drive is still creating the file
+    transcript_path.write_text('first segment\n')
+    partial.segment_written()
+    deadline = time.monotonic() + 5
+    while str(transcript_path) not in status_writer.uploading:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+    assert drive.files_by_id == {}
+
+    drive.release.set()
+    drive_id = partial.finish()
+    assert drive.files_by_id[drive_id]['parents'] == [FOLDER_ID]
+    assert drive.files_by_id[drive_id]['content'] == b'first segment\n'
+    status_writer.close()
+
+
+def test_unpublished_transcript_has_no_drive_file(transcript_path):
+    status_writer = StatusWriter(FakeDriveService())
+    partial = PartialTranscript(str(transcript_path), FOLDER_ID, status_writer)
+    partial.segment_written()
+    assert partial.finish() is None
+
+
+def test_pending_creation_is_dropped_by_finish(transcript_path):
+    drive = FakeDriveService()
+    status_writer = StatusWriter(drive)
+    partial = PartialTranscript(
+        str(transcript_path), FOLDER_ID, status_writer, every_segments=1
+    )
+
+    # The writer thread never ran, the final upload creates the file instead
+    partial.segment_written()
+    assert partial.finish() is None
+    status_writer.close()
+    assert drive.files_by_id == {}
+
+
+def test_drive_copy_keeps_its_name_apart_from_the_local_file(tmp_path):
+    drive = FakeDriveService()
+    status_writer = StatusWriter(drive)
+    first = drive.add_file('meeting_status.txt', 'text/plain', [FOLDER_ID])
+    second = drive.add_file('meeting_status.txt', 'text/plain', [FOLDER_ID])
+
+    # meeting.wav and meeting.mp4, each with a local status file of its own
+    status_writer.append(
+        'wav\n',
+        str(tmp_path / 'id1_rev1_status.txt'),
+        first,
+        file_name='meeting_status.txt',
+    )
+    status_writer.append(
+        'mp4\n',
+        str(tmp_path / 'id2_rev1_status.txt'),
+        second,
+        file_name='meeting_status.txt',
+    )
+    status_writer.close()
+
+    assert (
+        drive.files_by_id[first]['name']
+        == drive.files_by_id[second]['name']
+        == 'meeting_status.txt'
+    )
+    assert drive.files_by_id[first]['content'] == b'wav\n'
+    assert drive.files_by_id[second]['content'] == b'mp4\n'
+
+
+def test_retry_refreshes_the_partial_transcript_of_the_failed_attempt(transcript_path):
+    drive = FakeDriveService()
+    failed_attempt = drive.add_file(
+        'recording (incomplete).txt', 'text/plain', [FOLDER_ID], b'first'
+    )
+    status_writer = StatusWriter(drive, debounce=0, interval=0)
+    partial = PartialTranscript(
+        str(transcript_path),
+        FOLDER_ID,
+        status_writer,
+        every_segments=1,
+        file_name='recording.txt',
+        drive_id=failed_attempt,
+    )
+
+    transcript_path.write_text('first segment\n')
+    partial.segment_written()
+    status_writer.close()
+
+    assert list(drive.files_by_id) == [failed_attempt]
+    assert drive.files_by_id[failed_attempt]['name'] == 'recording.txt'
+    assert drive.files_by_id[failed_attempt]['content'] == b'first segment\n'
+    assert partial.finish() == failed_attempt
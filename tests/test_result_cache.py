@@ -0,0 +1,41 @@
+import hashlib
+import os
+
+import numpy as np
+
+from codes.asr_inference_service.result_cache import (
+    ResultCache,
+    hash_audio,
+    hashed_chunks,
+)
+
+
+def test_chunks_hashed_while_consumed_match_hash_audio():
+    waveform = np.linspace(-1, 1, 1000, dtype=np.float32)
+    chunks = [waveform[:300], waveform[300:301], waveform[301:]]
+
+    md5 = hashlib.md5()
+    passed = list(hashed_chunks(iter(chunks), md5))
+
+    assert all(a is b for a, b in zip(passed, chunks))
+    assert md5.hexdigest() == hash_audio(waveform) == hash_audio(iter(chunks))
+
+
+class EvictingCache(ResultCache):
+    """Cache whose entries are evicted by another thread right after their lookup"""
+
+    def _lookup(self, key):
+        path = super()._lookup(key)
+        if path is not None:
+            os.remove(path)
+        return path
+
+
+def test_entry_evicted_after_its_lookup_is_a_miss(tmp_path):
+    cache = EvictingCache(str(tmp_path), max_bytes=1000)
+    cache.put("a", "transcript a")
+    cache.put("b", "transcript b")
+
+    assert cache.get("a") is None
+    assert not cache.get_file("b", str(tmp_path / "b.txt"))
+    assert cache.stats()["entries"] == 0